@@ -0,0 +1,122 @@
+"""
+Times POST /dhos/v1/active/callback/message, which finds the newest open callback
+request of each patient in the request body, for 10, 1k and 50k patients. Compares the
+previous query, a plain IN list with an unordered DISTINCT ON, against the current one
+that binds the UUIDs as one array and ranks each patient's callbacks.
+
+Runs against the Postgres database configured by the usual DATABASE_* environment
+variables, which must already be migrated (`flask db upgrade`). Seeding TRUNCATEs the
+message table, so never point this at a database you care about:
+
+    ./run_local.sh db upgrade
+    source <(grep ^export run_local.sh)
+    python -m benchmarks.active_callbacks --patients 50000
+"""
+import argparse
+import statistics
+import time
+from typing import Callable, Dict, List
+
+from flask_batteries_included.sqldb import db
+
+from benchmarks.clinician_query_strategy import UUID_SQL
+from dhos_messages_api.app import create_app
+from dhos_messages_api.blueprint_api import controller
+from dhos_messages_api.models.message import Message, open_callback_filter
+
+
+def seed(patients: int) -> None:
+    print(f"Seeding callbacks for {patients} patients...")
+    db.session.execute("TRUNCATE message")
+    # Three messages per patient: two open callbacks, of which the newer should be
+    # returned, and a confirmed one.
+    db.session.execute(
+        f"""
+        INSERT INTO message (
+            uuid, created, created_by_, modified, modified_by_,
+            sender, sender_type, receiver, receiver_type, content, message_type_id,
+            confirmed
+        )
+        SELECT
+            gen_random_uuid()::text, now() - k * interval '1 hour', 'benchmark',
+            now() - k * interval '1 hour', 'benchmark',
+            {UUID_SQL.format(kind="patient", n="n")}, 'patient',
+            {UUID_SQL.format(kind="location", n="n % 50")}, 'location',
+            'benchmark callback', 5,
+            CASE WHEN k = 2 THEN now() END
+        FROM generate_series(1, :patients) AS n, generate_series(0, 2) AS k
+        """,
+        {"patients": patients},
+    )
+    db.session.execute("ANALYZE message")
+    db.session.commit()
+
+
+def previous(patient_list: List[str]) -> Dict:
+    messages = Message.query.filter(
+        open_callback_filter() & (Message.sender.in_(patient_list))
+    ).distinct(Message.sender)
+    return {message.sender: message.to_dict() for message in messages}
+
+
+def benchmark(
+    lookup: Callable[[List[str]], Dict], patient_list: List[str], repeat: int
+) -> Dict[str, float]:
+    timings: List[float] = []
+    count = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = len(lookup(patient_list))
+        timings.append((time.perf_counter() - start) * 1000)
+        db.session.expunge_all()
+    return {
+        "callbacks": count,
+        "median_ms": statistics.median(timings),
+        "min_ms": min(timings),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--patients", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--no-seed", action="store_true", help="Reuse the existing message table"
+    )
+    args = parser.parse_args()
+
+    app = create_app(use_pgsql=True)
+    with app.app_context():
+        if not args.no_seed:
+            seed(args.patients)
+        all_patients: List[str] = [
+            uuid
+            for (uuid,) in db.session.execute(
+                f"""
+                SELECT {UUID_SQL.format(kind="patient", n="n")}
+                FROM generate_series(1, :patients) AS n
+                """,
+                {"patients": args.patients},
+            )
+        ]
+        results = {}
+        for size in (10, 1000, 50_000):
+            patient_list = all_patients[:size]
+            for name, lookup in (
+                ("previous", previous),
+                ("current", controller.get_active_callback_messages_for_patients),
+            ):
+                results[f"{name} {len(patient_list)}"] = benchmark(
+                    lookup, patient_list, args.repeat
+                )
+
+    print()
+    for name, result in results.items():
+        print(
+            f"{name:>16}: {result['callbacks']} callbacks, "
+            f"median {result['median_ms']:.2f}ms, min {result['min_ms']:.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
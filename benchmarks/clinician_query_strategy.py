@@ -0,0 +1,133 @@
+"""
+Compares the CLINICIAN_QUERY_STRATEGY options for a clinician fetching a patient's
+messages through GET /dhos/v1/sender_or_receiver/<unique_id>/message.
+
+Runs against the Postgres database configured by the usual DATABASE_* environment
+variables, which must already be migrated (`flask db upgrade`). Seeding TRUNCATEs the
+message table, so never point this at a database you care about:
+
+    ./run_local.sh db upgrade
+    source <(grep ^export run_local.sh)
+    python -m benchmarks.clinician_query_strategy --rows 1000000
+"""
+import argparse
+import statistics
+import time
+from typing import Dict, List
+
+from flask import Flask, g
+from flask_batteries_included.sqldb import db
+
+from dhos_messages_api.app import create_app
+from dhos_messages_api.blueprint_api import controller
+
+PATIENTS = 20000
+CLINICIANS = 500
+LOCATIONS = 50
+
+# Deterministic UUID text for the n-th participant of a kind, usable from SQL and Python.
+UUID_SQL = "md5('{kind}' || {n})::uuid::text"
+
+
+def participant(kind: str, n: int) -> str:
+    return db.session.execute(f"SELECT {UUID_SQL.format(kind=kind, n=n)}").scalar()
+
+
+def seed(rows: int) -> None:
+    print(f"Seeding {rows} messages...")
+    db.session.execute("TRUNCATE message")
+    # Each message is between a patient and either a clinician or a location, in either
+    # direction, which is the mix the clinician-scoped query has to pick through.
+    db.session.execute(
+        f"""
+        INSERT INTO message (
+            uuid, created, created_by_, modified, modified_by_,
+            sender, sender_type, receiver, receiver_type, content, message_type_id
+        )
+        SELECT
+            gen_random_uuid()::text, now() - n * interval '1 second', 'benchmark',
+            now() - n * interval '1 second', 'benchmark',
+            CASE WHEN (n / {PATIENTS}) % 2 = 0 THEN patient ELSE other END,
+            CASE WHEN (n / {PATIENTS}) % 2 = 0 THEN 'patient' ELSE other_type END,
+            CASE WHEN (n / {PATIENTS}) % 2 = 0 THEN other ELSE patient END,
+            CASE WHEN (n / {PATIENTS}) % 2 = 0 THEN other_type ELSE 'patient' END,
+            'benchmark message', 0
+        FROM (
+            SELECT
+                n,
+                {UUID_SQL.format(kind="patient", n=f"n % {PATIENTS}")} AS patient,
+                CASE WHEN n % 3 = 0
+                    THEN {UUID_SQL.format(kind="location", n=f"n % {LOCATIONS}")}
+                    ELSE {UUID_SQL.format(kind="clinician", n=f"n % {CLINICIANS}")}
+                END AS other,
+                CASE WHEN n % 3 = 0 THEN 'location' ELSE 'clinician' END AS other_type
+            FROM generate_series(1, :rows) AS n
+        ) AS seed
+        """,
+        {"rows": rows},
+    )
+    db.session.execute("ANALYZE message")
+    db.session.commit()
+
+
+def benchmark(app: Flask, strategy: str, repeat: int) -> Dict[str, float]:
+    app.config["CLINICIAN_QUERY_STRATEGY"] = strategy
+    locations: List[str] = [participant("location", n) for n in range(5)]
+    with app.test_request_context(headers={"X-Location-Ids": ",".join(locations)}):
+        g.jwt_claims = {"clinician_id": participant("clinician", 1)}
+        query = controller.get_messages_by_sender_uuid_or_receiver_uuid(
+            participant("patient", 1)
+        )
+
+        sql = str(
+            query.statement.compile(
+                dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}
+            )
+        )
+        plan = db.session.execute(f"EXPLAIN (ANALYZE, COSTS OFF) {sql}").fetchall()
+        print(f"\n{strategy}:")
+        print("\n".join(f"  {row[0]}" for row in plan))
+
+        timings: List[float] = []
+        count = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            count = len(query.all())
+            timings.append((time.perf_counter() - start) * 1000)
+            db.session.expunge_all()
+
+    return {
+        "messages": count,
+        "median_ms": statistics.median(timings),
+        "min_ms": min(timings),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument(
+        "--no-seed", action="store_true", help="Reuse the existing message table"
+    )
+    args = parser.parse_args()
+
+    app = create_app(use_pgsql=True)
+    with app.app_context():
+        if not args.no_seed:
+            seed(args.rows)
+        results = {
+            strategy: benchmark(app, strategy, args.repeat)
+            for strategy in ("or", "union")
+        }
+
+    print()
+    for strategy, result in results.items():
+        print(
+            f"{strategy:>6}: {result['messages']} messages, "
+            f"median {result['median_ms']:.2f}ms, min {result['min_ms']:.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
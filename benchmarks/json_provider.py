@@ -0,0 +1,71 @@
+"""
+Compares the default JSON provider with the orjson provider (FAST_JSON) for encoding
+one receiver's message list, as GET /dhos/v1/receiver/<receiver_id>/message does with
+the "orm" serialiser.
+
+Messages are loaded once and only the jsonify() step is timed. Seeds an in-memory
+SQLite database, so needs no setup beyond the `fast-json` extra:
+
+    python -m benchmarks.json_provider --rows 10000
+"""
+import argparse
+import statistics
+import time
+from typing import Dict, List
+
+import flask
+from flask import Flask, g
+from flask.json.provider import DefaultJSONProvider
+
+from benchmarks.list_serialisers import RECEIVER, seed
+from dhos_messages_api.app import create_app
+from dhos_messages_api.blueprint_api import controller
+from dhos_messages_api.helper.json_provider import OrjsonProvider
+
+
+def benchmark(app: Flask, messages: List[Dict], repeat: int) -> Dict[str, float]:
+    timings: List[float] = []
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body: bytes = flask.jsonify(messages).get_data()
+        timings.append((time.perf_counter() - start) * 1000)
+        size = len(body)
+    return {
+        "bytes": size,
+        "median_ms": statistics.median(timings),
+        "min_ms": min(timings),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    app = create_app(testing=True, use_pgsql=False, use_sqlite=True)
+    with app.app_context():
+        seed(args.rows)
+        with app.test_request_context():
+            g.jwt_claims = {"clinician_id": RECEIVER}
+            query = controller.get_messages_by_receiver_uuid(RECEIVER)
+            messages, _ = controller.get_message_page(query)
+            results = {}
+            for name, provider in (
+                ("default", DefaultJSONProvider(app)),
+                ("orjson", OrjsonProvider(app)),
+            ):
+                app.json = provider
+                results[name] = benchmark(app, messages, args.repeat)
+
+    print()
+    for name, result in results.items():
+        print(
+            f"{name:>8}: {result['bytes']} bytes, "
+            f"median {result['median_ms']:.2f}ms, min {result['min_ms']:.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
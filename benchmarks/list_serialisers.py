@@ -0,0 +1,121 @@
+"""
+Compares the MESSAGES_SERIALISER options for serialising one receiver's message list,
+as GET /dhos/v1/receiver/<receiver_id>/message does.
+
+Runs against the Postgres database configured by the usual DATABASE_* environment
+variables, which must already be migrated (`flask db upgrade`), or against an
+in-memory SQLite database with --sqlite (where "postgres" falls back to "core").
+Seeding TRUNCATEs the message table, so never point this at a database you care about:
+
+    ./run_local.sh db upgrade
+    source <(grep ^export run_local.sh)
+    python benchmarks/list_serialisers.py --rows 10000
+"""
+import argparse
+import statistics
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import flask
+from flask import Flask, g
+from flask_batteries_included.sqldb import db, generate_uuid
+
+from dhos_messages_api.app import create_app
+from dhos_messages_api.blueprint_api import controller
+from dhos_messages_api.models.message import Message
+from dhos_messages_api.models.message_type import MessageType
+from dhos_messages_api.query.serialiser import message_encoder
+
+RECEIVER = "4c4f1d24-2952-4d4e-b1d1-3637e33cc161"
+SENDER = "5c4f1d24-2952-4d4e-b1d1-3637e33cc161"
+
+
+def seed(rows: int) -> None:
+    print(f"Seeding {rows} messages...")
+    db.session.execute(Message.__table__.delete())
+    if MessageType.query.filter_by(value=1).first() is None:
+        db.session.add(MessageType(uuid="DHOS-MESSAGES-DOSAGE", value=1))
+    now = datetime.utcnow()
+    db.session.execute(
+        Message.__table__.insert(),
+        [
+            {
+                "uuid": generate_uuid(),
+                "created": now - timedelta(seconds=n),
+                "created_by_": "benchmark",
+                "modified": now - timedelta(seconds=n),
+                "modified_by_": "benchmark",
+                "sender": SENDER,
+                "sender_type": "patient",
+                "receiver": RECEIVER,
+                "receiver_type": "clinician",
+                "content": f"benchmark message {n}",
+                "message_type_id": 1,
+                "confirmed": now if n % 2 else None,
+                "confirmed_tz": 3600 if n % 2 else None,
+            }
+            for n in range(rows)
+        ],
+    )
+    db.session.commit()
+
+
+def benchmark(app: Flask, serialiser: str, repeat: int) -> Dict[str, float]:
+    with app.test_request_context():
+        g.jwt_claims = {"clinician_id": RECEIVER}
+        query = controller.get_messages_by_receiver_uuid(RECEIVER)
+
+        timings: List[float] = []
+        size = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            encoder = message_encoder(serialiser)
+            if encoder is None:
+                messages, _ = controller.get_message_page(query)
+                body: bytes = flask.jsonify(messages).get_data()
+            else:
+                body, _ = controller.get_encoded_message_page(query, encoder)
+            timings.append((time.perf_counter() - start) * 1000)
+            size = len(body)
+            db.session.expunge_all()
+
+    return {
+        "bytes": size,
+        "median_ms": statistics.median(timings),
+        "min_ms": min(timings),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--sqlite", action="store_true", help="Use in-memory SQLite")
+    parser.add_argument(
+        "--no-seed", action="store_true", help="Reuse the existing message table"
+    )
+    args = parser.parse_args()
+
+    if args.sqlite:
+        app = create_app(testing=True, use_pgsql=False, use_sqlite=True)
+    else:
+        app = create_app(use_pgsql=True)
+    with app.app_context():
+        if not args.no_seed:
+            seed(args.rows)
+        results = {
+            serialiser: benchmark(app, serialiser, args.repeat)
+            for serialiser in ("orm", "core", "postgres")
+        }
+
+    print()
+    for serialiser, result in results.items():
+        print(
+            f"{serialiser:>8}: {result['bytes']} bytes, "
+            f"median {result['median_ms']:.2f}ms, min {result['min_ms']:.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Measures the POST /dhos/v2/message path: validating a new message with the compiled
+message validator, and creating it end to end with controller.create_message.
+
+Validation is compared with the per-call schema checks it replaced, kept below as
+`legacy_build`. Seeds an in-memory SQLite database, so needs no setup:
+
+    python -m benchmarks.message_create --requests 5000
+"""
+import argparse
+import statistics
+import time
+from typing import Callable, Dict, List, Optional
+
+from flask import g
+from flask_batteries_included.config import is_production_environment
+from flask_batteries_included.sqldb import db, generate_uuid
+
+from benchmarks.list_serialisers import RECEIVER, SENDER
+from dhos_messages_api.app import create_app
+from dhos_messages_api.blueprint_api import controller
+from dhos_messages_api.helper.validation import message_validator
+from dhos_messages_api.models.message import Message
+from dhos_messages_api.models.message_type import MessageType, get_message_type
+
+MESSAGE = {
+    "sender": SENDER,
+    "sender_type": "patient",
+    "receiver": RECEIVER,
+    "receiver_type": "clinician",
+    "message_type": {"value": 1},
+    "content": "benchmark message",
+    "internal": "benchmark",
+}
+
+
+def legacy_build(message_details: Dict) -> Message:
+    insert = Message()
+    schema = Message.schema()
+
+    for sent_property in message_details:
+        if sent_property in schema["required"]:
+            continue
+        if sent_property in schema["optional"]:
+            continue
+        if sent_property in schema["builtin"] and not is_production_environment():
+            continue
+        raise KeyError("Property '{}' not found in schema".format(sent_property))
+
+    for required_property in schema["required"]:
+        if (
+            required_property not in message_details
+            or message_details[required_property] is None
+            or len(str(message_details[required_property])) == 0
+        ):
+            raise KeyError(
+                "Property '{}' must contain a valid value".format(required_property)
+            )
+
+    message_type_id: Optional[int] = None
+    for sent_property in message_details:
+        if len(message_details[sent_property]) == 0:
+            raise KeyError(
+                "Empty fields should not be sent, property '{}' is empty".format(
+                    sent_property
+                )
+            )
+        if sent_property == "message_type":
+            if get_message_type(message_details[sent_property]["value"]):
+                message_type_id = message_details[sent_property]["value"]
+            else:
+                raise KeyError(
+                    "Property 'message_type' must contain a valid value, {} received".format(
+                        message_details[sent_property]["value"]
+                    )
+                )
+        else:
+            insert.set_property(sent_property, message_details[sent_property])
+
+    insert.uuid = generate_uuid()
+    insert.message_type_id = message_type_id
+    return insert
+
+
+def benchmark(call: Callable[[], object], requests: int) -> Dict[str, float]:
+    timings: List[float] = []
+    start = time.perf_counter()
+    for _ in range(requests):
+        call_start = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - call_start) * 1_000_000)
+    elapsed = time.perf_counter() - start
+    return {
+        "per_second": requests / elapsed,
+        "median_us": statistics.median(timings),
+        "p99_us": statistics.quantiles(timings, n=100)[98],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    app = create_app(testing=True, use_pgsql=False, use_sqlite=True)
+    with app.app_context():
+        db.session.add(MessageType(uuid="DHOS-MESSAGES-DOSAGE", value=1))
+        db.session.commit()
+        with app.test_request_context():
+            g.jwt_claims = {"patient_id": SENDER}
+            results = {
+                "legacy validate": benchmark(
+                    lambda: legacy_build(MESSAGE), args.requests
+                ),
+                "validate": benchmark(
+                    lambda: message_validator().build(MESSAGE), args.requests
+                ),
+                "create": benchmark(
+                    lambda: controller.create_message(MESSAGE), args.requests
+                ),
+            }
+
+    print()
+    for name, result in results.items():
+        print(
+            f"{name:>16}: {result['per_second']:.0f}/s, "
+            f"median {result['median_us']:.1f}us, p99 {result['p99_us']:.1f}us"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,11 @@ from dhos_messages_api.blueprint_api import api_blueprint
 from dhos_messages_api.blueprint_development import development_blueprint
 from dhos_messages_api.config import init_config
 from dhos_messages_api.helper.cli import add_cli_command
+from dhos_messages_api.helper.json_provider import init_json_provider
+from dhos_messages_api.helper.notifications import init_notifications
+from dhos_messages_api.helper.response_cache import init_response_cache
+from dhos_messages_api.helper.validation import init_message_validator
+from dhos_messages_api.models.message import forget_loaded_messages
 
 
 def create_app(
@@ -36,11 +41,18 @@ def create_app(
     )
 
     init_config(app)
+    init_json_provider(app)
+    init_message_validator(app)
+    init_response_cache(app)
+    init_notifications(app)
 
     # Register the API blueprint.
     app.register_blueprint(api_blueprint)
     app.logger.info("Registered API blueprint")
 
+    # Messages loaded by UUID are memoised for the rest of the request.
+    app.teardown_request(forget_loaded_messages)
+
     # Configure the SQL database
     init_db(app=app, testing=testing)
 
@@ -1,6 +1,13 @@
+import hashlib
+import json
+from datetime import datetime
+from functools import partial
+from typing import Callable, Dict, List, Optional
+
 import connexion
 import flask
 from flask import Response
+from flask_batteries_included.helpers.request_arg import RequestArg
 from flask_batteries_included.helpers.routes import deprecated_route
 from flask_batteries_included.helpers.security import protected_route
 from flask_batteries_included.helpers.security.endpoint_security import (
@@ -9,19 +16,147 @@ from flask_batteries_included.helpers.security.endpoint_security import (
     scopes_present,
 )
 from marshmallow import RAISE
+from sqlalchemy.orm import Query
 
 from dhos_messages_api.blueprint_api import controller
+from dhos_messages_api.helper.response_cache import cached_response, caller_fingerprint
 from dhos_messages_api.helper.security import (
     create_message_protection,
+    create_message_protection_base,
     message_by_id_protection,
+    message_list_protection,
+    receiver_list_protection,
     sender_or_receiver_protection,
     sender_receiver_protection,
 )
-from dhos_messages_api.models.api_spec import MessagePatchRequest
+from dhos_messages_api.models.api_spec import (
+    MessageBulkPatchRequest,
+    MessagePatchRequest,
+    MessageRetrievedRequest,
+)
+from dhos_messages_api.query.serialiser import MessageEncoder, message_encoder
 
 api_blueprint = flask.Blueprint("messages", __name__)
 
 
+def _include_archived(messages: Query) -> Query:
+    if RequestArg.boolean("include_archived"):
+        return controller.include_archived_messages(messages)
+    return messages
+
+
+def _return_minimal() -> bool:
+    """
+    Whether the request has a `Prefer: return=minimal` header (RFC 7240).
+    """
+    for preference in flask.request.headers.get("Prefer", "").split(","):
+        token: str = preference.split(";", 1)[0]
+        if token.replace(" ", "").lower() == "return=minimal":
+            return True
+    return False
+
+
+def _minimal_response() -> Response:
+    response = Response(status=204)
+    response.headers["Preference-Applied"] = "return=minimal"
+    return response
+
+
+def _etag(count: int, last_modified: Optional[datetime]) -> str:
+    """
+    A strong ETag for a response built from `count` messages, the latest modified at
+    `last_modified`, for the current URL and caller.
+    """
+    version = json.dumps(
+        [
+            flask.request.path,
+            count,
+            last_modified.isoformat() if last_modified is not None else None,
+            caller_fingerprint(),
+        ]
+    )
+    return hashlib.sha1(version.encode(), usedforsecurity=False).hexdigest()
+
+
+def _not_modified(etag: str) -> Optional[Response]:
+    """
+    A 304 response if the request's If-None-Match matches the ETag.
+    """
+    if not flask.request.if_none_match.contains(etag):
+        return None
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def _message_serialiser() -> str:
+    """
+    The serialiser configured for the current endpoint.
+    """
+    config = flask.current_app.config
+    endpoint: str = (flask.request.endpoint or "").rsplit(".", 1)[-1]
+    return config["MESSAGES_SERIALISER_ENDPOINTS"].get(
+        endpoint, config["MESSAGES_SERIALISER"]
+    )
+
+
+def _message_list_response(messages: Query, conditional: bool = False) -> Response:
+    """
+    Responds with a list of messages. If `conditional` is set the response has an ETag
+    and a matching If-None-Match is answered with 304, which costs a single aggregate
+    query.
+    """
+    etag: Optional[str] = None
+    if conditional:
+        etag = _etag(*controller.get_message_list_version(messages))
+        not_modified: Optional[Response] = _not_modified(etag)
+        if not_modified is not None:
+            return not_modified
+
+    limit: Optional[int] = RequestArg.integer("limit")
+    cursor: Optional[str] = RequestArg.string("cursor")
+    fields_arg: Optional[str] = RequestArg.string("fields")
+    fields: Optional[List[str]] = None
+    if fields_arg is not None:
+        fields = [field.strip() for field in fields_arg.split(",")]
+
+    encoder: Optional[MessageEncoder] = message_encoder(_message_serialiser(), fields)
+    if encoder is None and fields is not None:
+        messages = controller.select_message_fields(messages, fields)
+
+    response: Response
+    next_cursor: Optional[str] = None
+    if (
+        limit is None
+        and cursor is None
+        and flask.current_app.config["STREAM_LIST_RESPONSES"]
+    ):
+        # Direct passthrough hands the generator straight to the WSGI server. It also
+        # stops the ETag hook from buffering the body to hash it.
+        response = Response(
+            flask.stream_with_context(
+                controller.stream_message_list(messages, fields=fields, encoder=encoder)
+            ),
+            mimetype="application/json",
+            direct_passthrough=True,
+        )
+    elif encoder is None:
+        message_list, next_cursor = controller.get_message_page(
+            messages, limit=limit, cursor=cursor, fields=fields
+        )
+        response = flask.jsonify(message_list)
+    else:
+        body, next_cursor = controller.get_encoded_message_page(
+            messages, encoder, limit=limit, cursor=cursor
+        )
+        response = Response(body, mimetype="application/json")
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    if etag is not None:
+        response.set_etag(etag)
+    return response
+
+
 @api_blueprint.route("/dhos/v1/message", methods=["POST"])
 @protected_route(
     or_(
@@ -48,6 +183,13 @@ def create_message_v1() -> Response:
             type: string
             example: '09db61d2-2ad9-4878-beee-1225b720c205,5d68b104-38cb-48fe-a814-00ac1387ef17'
           required: false
+        - in: header
+          name: Prefer
+          description: Send return=minimal for an empty 204 response
+          schema:
+            type: string
+            example: 'return=minimal'
+          required: false
       requestBody:
         description: JSON body containing the message
         required: true
@@ -60,6 +202,8 @@ def create_message_v1() -> Response:
           content:
             application/json:
               schema: MessageResponse
+        '204':
+          description: The message was created and return=minimal was preferred
         default:
           description: >-
               Error, e.g. 400 Bad Request, 404 Not Found, 503 Service Unavailable
@@ -68,6 +212,9 @@ def create_message_v1() -> Response:
               schema: Error
     """
     message_details = connexion.request.get_json()
+    if _return_minimal():
+        controller.create_message_minimal(message_details=message_details)
+        return _minimal_response()
     response = controller.create_message(message_details=message_details)
     return flask.jsonify(response)
 
@@ -96,6 +243,13 @@ def create_message() -> Response:
             type: string
             example: '09db61d2-2ad9-4878-beee-1225b720c205,5d68b104-38cb-48fe-a814-00ac1387ef17'
           required: false
+        - in: header
+          name: Prefer
+          description: Send return=minimal for an empty 204 response
+          schema:
+            type: string
+            example: 'return=minimal'
+          required: false
       requestBody:
         description: JSON body containing the message
         required: true
@@ -108,6 +262,8 @@ def create_message() -> Response:
           content:
             application/json:
               schema: MessageResponse
+        '204':
+          description: The message was created and return=minimal was preferred
         default:
           description: >-
               Error, e.g. 400 Bad Request, 404 Not Found, 503 Service Unavailable
@@ -116,10 +272,69 @@ def create_message() -> Response:
               schema: Error
     """
     message_details = connexion.request.get_json()
+    if _return_minimal():
+        controller.create_message_minimal(message_details=message_details)
+        return _minimal_response()
     response = controller.create_message(message_details=message_details)
     return flask.jsonify(response)
 
 
+@api_blueprint.route("/dhos/v2/message/batch", methods=["POST"])
+@protected_route(
+    or_(
+        scopes_present(required_scopes="write:gdm_message_all"),
+        scopes_present(required_scopes="write:gdm_message"),
+    )
+)
+def create_messages() -> Response:
+    """---
+    post:
+      summary: Create new messages
+      description: >-
+        Create a batch of messages, each as POST /dhos/v2/message would. Messages that are
+        invalid, or that the caller may not send, are reported and the rest are created.
+        Results are returned in the order the messages were sent.
+      tags: [message]
+      parameters:
+        - in: header
+          name: X-Location-Ids
+          description: List of location UUIDs, only used for clinicians
+          schema:
+            type: string
+            example: '09db61d2-2ad9-4878-beee-1225b720c205,5d68b104-38cb-48fe-a814-00ac1387ef17'
+          required: false
+      requestBody:
+        description: JSON body containing the list of messages, each a MessageRequest
+        required: true
+        content:
+          application/json:
+            schema:
+              type: array
+              items:
+                type: object
+      responses:
+        '200':
+          description: The result for each message, in the order sent
+          content:
+            application/json:
+              schema:
+                type: array
+                items: MessageBatchResult
+        default:
+          description: >-
+              Error, e.g. 400 Bad Request, 404 Not Found, 503 Service Unavailable
+          content:
+            application/json:
+              schema: Error
+    """
+    messages_details = connexion.request.get_json()
+    is_allowed: Optional[Callable[[Dict], bool]] = None
+    if "write:gdm_message_all" not in flask.g.jwt_scopes:
+        is_allowed = partial(create_message_protection_base, flask.g.jwt_claims)
+    response = controller.create_messages(messages_details, is_allowed=is_allowed)
+    return flask.jsonify(response)
+
+
 @api_blueprint.route("/dhos/v1/message/<message_id>", methods=["GET"])
 @protected_route(
     or_(
@@ -151,12 +366,82 @@ def get_message_by_uuid(message_id: str) -> Response:
             type: string
             example: '09db61d2-2ad9-4878-beee-1225b720c205,5d68b104-38cb-48fe-a814-00ac1387ef17'
           required: false
+        - in: header
+          name: If-None-Match
+          description: ETag of a previous response, to get 304 Not Modified if it is unchanged
+          schema:
+            type: string
+            example: '"3f786850e387550fdab836ed7e6dc881de23001b"'
+          required: false
       responses:
         '200':
           description: The message
           content:
             application/json:
               schema: MessageResponse
+        '304':
+          description: Not modified since the response with the ETag given
+        default:
+          description: >-
+              Error, e.g. 400 Bad Request, 404 Not Found, 503 Service Unavailable
+          content:
+            application/json:
+              schema: Error
+    """
+    etag: str = _etag(*controller.get_message_version(message_id))
+    not_modified: Optional[Response] = _not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+    response: Response = flask.jsonify(controller.get_message_by_uuid(message_id))
+    response.set_etag(etag)
+    return response
+
+
+@api_blueprint.route("/dhos/v1/message/<message_id>/thread", methods=["GET"])
+@protected_route(
+    or_(
+        scopes_present(required_scopes="read:gdm_message_all"),
+        and_(
+            scopes_present(required_scopes="read:gdm_message"), message_by_id_protection
+        ),
+    )
+)
+def get_message_thread(message_id: str) -> Response:
+    """
+    ---
+    get:
+      summary: Get message thread
+      description: >-
+        Get every message in the reply chain containing the message with the UUID provided in
+        the URL path, following `related_message` up to the first message of the thread and then
+        down through all replies to it.
+
+        Consumers of this endpoint who do not have the `read:gdm_message_all` permission will only
+        retrieve the messages in the thread that they sent or received.
+      tags: [message]
+      parameters:
+        - name: message_id
+          in: path
+          required: true
+          description: The UUID of any message in the thread
+          schema:
+            type: string
+            example: '18439f36-ffa9-42ae-90de-0beda299cd37'
+        - in: header
+          name: X-Location-Ids
+          description: List of location UUIDs, only used for clinicians
+          schema:
+            type: string
+            example: '09db61d2-2ad9-4878-beee-1225b720c205,5d68b104-38cb-48fe-a814-00ac1387ef17'
+          required: false
+      responses:
+        '200':
+          description: The messages in the thread, oldest first
+          content:
+            application/json:
+              schema:
+                type: array
+                items: MessageResponse
         default:
           description: >-
               Error, e.g. 400 Bad Request, 404 Not Found, 503 Service Unavailable
@@ -164,7 +449,7 @@ def get_message_by_uuid(message_id: str) -> Response:
             application/json:
               schema: Error
     """
-    return flask.jsonify(controller.get_message_by_uuid(message_id))
+    return flask.jsonify(controller.get_message_thread(message_id))
 
 
 @api_blueprint.route("/dhos/v1/message/<message_id>", methods=["PATCH"])
@@ -201,6 +486,13 @@ def update_message(message_id: str) -> Response:
             type: string
             example: '09db61d2-2ad9-4878-beee-1225b720c205,5d68b104-38cb-48fe-a814-00ac1387ef17'
           required: false
+        - in: header
+          name: Prefer
+          description: Send return=minimal for an empty 204 response
+          schema:
+            type: string
+            example: 'return=minimal'
+          required: false
       requestBody:
         description: JSON body containing the message
         required: true
@@ -213,6 +505,8 @@ def update_message(message_id: str) -> Response:
           content:
             application/json:
               schema: MessageResponse
+        '204':
+          description: The message was updated and return=minimal was preferred
         default:
           description: >-
               Error, e.g. 400 Bad Request, 404 Not Found, 503 Service Unavailable
@@ -224,10 +518,269 @@ def update_message(message_id: str) -> Response:
         connexion.request.get_json(), unknown=RAISE
     )
 
-    return flask.jsonify(controller.update_message(message_id, message_details))
-
+    if _return_minimal():
+        controller.update_message_minimal(message_id, message_details)
+        return _minimal_response()
+    return flask.jsonify(controller.update_message(message_id, message_details))
+
+
+@api_blueprint.route("/dhos/v1/message", methods=["PATCH"])
+@protected_route(
+    or_(
+        scopes_present(required_scopes="write:gdm_message_all"),
+        and_(
+            scopes_present(required_scopes="write:gdm_message"),
+            message_list_protection,
+        ),
+    )
+)
+def update_messages() -> Response:
+    """
+    ---
+    patch:
+      summary: Update messages
+      description: >-
+        Update many messages at once, e.g. to mark a conversation as retrieved or confirmed.
+        Each item in the request body gives the UUID of a message and the fields to update,
+        as for PATCH /dhos/v1/message/{message_id}. Either every message is updated or none is.
+      tags: [message]
+      parameters:
+        - in: header
+          name: X-Location-Ids
+          description: List of location UUIDs, only used for clinicians
+          schema:
+            type: string
+            example: '09db61d2-2ad9-4878-beee-1225b720c205,5d68b104-38cb-48fe-a814-00ac1387ef17'
+          required: false
+      requestBody:
+        description: JSON body containing the list of updates
+        required: true
+        content:
+          application/json:
+            schema:
+              type: array
+              items: MessageBulkPatchRequest
+      responses:
+        '200':
+          description: The updated messages, in the order requested
+          content:
+            application/json:
+              schema:
+                type: array
+                items: MessageResponse
+        default:
+          description: >-
+              Error, e.g. 400 Bad Request, 404 Not Found, 503 Service Unavailable
+          content:
+            application/json:
+              schema: Error
+    """
+    updates = MessageBulkPatchRequest(many=True).load(
+        connexion.request.get_json(), unknown=RAISE
+    )
+
+    return flask.jsonify(controller.update_messages(updates))
+
+
+@api_blueprint.route("/dhos/v1/sender/<sender_id>/message", methods=["GET"])
+@protected_route(
+    or_(
+        scopes_present(required_scopes="read:gdm_message_all"),
+        and_(
+            scopes_present(required_scopes="read:gdm_message"),
+            sender_receiver_protection,
+        ),
+    )
+)
+@cached_response("sender_id")
+def get_messages_by_sender_uuid(sender_id: str) -> Response:
+    """
+    ---
+    get:
+      summary: Get messages by sender
+      description: Get a list of messages sent by the sender UUID provided in the URL path.
+      tags: [message]
+      parameters:
+        - name: sender_id
+          in: path
+          required: true
+          description: The sender UUID
+          schema:
+            type: string
+            example: '18439f36-ffa9-42ae-90de-0beda299cd37'
+        - in: header
+          name: X-Location-Ids
+          description: List of location UUIDs, only used for clinicians
+          schema:
+            type: string
+            example: '09db61d2-2ad9-4878-beee-1225b720c205,5d68b104-38cb-48fe-a814-00ac1387ef17'
+          required: false
+        - name: limit
+          in: query
+          required: false
+          description: >-
+            Opt-in pagination: the maximum number of messages to return, newest first. Values
+            above the server's maximum page size are reduced to that maximum.
+          schema:
+            type: integer
+            minimum: 1
+            example: 100
+        - name: cursor
+          in: query
+          required: false
+          description: >-
+            Opaque continuation token taken from the X-Next-Cursor header of the previous page
+          schema:
+            type: string
+            example: 'WyIyMDIwLTAxLTAxVDAwOjAwOjAwIiwiMTg0MzlmMzYiXQ'
+        - name: fields
+          in: query
+          required: false
+          description: >-
+            Comma-separated list of message fields to include in the response. Only the columns
+            needed for those fields are read from the database. Defaults to all fields.
+          schema:
+            type: string
+            example: 'uuid,sender,created,confirmed'
+        - name: include_archived
+          in: query
+          required: false
+          description: >-
+            Also return settled messages that have been moved to the archive. Defaults to false.
+          schema:
+            type: boolean
+            example: true
+      responses:
+        '200':
+          description: A list of messages sent by the sender
+          headers:
+            X-Next-Cursor:
+              description: >-
+                Continuation token for the next page of messages, only present when the response
+                was paginated and more messages are available
+              schema:
+                type: string
+          content:
+            application/json:
+              schema:
+                type: array
+                items: MessageResponse
+        default:
+          description: >-
+              Error, e.g. 400 Bad Request, 404 Not Found, 503 Service Unavailable
+          content:
+            application/json:
+              schema: Error
+    """
+    return _message_list_response(
+        _include_archived(controller.get_messages_by_sender_uuid(sender_id))
+    )
+
+
+@api_blueprint.route("/dhos/v1/receiver/<receiver_id>/message", methods=["GET"])
+@protected_route(
+    or_(
+        scopes_present(required_scopes="read:gdm_message_all"),
+        and_(
+            scopes_present(required_scopes="read:gdm_message"),
+            sender_receiver_protection,
+        ),
+    )
+)
+@cached_response("receiver_id")
+def get_messages_by_receiver_uuid(receiver_id: str) -> Response:
+    """
+    ---
+    get:
+      summary: Get messages by receiver
+      description: >-
+        Get a list of messages received by the receiver UUID provided in the URL path.
+
+        Consumers of this endpoint who have the `read:gdm_message_all` permission will retrieve all
+        messages received by the receiver.
+
+        For all other consumers, this endpoint will only retrieve messages where the consumer of the
+        endpoint is themselves the receiver - i.e. their JWT claims will need to show them as having
+        the UUID that is passed in as the receiver_id parameter.
+      tags: [message]
+      parameters:
+        - name: receiver_id
+          in: path
+          required: true
+          description: The receiver UUID
+          schema:
+            type: string
+            example: '18439f36-ffa9-42ae-90de-0beda299cd37'
+        - in: header
+          name: X-Location-Ids
+          description: List of location UUIDs, only used for clinicians
+          schema:
+            type: string
+            example: '09db61d2-2ad9-4878-beee-1225b720c205,5d68b104-38cb-48fe-a814-00ac1387ef17'
+          required: false
+        - name: limit
+          in: query
+          required: false
+          description: >-
+            Opt-in pagination: the maximum number of messages to return, newest first. Values
+            above the server's maximum page size are reduced to that maximum.
+          schema:
+            type: integer
+            minimum: 1
+            example: 100
+        - name: cursor
+          in: query
+          required: false
+          description: >-
+            Opaque continuation token taken from the X-Next-Cursor header of the previous page
+          schema:
+            type: string
+            example: 'WyIyMDIwLTAxLTAxVDAwOjAwOjAwIiwiMTg0MzlmMzYiXQ'
+        - name: fields
+          in: query
+          required: false
+          description: >-
+            Comma-separated list of message fields to include in the response. Only the columns
+            needed for those fields are read from the database. Defaults to all fields.
+          schema:
+            type: string
+            example: 'uuid,sender,created,confirmed'
+        - name: include_archived
+          in: query
+          required: false
+          description: >-
+            Also return settled messages that have been moved to the archive. Defaults to false.
+          schema:
+            type: boolean
+            example: true
+      responses:
+        '200':
+          description: A list of messages received by the receiver
+          headers:
+            X-Next-Cursor:
+              description: >-
+                Continuation token for the next page of messages, only present when the response
+                was paginated and more messages are available
+              schema:
+                type: string
+          content:
+            application/json:
+              schema:
+                type: array
+                items: MessageResponse
+        default:
+          description: >-
+              Error, e.g. 400 Bad Request, 404 Not Found, 503 Service Unavailable
+          content:
+            application/json:
+              schema: Error
+    """
+    return _message_list_response(
+        _include_archived(controller.get_messages_by_receiver_uuid(receiver_id))
+    )
+
 
-@api_blueprint.route("/dhos/v1/sender/<sender_id>/message", methods=["GET"])
+@api_blueprint.route("/dhos/v1/receiver/<receiver_id>/message/sync", methods=["GET"])
 @protected_route(
     or_(
         scopes_present(required_scopes="read:gdm_message_all"),
@@ -237,21 +790,54 @@ def update_message(message_id: str) -> Response:
         ),
     )
 )
-def get_messages_by_sender_uuid(sender_id: str) -> Response:
+def get_messages_changed_since(receiver_id: str) -> Response:
     """
     ---
     get:
-      summary: Get messages by sender
-      description: Get a list of messages sent by the sender UUID provided in the URL path.
+      summary: Sync messages by receiver
+      description: >-
+        Get the messages received by the receiver UUID provided in the URL path that have been
+        created or modified since the `since` watermark, along with the messages that have been
+        deleted since then. The response includes the watermark to pass on the next call.
+
+        Without a watermark, all of the receiver's messages are returned.
+
+        Changes made shortly before the watermark are returned again, so that none are missed
+        when transactions commit out of order. Clients must de-duplicate messages and
+        tombstones by UUID.
+
+        With a watermark and `wait`, if nothing has changed the request waits up to `wait`
+        seconds for one of the receiver's messages to be created or updated, so that clients
+        can long-poll rather than poll. Waits are capped by the server, and `wait` is ignored
+        when the server does not have change notifications enabled. An unchanged watermark
+        means the wait ended without a change.
+
+        Access rules are the same as for getting messages by receiver.
       tags: [message]
       parameters:
-        - name: sender_id
+        - name: receiver_id
           in: path
           required: true
-          description: The sender UUID
+          description: The receiver UUID
           schema:
             type: string
             example: '18439f36-ffa9-42ae-90de-0beda299cd37'
+        - name: since
+          in: query
+          required: false
+          description: The watermark returned by the previous sync
+          schema:
+            type: string
+            example: '2018-02-11T11:59:50.123456+00:00'
+        - name: wait
+          in: query
+          required: false
+          description: >-
+            The number of seconds to wait for a change if there are none since the watermark
+          schema:
+            type: integer
+            minimum: 0
+            example: 25
         - in: header
           name: X-Location-Ids
           description: List of location UUIDs, only used for clinicians
@@ -261,12 +847,10 @@ def get_messages_by_sender_uuid(sender_id: str) -> Response:
           required: false
       responses:
         '200':
-          description: A list of messages sent by the sender
+          description: The changes since the watermark
           content:
             application/json:
-              schema:
-                type: array
-                items: MessageResponse
+              schema: MessageSyncResponse
         default:
           description: >-
               Error, e.g. 400 Bad Request, 404 Not Found, 503 Service Unavailable
@@ -274,33 +858,44 @@ def get_messages_by_sender_uuid(sender_id: str) -> Response:
             application/json:
               schema: Error
     """
-    return flask.jsonify(controller.get_messages_by_sender_uuid(sender_id))
+    since: Optional[datetime] = RequestArg.iso8601_datetime("since")
+    wait: Optional[int] = RequestArg.integer("wait")
+    if since is not None and wait:
+        max_wait: int = flask.current_app.config["MESSAGES_MAX_WAIT_SECONDS"]
+        return flask.jsonify(
+            controller.wait_for_messages_changed_since(
+                receiver_id, since=since, timeout=min(wait, max_wait)
+            )
+        )
+    return flask.jsonify(
+        controller.get_messages_changed_since(receiver_id, since=since)
+    )
 
 
-@api_blueprint.route("/dhos/v1/receiver/<receiver_id>/message", methods=["GET"])
+@api_blueprint.route(
+    "/dhos/v1/receiver/<receiver_id>/message/retrieved", methods=["POST"]
+)
 @protected_route(
     or_(
-        scopes_present(required_scopes="read:gdm_message_all"),
+        scopes_present(required_scopes="write:gdm_message_all"),
         and_(
-            scopes_present(required_scopes="read:gdm_message"),
+            scopes_present(required_scopes="write:gdm_message"),
             sender_receiver_protection,
         ),
     )
 )
-def get_messages_by_receiver_uuid(receiver_id: str) -> Response:
+def mark_messages_retrieved(receiver_id: str) -> Response:
     """
     ---
-    get:
-      summary: Get messages by receiver
+    post:
+      summary: Mark messages retrieved by receiver
       description: >-
-        Get a list of messages received by the receiver UUID provided in the URL path.
+        Mark every message received by the receiver UUID provided in the URL path, created up
+        to the `retrieved` timestamp in the request body and not already retrieved, as
+        retrieved at that time. One call acknowledges everything the receiver has read,
+        however many messages that is.
 
-        Consumers of this endpoint who have the `read:gdm_message_all` permission will retrieve all
-        messages received by the receiver.
-
-        For all other consumers, this endpoint will only retrieve messages where the consumer of the
-        endpoint is themselves the receiver - i.e. their JWT claims will need to show them as having
-        the UUID that is passed in as the receiver_id parameter.
+        Access rules are the same as for getting messages by receiver.
       tags: [message]
       parameters:
         - name: receiver_id
@@ -317,14 +912,18 @@ def get_messages_by_receiver_uuid(receiver_id: str) -> Response:
             type: string
             example: '09db61d2-2ad9-4878-beee-1225b720c205,5d68b104-38cb-48fe-a814-00ac1387ef17'
           required: false
+      requestBody:
+        description: JSON body containing the watermark
+        required: true
+        content:
+          application/json:
+            schema: MessageRetrievedRequest
       responses:
         '200':
-          description: A list of messages received by the receiver
+          description: The number of messages marked as retrieved
           content:
             application/json:
-              schema:
-                type: array
-                items: MessageResponse
+              schema: MessageRetrievedResponse
         default:
           description: >-
               Error, e.g. 400 Bad Request, 404 Not Found, 503 Service Unavailable
@@ -332,7 +931,13 @@ def get_messages_by_receiver_uuid(receiver_id: str) -> Response:
             application/json:
               schema: Error
     """
-    return flask.jsonify(controller.get_messages_by_receiver_uuid(receiver_id))
+    request = MessageRetrievedRequest().load(
+        connexion.request.get_json(), unknown=RAISE
+    )
+
+    return flask.jsonify(
+        controller.mark_messages_retrieved(receiver_id, request["retrieved"])
+    )
 
 
 @api_blueprint.route("/dhos/v1/sender/<sender_id>/active/message", methods=["GET"])
@@ -345,6 +950,7 @@ def get_messages_by_receiver_uuid(receiver_id: str) -> Response:
         ),
     )
 )
+@cached_response("sender_id")
 def get_active_messages_by_sender_uuid(sender_id: str) -> Response:
     """
     ---
@@ -367,9 +973,43 @@ def get_active_messages_by_sender_uuid(sender_id: str) -> Response:
             type: string
             example: '09db61d2-2ad9-4878-beee-1225b720c205,5d68b104-38cb-48fe-a814-00ac1387ef17'
           required: false
+        - name: limit
+          in: query
+          required: false
+          description: >-
+            Opt-in pagination: the maximum number of messages to return, newest first. Values
+            above the server's maximum page size are reduced to that maximum.
+          schema:
+            type: integer
+            minimum: 1
+            example: 100
+        - name: cursor
+          in: query
+          required: false
+          description: >-
+            Opaque continuation token taken from the X-Next-Cursor header of the previous page
+          schema:
+            type: string
+            example: 'WyIyMDIwLTAxLTAxVDAwOjAwOjAwIiwiMTg0MzlmMzYiXQ'
+        - name: fields
+          in: query
+          required: false
+          description: >-
+            Comma-separated list of message fields to include in the response. Only the columns
+            needed for those fields are read from the database. Defaults to all fields.
+          schema:
+            type: string
+            example: 'uuid,sender,created,confirmed'
       responses:
         '200':
           description: A list of active messages sent by the sender
+          headers:
+            X-Next-Cursor:
+              description: >-
+                Continuation token for the next page of messages, only present when the response
+                was paginated and more messages are available
+              schema:
+                type: string
           content:
             application/json:
               schema:
@@ -382,7 +1022,9 @@ def get_active_messages_by_sender_uuid(sender_id: str) -> Response:
             application/json:
               schema: Error
     """
-    return flask.jsonify(controller.get_active_messages_by_sender_uuid(sender_id))
+    return _message_list_response(
+        controller.get_active_messages_by_sender_uuid(sender_id)
+    )
 
 
 @api_blueprint.route("/dhos/v1/receiver/<receiver_id>/active/message", methods=["GET"])
@@ -395,6 +1037,7 @@ def get_active_messages_by_sender_uuid(sender_id: str) -> Response:
         ),
     )
 )
+@cached_response("receiver_id")
 def get_active_messages_by_receiver_uuid(receiver_id: str) -> Response:
     """
     ---
@@ -425,9 +1068,43 @@ def get_active_messages_by_receiver_uuid(receiver_id: str) -> Response:
             type: string
             example: '09db61d2-2ad9-4878-beee-1225b720c205,5d68b104-38cb-48fe-a814-00ac1387ef17'
           required: false
+        - name: limit
+          in: query
+          required: false
+          description: >-
+            Opt-in pagination: the maximum number of messages to return, newest first. Values
+            above the server's maximum page size are reduced to that maximum.
+          schema:
+            type: integer
+            minimum: 1
+            example: 100
+        - name: cursor
+          in: query
+          required: false
+          description: >-
+            Opaque continuation token taken from the X-Next-Cursor header of the previous page
+          schema:
+            type: string
+            example: 'WyIyMDIwLTAxLTAxVDAwOjAwOjAwIiwiMTg0MzlmMzYiXQ'
+        - name: fields
+          in: query
+          required: false
+          description: >-
+            Comma-separated list of message fields to include in the response. Only the columns
+            needed for those fields are read from the database. Defaults to all fields.
+          schema:
+            type: string
+            example: 'uuid,sender,created,confirmed'
       responses:
         '200':
           description: A list of active messages received by the receiver
+          headers:
+            X-Next-Cursor:
+              description: >-
+                Continuation token for the next page of messages, only present when the response
+                was paginated and more messages are available
+              schema:
+                type: string
           content:
             application/json:
               schema:
@@ -440,7 +1117,9 @@ def get_active_messages_by_receiver_uuid(receiver_id: str) -> Response:
             application/json:
               schema: Error
     """
-    return flask.jsonify(controller.get_active_messages_by_receiver_uuid(receiver_id))
+    return _message_list_response(
+        controller.get_active_messages_by_receiver_uuid(receiver_id)
+    )
 
 
 @api_blueprint.route("/dhos/v1/sender_or_receiver/<unique_id>/message", methods=["GET"])
@@ -454,6 +1133,7 @@ def get_active_messages_by_receiver_uuid(receiver_id: str) -> Response:
         ),
     )
 )
+@cached_response("unique_id")
 def get_messages_by_sender_uuid_or_receiver_uuid(unique_id: str) -> Response:
     """
     ---
@@ -478,14 +1158,65 @@ def get_messages_by_sender_uuid_or_receiver_uuid(unique_id: str) -> Response:
             type: string
             example: '09db61d2-2ad9-4878-beee-1225b720c205,5d68b104-38cb-48fe-a814-00ac1387ef17'
           required: false
+        - in: header
+          name: If-None-Match
+          description: ETag of a previous response, to get 304 Not Modified if it is unchanged
+          schema:
+            type: string
+            example: '"3f786850e387550fdab836ed7e6dc881de23001b"'
+          required: false
+        - name: limit
+          in: query
+          required: false
+          description: >-
+            Opt-in pagination: the maximum number of messages to return, newest first. Values
+            above the server's maximum page size are reduced to that maximum.
+          schema:
+            type: integer
+            minimum: 1
+            example: 100
+        - name: cursor
+          in: query
+          required: false
+          description: >-
+            Opaque continuation token taken from the X-Next-Cursor header of the previous page
+          schema:
+            type: string
+            example: 'WyIyMDIwLTAxLTAxVDAwOjAwOjAwIiwiMTg0MzlmMzYiXQ'
+        - name: fields
+          in: query
+          required: false
+          description: >-
+            Comma-separated list of message fields to include in the response. Only the columns
+            needed for those fields are read from the database. Defaults to all fields.
+          schema:
+            type: string
+            example: 'uuid,sender,created,confirmed'
+        - name: include_archived
+          in: query
+          required: false
+          description: >-
+            Also return settled messages that have been moved to the archive. Defaults to false.
+          schema:
+            type: boolean
+            example: true
       responses:
         '200':
           description: A list of messages sent by the sender or received by the receiver
+          headers:
+            X-Next-Cursor:
+              description: >-
+                Continuation token for the next page of messages, only present when the response
+                was paginated and more messages are available
+              schema:
+                type: string
           content:
             application/json:
               schema:
                 type: array
                 items: MessageResponse
+        '304':
+          description: Not modified since the response with the ETag given
         default:
           description: >-
               Error, e.g. 400 Bad Request, 404 Not Found, 503 Service Unavailable
@@ -493,9 +1224,102 @@ def get_messages_by_sender_uuid_or_receiver_uuid(unique_id: str) -> Response:
             application/json:
               schema: Error
     """
-    return flask.jsonify(
-        controller.get_messages_by_sender_uuid_or_receiver_uuid(unique_id)
+    return _message_list_response(
+        _include_archived(
+            controller.get_messages_by_sender_uuid_or_receiver_uuid(unique_id)
+        ),
+        conditional=True,
+    )
+
+
+@api_blueprint.route("/dhos/v1/sender_or_receiver/<unique_id>/inbox", methods=["GET"])
+@protected_route(
+    or_(
+        scopes_present(required_scopes="read:gdm_message_all"),
+        scopes_present(required_scopes="read:message_all"),
+        and_(
+            scopes_present(required_scopes="read:gdm_message"),
+            sender_or_receiver_protection,
+        ),
+    )
+)
+@cached_response("unique_id")
+def get_inbox_summary(unique_id: str) -> Response:
+    """
+    ---
+    get:
+      summary: Get inbox summary
+      description: >-
+        Get one entry per conversation of the sender or receiver who matches the UUID provided in
+        the URL path, with the latest message, the number of unread messages and the time of the
+        last activity. Conversations are considered from the same messages as
+        `GET /dhos/v1/sender_or_receiver/<unique_id>/message` and are ordered by last activity,
+        most recent first.
+      tags: [message]
+      parameters:
+        - name: unique_id
+          in: path
+          required: true
+          description: The sender UUID or receiver UUID
+          schema:
+            type: string
+            example: '18439f36-ffa9-42ae-90de-0beda299cd37'
+        - in: header
+          name: X-Location-Ids
+          description: List of location UUIDs, only used for clinicians
+          schema:
+            type: string
+            example: '09db61d2-2ad9-4878-beee-1225b720c205,5d68b104-38cb-48fe-a814-00ac1387ef17'
+          required: false
+        - name: limit
+          in: query
+          required: false
+          description: >-
+            Opt-in pagination: the maximum number of conversations to return. Values above the
+            server's maximum page size are reduced to that maximum.
+          schema:
+            type: integer
+            minimum: 1
+            example: 100
+        - name: cursor
+          in: query
+          required: false
+          description: >-
+            Opaque continuation token taken from the X-Next-Cursor header of the previous page
+          schema:
+            type: string
+            example: 'WyIyMDIwLTAxLTAxVDAwOjAwOjAwIiwiMTg0MzlmMzYiXQ'
+      responses:
+        '200':
+          description: A list of conversations, most recently active first
+          headers:
+            X-Next-Cursor:
+              description: >-
+                Continuation token for the next page of conversations, only present when the
+                response was paginated and more conversations are available
+              schema:
+                type: string
+          content:
+            application/json:
+              schema:
+                type: array
+                items: InboxEntry
+        default:
+          description: >-
+              Error, e.g. 400 Bad Request, 404 Not Found, 503 Service Unavailable
+          content:
+            application/json:
+              schema: Error
+    """
+    summary, next_cursor = controller.get_inbox_summary(
+        unique_id,
+        limit=RequestArg.integer("limit"),
+        cursor=RequestArg.string("cursor"),
     )
+    response = flask.jsonify(summary)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
 
 
 @api_blueprint.route(
@@ -510,6 +1334,7 @@ def get_messages_by_sender_uuid_or_receiver_uuid(unique_id: str) -> Response:
         ),
     )
 )
+@cached_response("sender_id", "receiver_id")
 def get_messages_by_sender_uuid_and_receiver_uuid(
     sender_id: str, receiver_id: str
 ) -> Response:
@@ -543,9 +1368,51 @@ def get_messages_by_sender_uuid_and_receiver_uuid(
             type: string
             example: '09db61d2-2ad9-4878-beee-1225b720c205,5d68b104-38cb-48fe-a814-00ac1387ef17'
           required: false
+        - name: limit
+          in: query
+          required: false
+          description: >-
+            Opt-in pagination: the maximum number of messages to return, newest first. Values
+            above the server's maximum page size are reduced to that maximum.
+          schema:
+            type: integer
+            minimum: 1
+            example: 100
+        - name: cursor
+          in: query
+          required: false
+          description: >-
+            Opaque continuation token taken from the X-Next-Cursor header of the previous page
+          schema:
+            type: string
+            example: 'WyIyMDIwLTAxLTAxVDAwOjAwOjAwIiwiMTg0MzlmMzYiXQ'
+        - name: fields
+          in: query
+          required: false
+          description: >-
+            Comma-separated list of message fields to include in the response. Only the columns
+            needed for those fields are read from the database. Defaults to all fields.
+          schema:
+            type: string
+            example: 'uuid,sender,created,confirmed'
+        - name: include_archived
+          in: query
+          required: false
+          description: >-
+            Also return settled messages that have been moved to the archive. Defaults to false.
+          schema:
+            type: boolean
+            example: true
       responses:
         '200':
           description: A list of messages sent by the sender and received by the receiver
+          headers:
+            X-Next-Cursor:
+              description: >-
+                Continuation token for the next page of messages, only present when the response
+                was paginated and more messages are available
+              schema:
+                type: string
           content:
             application/json:
               schema:
@@ -558,8 +1425,12 @@ def get_messages_by_sender_uuid_and_receiver_uuid(
             application/json:
               schema: Error
     """
-    return flask.jsonify(
-        controller.get_messages_by_sender_uuid_and_receiver_uuid(sender_id, receiver_id)
+    return _message_list_response(
+        _include_archived(
+            controller.get_messages_by_sender_uuid_and_receiver_uuid(
+                sender_id, receiver_id
+            )
+        )
     )
 
 
@@ -575,6 +1446,7 @@ def get_messages_by_sender_uuid_and_receiver_uuid(
         ),
     )
 )
+@cached_response("sender_id", "receiver_id")
 def get_active_messages_by_sender_uuid_and_receiver_uuid(
     sender_id: str, receiver_id: str
 ) -> Response:
@@ -608,9 +1480,43 @@ def get_active_messages_by_sender_uuid_and_receiver_uuid(
             type: string
             example: '09db61d2-2ad9-4878-beee-1225b720c205,5d68b104-38cb-48fe-a814-00ac1387ef17'
           required: false
+        - name: limit
+          in: query
+          required: false
+          description: >-
+            Opt-in pagination: the maximum number of messages to return, newest first. Values
+            above the server's maximum page size are reduced to that maximum.
+          schema:
+            type: integer
+            minimum: 1
+            example: 100
+        - name: cursor
+          in: query
+          required: false
+          description: >-
+            Opaque continuation token taken from the X-Next-Cursor header of the previous page
+          schema:
+            type: string
+            example: 'WyIyMDIwLTAxLTAxVDAwOjAwOjAwIiwiMTg0MzlmMzYiXQ'
+        - name: fields
+          in: query
+          required: false
+          description: >-
+            Comma-separated list of message fields to include in the response. Only the columns
+            needed for those fields are read from the database. Defaults to all fields.
+          schema:
+            type: string
+            example: 'uuid,sender,created,confirmed'
       responses:
         '200':
           description: A list of active messages sent by the sender and received by the receiver
+          headers:
+            X-Next-Cursor:
+              description: >-
+                Continuation token for the next page of messages, only present when the response
+                was paginated and more messages are available
+              schema:
+                type: string
           content:
             application/json:
               schema:
@@ -623,7 +1529,7 @@ def get_active_messages_by_sender_uuid_and_receiver_uuid(
             application/json:
               schema: Error
     """
-    return flask.jsonify(
+    return _message_list_response(
         controller.get_active_messages_by_sender_uuid_and_receiver_uuid(
             sender_id, receiver_id
         )
@@ -642,6 +1548,7 @@ def get_active_messages_by_sender_uuid_and_receiver_uuid(
         ),
     )
 )
+@cached_response("receiver_id")
 def get_active_callback_messages_by_receiver_uuid(receiver_id: str) -> Response:
     """
     ---
@@ -673,9 +1580,43 @@ def get_active_callback_messages_by_receiver_uuid(receiver_id: str) -> Response:
             type: string
             example: '09db61d2-2ad9-4878-beee-1225b720c205,5d68b104-38cb-48fe-a814-00ac1387ef17'
           required: false
+        - name: limit
+          in: query
+          required: false
+          description: >-
+            Opt-in pagination: the maximum number of messages to return, newest first. Values
+            above the server's maximum page size are reduced to that maximum.
+          schema:
+            type: integer
+            minimum: 1
+            example: 100
+        - name: cursor
+          in: query
+          required: false
+          description: >-
+            Opaque continuation token taken from the X-Next-Cursor header of the previous page
+          schema:
+            type: string
+            example: 'WyIyMDIwLTAxLTAxVDAwOjAwOjAwIiwiMTg0MzlmMzYiXQ'
+        - name: fields
+          in: query
+          required: false
+          description: >-
+            Comma-separated list of message fields to include in the response. Only the columns
+            needed for those fields are read from the database. Defaults to all fields.
+          schema:
+            type: string
+            example: 'uuid,sender,created,confirmed'
       responses:
         '200':
           description: A list of active callback messages received by the receiver
+          headers:
+            X-Next-Cursor:
+              description: >-
+                Continuation token for the next page of messages, only present when the response
+                was paginated and more messages are available
+              schema:
+                type: string
           content:
             application/json:
               schema:
@@ -688,7 +1629,7 @@ def get_active_callback_messages_by_receiver_uuid(receiver_id: str) -> Response:
             application/json:
               schema: Error
     """
-    return flask.jsonify(
+    return _message_list_response(
         controller.get_active_callback_messages_by_receiver_uuid(receiver_id)
     )
 
@@ -750,3 +1691,60 @@ def get_active_callback_messages_for_patients() -> Response:
     return flask.jsonify(
         controller.get_active_callback_messages_for_patients(patient_list)
     )
+
+
+@api_blueprint.route("/dhos/v1/message/count", methods=["POST"])
+@protected_route(
+    or_(
+        scopes_present(required_scopes="read:gdm_message_all"),
+        and_(
+            scopes_present(required_scopes="read:gdm_message"),
+            receiver_list_protection,
+        ),
+    )
+)
+def get_message_counts_by_receiver_uuids() -> Response:
+    """
+    ---
+    post:
+      summary: Get message counts for receivers
+      description: >-
+        Get the number of unread, active and open callback messages for each of the receiver
+        UUIDs provided in the request body, without retrieving the messages themselves.
+      tags: [message]
+      parameters:
+        - in: header
+          name: X-Location-Ids
+          description: List of location UUIDs, only used for clinicians
+          schema:
+            type: string
+            example: '09db61d2-2ad9-4878-beee-1225b720c205,5d68b104-38cb-48fe-a814-00ac1387ef17'
+          required: false
+      requestBody:
+        description: JSON body containing the list of receivers
+        required: true
+        content:
+          application/json:
+            schema:
+              type: array
+              items:
+                type: string
+                example: '18439f36-ffa9-42ae-90de-0beda299cd37'
+      responses:
+        '200':
+          description: The message counts for each receiver, in the order requested
+          content:
+            application/json:
+              schema:
+                type: array
+                items: MessageCounts
+        default:
+          description: >-
+              Error, e.g. 400 Bad Request, 404 Not Found, 503 Service Unavailable
+          content:
+            application/json:
+              schema: Error
+    """
+    receiver_list = connexion.request.get_json()
+
+    return flask.jsonify(controller.get_message_counts_by_receiver_uuids(receiver_list))
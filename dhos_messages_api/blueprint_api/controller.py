@@ -1,17 +1,54 @@
+import time
+from datetime import datetime, timedelta, timezone
 from enum import Enum
-from typing import Dict, List, Optional
+from typing import (
+    Any,
+    Callable,
+    Collection,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
 
-from flask import g
-from flask_batteries_included.config import is_production_environment
-from flask_batteries_included.sqldb import db, generate_uuid
+from flask import current_app, g
+from flask_batteries_included.helpers.error_handler import EntityNotFoundException
+from flask_batteries_included.helpers.security.jwt import current_jwt_user
+from flask_batteries_included.helpers.timestamp import parse_datetime_to_iso8601
+from flask_batteries_included.sqldb import db
 from she_logging import logger
-
+from sqlalchemy import case, func, literal, or_, select, union_all, update
+from sqlalchemy.orm import Query, aliased, with_expression
+from sqlalchemy.sql.elements import ColumnElement
+
+from dhos_messages_api.helper.notifications import message_broker, publish_changes
+from dhos_messages_api.helper.response_cache import (
+    bump_versions,
+    response_cache_enabled,
+)
 from dhos_messages_api.helper.security import (
     get_clinician_locations,
+    get_ids_to_validate,
     user_type_to_validate,
 )
-from dhos_messages_api.models.message import Message
-from dhos_messages_api.models.message_type import MessageType
+from dhos_messages_api.helper.validation import message_validator
+from dhos_messages_api.models.message import (
+    Message,
+    active_message_filter,
+    archived_uuids,
+    load_message_or_404,
+    message_archive,
+    message_entity,
+    open_callback_filter,
+    to_archive_criterion,
+)
+from dhos_messages_api.models.message_type import CALLBACK_MESSAGE_TYPE
+from dhos_messages_api.query.filters import any_of
+from dhos_messages_api.query.pagination import order_messages, paginate
+from dhos_messages_api.query.serialiser import MessageEncoder
 
 
 class DhosMessageType(Enum):
@@ -19,7 +56,7 @@ class DhosMessageType(Enum):
     DOSAGE = 1
     DIETARY = 2
     FEEDBACK = 3
-    CALLBACK = 5
+    CALLBACK = CALLBACK_MESSAGE_TYPE
     ACTIVATION_CODE = 6
     RED_ALERT = 7
     AMBER_ALERT = 8
@@ -27,170 +64,585 @@ class DhosMessageType(Enum):
     CLEAR_ALERTS = 10
 
 
-def create_message(message_details: Dict) -> Dict:
+def _messages_changed(participants: Iterable[str]) -> None:
+    """
+    Invalidates cached responses and wakes waiting requests for the participants of
+    changed messages. Call after committing the change.
+    """
+    changed: Set[str] = set(participants)
+    bump_versions(changed)
+    publish_changes(changed)
+
+
+def _insert_messages(inserts: List[Message]) -> None:
+    """
+    Writes new messages with a single multi-row INSERT. Every column value is set on
+    the messages first, so they can be serialised afterwards without reloading them.
+    Builtin values sent by the client, which are allowed outside production, are kept.
+    """
+    now: datetime = datetime.utcnow()
+    user: str = current_jwt_user()
+    for insert in inserts:
+        if insert.created is None:
+            insert.created = now
+        if insert.modified is None:
+            insert.modified = now
+        if insert.created_by_ is None:
+            insert.created_by_ = user
+        if insert.modified_by_ is None:
+            insert.modified_by_ = user
+    db.session.execute(
+        Message.__table__.insert().values(
+            [
+                {
+                    column.name: getattr(insert, column.key)
+                    for column in Message.__table__.columns
+                }
+                for insert in inserts
+            ]
+        )
+    )
+
+
+def _insert_message(message_details: Dict) -> Message:
     logger.debug("Creating message", extra={"message_data": message_details})
 
-    insert = Message()
-    schema = Message.schema()
+    insert = message_validator().build(message_details)
 
-    for sent_property in message_details:
-        if sent_property in schema["required"]:
-            continue
-        if sent_property in schema["optional"]:
+    _insert_messages([insert])
+    db.session.commit()
+    _messages_changed((insert.sender, insert.receiver))
+    return insert
+
+
+def create_message(message_details: Dict) -> Dict:
+    return _insert_message(message_details).to_dict()
+
+
+def create_message_minimal(message_details: Dict) -> None:
+    """
+    Creates a message without serialising it, for callers that ignore the response.
+    """
+    _insert_message(message_details)
+
+
+def create_messages(
+    messages_details: List[Dict],
+    is_allowed: Optional[Callable[[Dict], bool]] = None,
+) -> List[Dict]:
+    """
+    Creates a batch of messages, each validated as by `create_message` and, if
+    `is_allowed` is given, checked with it. Valid messages are written with a single
+    multi-row INSERT. Returns a result for each message in the order given: the new
+    message with status 200, or an error with status 400 (invalid) or 403 (not
+    allowed).
+    """
+    max_batch_size: int = current_app.config["MESSAGES_MAX_BATCH_SIZE"]
+    if len(messages_details) > max_batch_size:
+        raise ValueError(
+            "Cannot create more than {} messages at once".format(max_batch_size)
+        )
+    logger.debug("Creating %d messages", len(messages_details))
+
+    results: List[Dict] = []
+    inserts: List[Message] = []
+    for message_details in messages_details:
+        try:
+            insert = message_validator().build(message_details)
+        except (KeyError, TypeError, ValueError) as e:
+            results.append({"status": 400, "error": str(e)})
             continue
-        if sent_property in schema["builtin"] and not is_production_environment():
+        if is_allowed is not None and not is_allowed(message_details):
+            results.append({"status": 403, "error": "Forbidden"})
             continue
-        raise KeyError("Property '{}' not found in schema".format(sent_property))
-
-    for required_property in schema["required"]:
-        if (
-            required_property not in message_details
-            or message_details[required_property] is None
-            or len(str(message_details[required_property])) == 0
-        ):
-            raise KeyError(
-                "Property '{}' must contain a valid value".format(required_property)
-            )
-
-    message_type: Optional[MessageType] = None
-    for sent_property in message_details:
-        if len(message_details[sent_property]) == 0:
-            raise KeyError(
-                "Empty fields should not be sent, property '{}' is empty".format(
-                    sent_property
-                )
-            )
-        if sent_property == "message_type":
-            query_result: MessageType = MessageType.query.filter_by(
-                value=message_details[sent_property]["value"]
-            ).first()
-            if query_result:
-                message_type = query_result
-            else:
-                raise KeyError(
-                    "Property 'message_type' must contain a valid value, {} received".format(
-                        message_details[sent_property]["value"]
-                    )
-                )
-        else:
-            insert.set_property(sent_property, message_details[sent_property])
+        results.append({"status": 200})
+        inserts.append(insert)
 
-    insert.uuid = generate_uuid()
-    insert.message_type = message_type
+    if not inserts:
+        return results
 
-    db.session.add(insert)
+    _insert_messages(inserts)
     db.session.commit()
+    _messages_changed(
+        participant
+        for insert in inserts
+        for participant in (insert.sender, insert.receiver)
+    )
 
-    return insert.to_dict()
+    created: Iterator[Message] = iter(inserts)
+    for result in results:
+        if result["status"] == 200:
+            result["message"] = next(created).to_dict()
+    return results
 
 
 def get_message_by_uuid(message_uuid: str) -> Dict:
     logger.debug("Getting message by UUID '%s'", message_uuid)
-    message = Message.query.filter_by(uuid=message_uuid).first_or_404()
+    message = load_message_or_404(message_uuid, include_archived=True)
     return message.to_dict()
 
 
-def get_messages_by_sender_uuid(sender_uuid: str) -> List[Dict]:
+def get_message_version(message_uuid: str) -> Tuple[int, Optional[datetime]]:
+    """
+    Identifies the current state of a message for its ETag. The message is usually
+    already loaded by the route's protection function, so this costs no query.
+    """
+    message = load_message_or_404(message_uuid, include_archived=True)
+    return 1, message.modified
+
+
+def get_message_list_version(messages: Query) -> Tuple[int, Optional[datetime]]:
+    """
+    Identifies the current state of a message list for its ETag: how many messages it
+    has and when the latest of them was modified. A single aggregate query, so no
+    messages are loaded.
+    """
+    message: Any = message_entity(messages)
+    count, last_modified = (
+        messages.order_by(None)
+        .with_entities(func.count(message.uuid), func.max(message.modified))
+        .one()
+    )
+    return count, last_modified
+
+
+def _message_and_archive() -> Any:
+    """
+    An alias of Message that reads from the message and archive tables together, for
+    lookups that must find archived messages too. Read-only.
+    """
+    combined = union_all(select(Message.__table__), select(message_archive)).subquery()
+    return aliased(Message, combined)
+
+
+def get_message_thread(message_uuid: str) -> List[Dict]:
+    """
+    Returns the whole reply chain containing a message, oldest first. One recursive
+    query walks up `related_message` to the root of the thread and another walks back
+    down through all of its replies. Both walks stop after MESSAGES_MAX_THREAD_DEPTH
+    steps, which also guards against reply cycles. Archived messages are included, as
+    they may have been replied to.
+    """
+    logger.debug("Getting thread for message UUID '%s'", message_uuid)
+    load_message_or_404(message_uuid, include_archived=True)
+    max_depth: int = current_app.config["MESSAGES_MAX_THREAD_DEPTH"]
+
+    start = _message_and_archive()
+    ancestors = (
+        db.session.query(start.uuid, start.related_message, literal(0).label("depth"))
+        .filter(start.uuid == message_uuid)
+        .cte("ancestors", recursive=True)
+    )
+    parent = _message_and_archive()
+    ancestors = ancestors.union_all(
+        db.session.query(
+            parent.uuid, parent.related_message, ancestors.c.depth + 1
+        ).filter(
+            parent.uuid == ancestors.c.related_message, ancestors.c.depth < max_depth
+        )
+    )
+    root = (
+        db.session.query(ancestors.c.uuid)
+        .order_by(ancestors.c.depth.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+
+    first = _message_and_archive()
+    thread = (
+        db.session.query(first.uuid, literal(0).label("depth"))
+        .filter(first.uuid == root)
+        .cte("thread", recursive=True)
+    )
+    reply = _message_and_archive()
+    thread = thread.union_all(
+        db.session.query(reply.uuid, thread.c.depth + 1).filter(
+            reply.related_message == thread.c.uuid, thread.c.depth < max_depth
+        )
+    )
+
+    message: Any = _message_and_archive()
+    messages = db.session.query(message).filter(
+        message.deleted.is_(None),
+        message.uuid.in_(db.session.query(thread.c.uuid)),
+    )
+    if "read:gdm_message_all" not in g.jwt_scopes:
+        # Replies may involve other participants, so only return the messages the
+        # caller could retrieve individually.
+        ids_to_validate, user_types = get_ids_to_validate(g.jwt_claims)
+        messages = messages.filter(
+            or_(
+                message.sender.in_(ids_to_validate)
+                & message.sender_type.in_(user_types),
+                message.receiver.in_(ids_to_validate)
+                & message.receiver_type.in_(user_types),
+            )
+        )
+
+    thread_data: List[Dict] = [
+        thread_message.to_dict()
+        for thread_message in messages.order_by(message.created, message.uuid)
+    ]
+    logger.debug("Found %d messages in thread", len(thread_data))
+    return thread_data
+
+
+def select_message_fields(messages: Query, fields: List[str]) -> Query:
+    """
+    Restricts a message list query to the columns needed for the given fields.
+    Raises KeyError if any field is not a message field.
+    """
+    logger.debug("Selecting message fields %s", fields)
+    return messages.options(*Message.load_fields(fields))
+
+
+def get_message_page(
+    messages: Query,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Serialises a message list query, newest first. If a limit is given only one page
+    of messages is returned, along with the cursor for the next page (None when there
+    are no more messages). If fields are given only those fields are loaded and
+    returned; the query should already be restricted with `select_message_fields`.
+    """
+    page, next_cursor = paginate(messages, limit=limit, cursor=cursor)
+    all_message_data: List[Dict] = [message.to_dict(fields=fields) for message in page]
+    logger.debug("Found %d messages", len(all_message_data))
+    return all_message_data, next_cursor
+
+
+def get_encoded_message_page(
+    messages: Query,
+    encoder: MessageEncoder,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+) -> Tuple[bytes, Optional[str]]:
+    """
+    As `get_message_page`, but writes the page as a JSON array with the given
+    encoder rather than building Message instances.
+    """
+    page, next_cursor = paginate(encoder.select(messages), limit=limit, cursor=cursor)
+    body: str = "[" + ",".join(encoder.encode(row) for row in page) + "]\n"
+    logger.debug("Found %d messages", len(page))
+    return body.encode("utf-8"), next_cursor
+
+
+def stream_message_list(
+    messages: Query,
+    fields: Optional[List[str]] = None,
+    encoder: Optional[MessageEncoder] = None,
+) -> Iterator[bytes]:
+    """
+    Serialises a message list query as a JSON array, newest first, without holding
+    the whole list in memory. Rows are fetched from a server-side cursor in batches
+    of STREAM_BATCH_SIZE and each batch is yielded as one chunk of the array. Rows
+    are written with the encoder if one is given.
+    """
+    batch_size: int = current_app.config["STREAM_BATCH_SIZE"]
+    yield b"["
+
+    count = 0
+    chunk: List[bytes] = []
+    query: Query = messages if encoder is None else encoder.select(messages)
+    for row in order_messages(query).yield_per(batch_size):
+        chunk.append(b"," if count else b"")
+        if encoder is None:
+            text: str = current_app.json.dumps(
+                row.to_dict(fields=fields), separators=(",", ":")
+            )
+        else:
+            text = encoder.encode(row)
+        chunk.append(text.encode("utf-8"))
+        count += 1
+        if count % batch_size == 0:
+            yield b"".join(chunk)
+            chunk.clear()
+
+    chunk.append(b"]\n")
+    yield b"".join(chunk)
+    logger.debug("Streamed %d messages", count)
+
+
+def include_archived_messages(messages: Query) -> Query:
+    """
+    Extends a message list query to also return the matching messages from the
+    archive table. The query's filter is applied to both tables and the result reads
+    from their UNION ALL through an alias of Message, so ordering, pagination and
+    field selection added later apply to the combined list as long as they take their
+    columns from `message_entity`. Archived messages are read-only.
+    """
+    criterion: ColumnElement = messages.whereclause
+    combined = union_all(
+        select(Message.__table__).where(criterion),
+        select(message_archive).where(to_archive_criterion(criterion)),
+    ).subquery()
+    return Message.query_class(
+        aliased(Message, combined), session=db.session(), _with_deleted=True
+    )
+
+
+def get_messages_by_sender_uuid(sender_uuid: str) -> Query:
     logger.debug("Getting messages by sender ID '%s'", sender_uuid)
     user_type = user_type_to_validate(sender_uuid, g.jwt_claims)
-    all_messages = Message.query.filter_by(
-        sender=sender_uuid, sender_type=user_type
-    ).order_by(Message.created.desc())
-    all_message_data: List[Dict] = [message.to_dict() for message in all_messages]
-    logger.debug(
-        "Found %d messages with sender ID '%s'",
-        len(all_message_data),
-        sender_uuid,
-    )
-    return all_message_data
+    return Message.query.filter_by(sender=sender_uuid, sender_type=user_type)
 
 
-def get_messages_by_receiver_uuid(receiver_uuid: str) -> List[Dict]:
+def get_messages_by_receiver_uuid(receiver_uuid: str) -> Query:
     logger.debug("Getting messages by receiver ID '%s'", receiver_uuid)
-    all_messages = Message.query.filter_by(receiver=receiver_uuid).order_by(
-        Message.created.desc()
-    )
+    all_messages = Message.query.filter_by(receiver=receiver_uuid)
 
     user_type = user_type_to_validate(receiver_uuid, g.jwt_claims)
     if user_type:
         all_messages = all_messages.filter_by(receiver_type=user_type)
 
-    all_message_data: List[Dict] = [message.to_dict() for message in all_messages]
-    logger.debug(
-        "Found %d messages with receiver ID '%s'",
-        len(all_message_data),
-        receiver_uuid,
-    )
-    return all_message_data
+    return all_messages
 
 
-def get_active_messages_by_sender_uuid(sender_uuid: str) -> List[Dict]:
+def get_active_messages_by_sender_uuid(sender_uuid: str) -> Query:
     logger.debug("Getting active messages by sender ID '%s'", sender_uuid)
     user_type = user_type_to_validate(sender_uuid, g.jwt_claims)
-    all_messages = Message.query.filter(
+    return Message.query.filter(
         (Message.sender_type == user_type)
         & (Message.sender == sender_uuid)
-        & (
-            (Message.confirmed.is_(None))
-            | (Message.message_type_id == DhosMessageType.CALLBACK.value)
-        )
-    )
-    all_message_data: List[Dict] = [message.to_dict() for message in all_messages]
-    logger.debug(
-        "Found %d active messages with sender ID '%s'",
-        len(all_message_data),
-        sender_uuid,
+        & active_message_filter()
     )
-    return all_message_data
 
 
-def get_active_messages_by_receiver_uuid(receiver_uuid: str) -> List[Dict]:
+def get_active_messages_by_receiver_uuid(receiver_uuid: str) -> Query:
     logger.debug("Getting active messages by receiver ID '%s'", receiver_uuid)
     user_type = user_type_to_validate(receiver_uuid, g.jwt_claims)
-    all_messages = Message.query.filter(
+    return Message.query.filter(
+        (Message.receiver_type == user_type)
+        & (Message.receiver == receiver_uuid)
+        & active_message_filter()
+    )
+
+
+def get_active_callback_messages_by_receiver_uuid(receiver_uuid: str) -> Query:
+    logger.debug("Getting active callback messages by receiver ID '%s'", receiver_uuid)
+    user_type = user_type_to_validate(receiver_uuid, g.jwt_claims)
+    return Message.query.filter(
         (Message.receiver_type == user_type)
         & (Message.receiver == receiver_uuid)
-        & (
-            (Message.confirmed.is_(None))
-            | (Message.message_type_id == DhosMessageType.CALLBACK.value)
+        & open_callback_filter()
+    )
+
+
+def get_message_counts_by_receiver_uuids(receiver_uuids: List[str]) -> List[Dict]:
+    """
+    Counts the unread, active and open callback messages for each receiver in a
+    single grouped query, without loading any messages. Each count is scoped to the
+    receiver type implied by the caller's JWT in the same way as the list it
+    summarises: unread as the receiver's message list, active and callback as its
+    active and active callback lists.
+    """
+    logger.debug("Counting messages for %d receivers", len(receiver_uuids))
+    rows = (
+        Message.query.with_entities(
+            Message.receiver,
+            Message.receiver_type,
+            func.count(case((Message.retrieved.is_(None), 1))),
+            func.count(case((active_message_filter(), 1))),
+            func.count(case((open_callback_filter(), 1))),
         )
+        .filter(Message.receiver.in_(set(receiver_uuids)))
+        .group_by(Message.receiver, Message.receiver_type)
+        .all()
     )
-    all_message_data: List[Dict] = [message.to_dict() for message in all_messages]
+
+    # Each receiver's counts by receiver type, so every receiver is a single lookup.
+    counts_by_receiver: Dict[str, Dict[str, Tuple[int, int, int]]] = {}
+    for receiver, receiver_type, unread, active, callback in rows:
+        counts_by_receiver.setdefault(receiver, {})[receiver_type] = (
+            unread,
+            active,
+            callback,
+        )
+
+    counts: List[Dict] = []
+    for receiver_uuid in receiver_uuids:
+        user_type = user_type_to_validate(receiver_uuid, g.jwt_claims)
+        by_type = counts_by_receiver.get(receiver_uuid, {})
+        # The message list only filters on receiver type when there is one, but the
+        # active lists always match it, so return nothing when there is none.
+        unread = sum(
+            type_counts[0]
+            for receiver_type, type_counts in by_type.items()
+            if not user_type or receiver_type == user_type
+        )
+        _, active, callback = (
+            by_type.get(user_type, (0, 0, 0)) if user_type else (0, 0, 0)
+        )
+        counts.append(
+            {
+                "receiver": receiver_uuid,
+                "unread": unread,
+                "active": active,
+                "callback": callback,
+            }
+        )
+    return counts
+
+
+def _get_messages_changed_since(
+    receiver_uuid: str, since: Optional[datetime]
+) -> Tuple[Dict, bool]:
     logger.debug(
-        "Found %d active messages with receiver ID '%s'",
-        len(all_message_data),
+        "Getting messages by receiver ID '%s' changed since %s", receiver_uuid, since
+    )
+    changed = Message.query
+    if since is not None:
+        # `modified` is set before the commit, so a change may become visible after a
+        # later one has already been synced. Looking back over the overlap window
+        # picks up any that committed late.
+        if since.tzinfo is None:
+            # Stored times are UTC, so a naive watermark is too, whatever the server's
+            # local time zone.
+            since = since.replace(tzinfo=timezone.utc)
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+        overlap = timedelta(seconds=current_app.config["MESSAGES_SYNC_OVERLAP_SECONDS"])
+        # Include soft-deleted rows so that they can be reported as tombstones.
+        changed = changed.with_deleted().filter(Message.modified > since - overlap)
+    changed = changed.filter_by(receiver=receiver_uuid)
+
+    user_type = user_type_to_validate(receiver_uuid, g.jwt_claims)
+    if user_type:
+        changed = changed.filter_by(receiver_type=user_type)
+
+    messages: List[Dict] = []
+    deleted: List[Dict] = []
+    watermark: Optional[datetime] = since
+    for message in changed.order_by(Message.modified, Message.uuid):
+        if message.deleted is None:
+            messages.append(message.to_dict())
+        else:
+            deleted.append(
+                {
+                    "uuid": message.uuid,
+                    "deleted": parse_datetime_to_iso8601(message.deleted),
+                }
+            )
+        if watermark is None or message.modified > watermark:
+            watermark = message.modified
+
+    logger.debug(
+        "Found %d changed and %d deleted messages with receiver ID '%s'",
+        len(messages),
+        len(deleted),
         receiver_uuid,
     )
-    return all_message_data
+    changes: Dict = {
+        "messages": messages,
+        "deleted": deleted,
+        "watermark": watermark.replace(tzinfo=timezone.utc).isoformat(
+            timespec="microseconds"
+        )
+        if watermark
+        else None,
+    }
+    return changes, watermark != since
 
 
-def get_active_callback_messages_by_receiver_uuid(receiver_uuid: str) -> List[Dict]:
-    logger.debug("Getting active callback messages by receiver ID '%s'", receiver_uuid)
+def get_messages_changed_since(receiver_uuid: str, since: Optional[datetime]) -> Dict:
+    """
+    Returns the messages for a receiver that were created or modified after the
+    `since` watermark, tombstones for messages deleted since then, and the watermark
+    to send next time. Without a watermark all current messages are returned.
+
+    Changes from the MESSAGES_SYNC_OVERLAP_SECONDS before the watermark are returned
+    again, so that a change committed after a later one was synced is not missed.
+    Callers must treat messages and tombstones they have already seen as updates.
+    """
+    return _get_messages_changed_since(receiver_uuid, since)[0]
+
+
+def wait_for_messages_changed_since(
+    receiver_uuid: str, since: datetime, timeout: float
+) -> Dict:
+    """
+    As `get_messages_changed_since`, but if nothing has changed after the watermark,
+    waits up to `timeout` seconds for a message for the receiver to be created or
+    updated. Once notified of a change the overlap window is returned even if nothing
+    is newer than the watermark, as the change may have committed late. The database
+    connection is released while waiting.
+    """
+    deadline: float = time.monotonic() + timeout
+    broker = message_broker()
+    if broker is None:
+        return get_messages_changed_since(receiver_uuid, since)
+    # Subscribed before querying, so that a change committed in between is not missed.
+    with broker.subscribe(receiver_uuid) as wait:
+        notified: bool = False
+        while True:
+            changes, newer = _get_messages_changed_since(receiver_uuid, since)
+            remaining: float = deadline - time.monotonic()
+            if newer or notified or remaining <= 0:
+                return changes
+            db.session.close()
+            notified = wait(remaining)
+
+
+def mark_messages_retrieved(receiver_uuid: str, retrieved: str) -> Dict:
+    """
+    Marks every message for a receiver created up to the `retrieved` timestamp, and
+    not already retrieved, as retrieved at that time. This is a single UPDATE, so
+    costs the same however many messages are unread.
+    """
+    logger.debug(
+        "Marking messages by receiver ID '%s' retrieved up to %s",
+        receiver_uuid,
+        retrieved,
+    )
+    values: Dict[str, Any] = Message.column_values("retrieved", retrieved)
+    unretrieved: ColumnElement = (
+        (Message.receiver == receiver_uuid)
+        & (Message.created <= values["retrieved"])
+        & Message.retrieved.is_(None)
+        & Message.deleted.is_(None)
+    )
+
     user_type = user_type_to_validate(receiver_uuid, g.jwt_claims)
-    all_messages = Message.query.filter(
-        (
-            (Message.receiver_type == user_type)
-            & (Message.receiver == receiver_uuid)
-            & (Message.confirmed.is_(None))
-            & (Message.cancelled.is_(None))
-        )
-        & (Message.message_type_id == DhosMessageType.CALLBACK.value)
+    if user_type:
+        unretrieved &= Message.receiver_type == user_type
+
+    result = db.session.execute(
+        update(Message)
+        .where(unretrieved)
+        .values(values)
+        .execution_options(synchronize_session=False)
     )
-    all_message_data: List[Dict] = [message.to_dict() for message in all_messages]
+    participants: List[str] = [receiver_uuid]
+    if response_cache_enabled():
+        # Includes any already retrieved at the same time, which is harmless.
+        participants.extend(
+            sender
+            for (sender,) in Message.query.filter(
+                (Message.receiver == receiver_uuid)
+                & (Message.retrieved == values["retrieved"])
+            )
+            .with_entities(Message.sender)
+            .distinct()
+        )
+    db.session.commit()
+    _messages_changed(participants)
+
     logger.debug(
-        "Found %d active callback messages with receiver ID '%s'",
-        len(all_message_data),
+        "Marked %d messages with receiver ID '%s' retrieved",
+        result.rowcount,
         receiver_uuid,
     )
-    return all_message_data
+    return {"receiver": receiver_uuid, "updated": result.rowcount}
 
 
-def get_messages_by_sender_uuid_or_receiver_uuid(uuid: str) -> List[Dict]:
+def get_messages_by_sender_uuid_or_receiver_uuid(uuid: str) -> Query:
     logger.debug("Getting messages by sender or receiver ID '%s'", uuid)
 
     user_type = user_type_to_validate(uuid, g.jwt_claims)
 
-    all_messages: List[Message]
+    all_messages: Query
     if user_type:
         all_messages = get_all_from_specific_user_and_id(uuid, user_type)
     else:
@@ -201,16 +653,69 @@ def get_messages_by_sender_uuid_or_receiver_uuid(uuid: str) -> List[Dict]:
                 ((Message.sender == uuid)) | ((Message.receiver == uuid))
             )
 
-    all_message_data: List[Dict] = [message.to_dict() for message in all_messages]
-    logger.debug(
-        "Found %d messages with sender or receiver ID '%s'",
-        len(all_message_data),
-        uuid,
+    return all_messages
+
+
+def get_inbox_summary(
+    uuid: str, limit: Optional[int] = None, cursor: Optional[str] = None
+) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Summarises the conversations of a sender or receiver, one entry per counterparty,
+    most recently active first. The messages considered are the same as for
+    `get_messages_by_sender_uuid_or_receiver_uuid`. Window functions pick the latest
+    message and count the unread messages of each conversation in the database, so
+    only one message per counterparty is loaded.
+    """
+    logger.debug("Getting inbox summary for ID '%s'", uuid)
+    sent = Message.sender == uuid
+    conversation = (
+        case((sent, Message.receiver), else_=Message.sender),
+        case((sent, Message.receiver_type), else_=Message.sender_type),
+    )
+    ranked = (
+        get_messages_by_sender_uuid_or_receiver_uuid(uuid)
+        .with_entities(
+            Message.uuid,
+            func.row_number()
+            .over(
+                partition_by=conversation,
+                order_by=(Message.created.desc(), Message.uuid.desc()),
+            )
+            .label("position"),
+            func.count(
+                case(((Message.receiver == uuid) & Message.retrieved.is_(None), 1))
+            )
+            .over(partition_by=conversation)
+            .label("unread"),
+        )
+        .subquery()
+    )
+    latest = (
+        Message.query.join(ranked, Message.uuid == ranked.c.uuid)
+        .filter(ranked.c.position == 1)
+        .options(with_expression(Message.unread_count, ranked.c.unread))
     )
-    return all_message_data
 
+    page, next_cursor = paginate(latest, limit=limit, cursor=cursor)
+    summary: List[Dict] = []
+    for message in page:
+        sent_by_uuid = message.sender == uuid
+        summary.append(
+            {
+                "counterparty": message.receiver if sent_by_uuid else message.sender,
+                "counterparty_type": message.receiver_type
+                if sent_by_uuid
+                else message.sender_type,
+                "last_activity": message.created.replace(tzinfo=timezone.utc),
+                "unread": message.unread_count,
+                "latest_message": message.to_dict(),
+            }
+        )
+    logger.debug("Found %d conversations", len(summary))
+    return summary, next_cursor
 
-def get_all_from_unique_id_filtered_to_clinician(unique_id: str) -> List[Message]:
+
+def get_all_from_unique_id_filtered_to_clinician(unique_id: str) -> Query:
     """
     Returns messages:
     - sent or received by this id, if the other party is the clinician making the request
@@ -231,35 +736,42 @@ def get_all_from_unique_id_filtered_to_clinician(unique_id: str) -> List[Message
     filter_ids: List[str] = get_clinician_locations()
     clinician_uuid: str = g.jwt_claims["clinician_id"]
 
-    all_messages = Message.query.filter(
+    branches: List[ColumnElement] = [
         (
             (Message.sender == unique_id)
             & (Message.receiver == clinician_uuid)
             & (Message.receiver_type == "clinician")
-        )
-        | (
+        ),
+        (
             (Message.receiver == unique_id)
             & (Message.sender == clinician_uuid)
             & (Message.sender_type == "clinician")
-        )
-        | (
+        ),
+        (
             (Message.sender == unique_id)
             & (Message.receiver.in_(filter_ids))
             & (Message.receiver_type == "location")
-        )
-        | (
+        ),
+        (
             (Message.receiver == unique_id)
             & (Message.sender.in_(filter_ids))
             & (Message.sender_type == "location")
-        )
-        | ((Message.sender == unique_id) & (Message.sender_type == "patient"))
-        | ((Message.receiver == unique_id) & (Message.receiver_type == "patient"))
-    )
+        ),
+        ((Message.sender == unique_id) & (Message.sender_type == "patient")),
+        ((Message.receiver == unique_id) & (Message.receiver_type == "patient")),
+    ]
 
-    return all_messages
+    if current_app.config["CLINICIAN_QUERY_STRATEGY"] == "union":
+        # Each branch is selective on sender or receiver alone, so it can use that
+        # column's index instead of the planner scanning the table for the OR. The IN
+        # removes messages matched by more than one branch.
+        matching = union_all(*(select(Message.uuid).where(b) for b in branches))
+        return Message.query.filter(Message.uuid.in_(matching))
+
+    return Message.query.filter(or_(*branches))
 
 
-def get_all_from_specific_user_and_id(unique_id: str, user_type: str) -> List[Message]:
+def get_all_from_specific_user_and_id(unique_id: str, user_type: str) -> Query:
     all_messages = Message.query.filter(
         (
             (Message.sender == unique_id)
@@ -281,54 +793,41 @@ def get_all_from_specific_user_and_id(unique_id: str, user_type: str) -> List[Me
 
 def get_messages_by_sender_uuid_and_receiver_uuid(
     sender_uuid: str, receiver_uuid: str
-) -> List[Dict]:
+) -> Query:
     logger.debug(
         "Getting messages by sender ID '%s' AND receiver ID '%s'",
         sender_uuid,
         receiver_uuid,
     )
-    all_messages = Message.query.filter_by(
-        receiver=receiver_uuid, sender=sender_uuid
-    ).order_by(Message.created.desc())
-
-    all_message_data: List[Dict] = [message.to_dict() for message in all_messages]
-    logger.debug(
-        "Found %d messages with specified sender and receiver IDs",
-        len(all_message_data),
-    )
-    return all_message_data
+    return Message.query.filter_by(receiver=receiver_uuid, sender=sender_uuid)
 
 
 def get_active_messages_by_sender_uuid_and_receiver_uuid(
     sender_uuid: str, receiver_uuid: str
-) -> List[Dict]:
+) -> Query:
     logger.debug(
         "Getting active messages by sender ID '%s' AND receiver ID '%s'",
         sender_uuid,
         receiver_uuid,
     )
-    all_messages = Message.query.filter(
+    return Message.query.filter(
         (Message.confirmed.is_(None))
         | (Message.message_type_id == DhosMessageType.CALLBACK.value)
         & (Message.receiver == receiver_uuid)
         & (Message.sender == sender_uuid)
-    ).order_by(Message.created.desc())
-
-    all_message_data: List[Dict] = [message.to_dict() for message in all_messages]
-    logger.debug(
-        "Found %d active messages with specified sender and receiver IDs",
-        len(all_message_data),
     )
-    return all_message_data
 
 
-def update_message(message_uuid: str, message_details: Dict) -> Dict:
+def _update_message(message_uuid: str, message_details: Dict) -> Message:
+    """
+    Applies updates to a message and flushes them, leaving the commit to the caller.
+    """
     logger.debug(
         "Updating message with UUID %s",
         message_uuid,
         extra={"message_data": message_details},
     )
-    message_db = Message.query.filter_by(uuid=message_uuid).first_or_404()
+    message_db = load_message_or_404(message_uuid)
     has_one_or_more_values = False
 
     for property_to_update in message_details:
@@ -338,19 +837,150 @@ def update_message(message_uuid: str, message_details: Dict) -> Dict:
     if not has_one_or_more_values:
         raise KeyError("valid update parameters not found.")
 
+    # Set here rather than on update by the database, so that the message can be
+    # serialised before the commit expires it and no reload is needed.
+    message_db.modified = datetime.utcnow()
+    message_db.modified_by_ = current_jwt_user()
+    db.session.flush()
+    return message_db
+
+
+def _commit_update(message: Message) -> None:
+    # Read before the commit expires them.
+    participants: Tuple[str, str] = (message.sender, message.receiver)
     db.session.commit()
-    return message_db.to_dict()
+    _messages_changed(participants)
 
 
-def get_active_callback_messages_for_patients(patient_list: Dict) -> Dict:
-    messages = Message.query.filter(
-        (Message.confirmed.is_(None))
-        & (Message.cancelled.is_(None))
-        & (Message.message_type_id == DhosMessageType.CALLBACK.value)
-        & (Message.sender.in_(patient_list))
-    ).distinct(Message.sender)
+def update_message(message_uuid: str, message_details: Dict) -> Dict:
+    message: Message = _update_message(message_uuid, message_details)
+    response: Dict = message.to_dict()
+    _commit_update(message)
+    return response
+
+
+def update_message_minimal(message_uuid: str, message_details: Dict) -> None:
+    """
+    Updates a message without serialising it, for callers that ignore the response.
+    """
+    _commit_update(_update_message(message_uuid, message_details))
+
+
+def _existing_uuids(message_uuids: Collection[str]) -> Set[str]:
+    return {
+        uuid
+        for (uuid,) in Message.query.filter(
+            any_of(Message.uuid, message_uuids)
+        ).with_entities(Message.uuid)
+    }
+
+
+def update_messages(updates: List[Dict]) -> List[Dict]:
+    """
+    Applies a list of `{"uuid": ..., "changes": {...}}` updates in one transaction.
+    Messages given the same changes are updated together by a single UPDATE, so
+    e.g. marking a whole conversation as retrieved is one statement. Returns the
+    updated messages in the order given.
+    """
+    max_batch_size: int = current_app.config["MESSAGES_MAX_BATCH_SIZE"]
+    if len(updates) > max_batch_size:
+        raise ValueError(
+            "Cannot update more than {} messages at once".format(max_batch_size)
+        )
+    logger.debug("Updating %d messages", len(updates), extra={"message_data": updates})
+
+    message_uuids: List[str] = [message_update["uuid"] for message_update in updates]
+    if len(set(message_uuids)) != len(message_uuids):
+        raise ValueError("Each message can only be updated once per request")
+    found: Set[str] = _existing_uuids(message_uuids)
+    missing: List[str] = [uuid for uuid in message_uuids if uuid not in found]
+    if missing:
+        raise EntityNotFoundException(
+            "Messages not found: {}".format(", ".join(missing))
+        )
+
+    related: Set[str] = {
+        message_update["changes"]["related_message"]
+        for message_update in updates
+        if "related_message" in message_update["changes"]
+    }
+    related_found: Set[str] = set()
+    if related:
+        related_found = _existing_uuids(related) | archived_uuids(related)
+
+    groups: Dict[Tuple, List[str]] = {}
+    for message_update in updates:
+        if not message_update["changes"]:
+            raise KeyError("valid update parameters not found.")
+        values: Dict[str, Any] = {}
+        for key, value in message_update["changes"].items():
+            if key == "related_message":
+                if value == message_update["uuid"]:
+                    raise KeyError(
+                        "Cannot set property related_message, "
+                        "circular reference to parent."
+                    )
+                if value not in related_found:
+                    raise KeyError(Message().invalid_value_error(key, value))
+            values.update(Message.column_values(key, value))
+        groups.setdefault(tuple(sorted(values.items())), []).append(
+            message_update["uuid"]
+        )
+
+    for group_values, group_uuids in groups.items():
+        db.session.execute(
+            update(Message)
+            .where(any_of(Message.uuid, group_uuids))
+            .values(dict(group_values))
+            .execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+
+    messages: Dict[str, Message] = {
+        message.uuid: message
+        for message in Message.query.filter(any_of(Message.uuid, message_uuids))
+    }
+    _messages_changed(
+        participant
+        for message in messages.values()
+        for participant in (message.sender, message.receiver)
+    )
+    return [messages[uuid].to_dict() for uuid in message_uuids]
+
+
+def get_active_callback_messages_for_patients(patient_list: List[str]) -> Dict:
+    """
+    Returns the newest open callback request sent by each of the patients, keyed by
+    patient UUID. The UUIDs are bound as a single array parameter on Postgres, so the
+    statement is the same however many there are, and looked up in chunks of
+    MESSAGES_PATIENT_CHUNK_SIZE.
+    """
+    chunk_size: int = current_app.config["MESSAGES_PATIENT_CHUNK_SIZE"]
+    patient_uuids: List[str] = list(dict.fromkeys(patient_list))
+    logger.debug("Getting active callbacks for %d patients", len(patient_uuids))
+
     callbacks: Dict = {}
-    for msg in messages:
-        callbacks[msg.sender] = msg.to_dict()
+    for start in range(0, len(patient_uuids), chunk_size):
+        ranked = (
+            Message.query.filter(
+                open_callback_filter()
+                & any_of(Message.sender, patient_uuids[start : start + chunk_size])
+            )
+            .with_entities(
+                Message.uuid,
+                func.row_number()
+                .over(
+                    partition_by=Message.sender,
+                    order_by=(Message.created.desc(), Message.uuid.desc()),
+                )
+                .label("position"),
+            )
+            .subquery()
+        )
+        latest = Message.query.join(ranked, Message.uuid == ranked.c.uuid).filter(
+            ranked.c.position == 1
+        )
+        for message in latest:
+            callbacks[message.sender] = message.to_dict()
 
     return callbacks
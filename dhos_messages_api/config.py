@@ -1,8 +1,105 @@
+from typing import Dict, Optional
+
+from environs import Env
 from flask import Flask
+from marshmallow.validate import OneOf
+
+env = Env()
 
 
 class Configuration:
-    pass
+    # Upper bound applied to the `limit` query parameter on paginated list endpoints.
+    MESSAGES_MAX_PAGE_SIZE: int = env.int("MESSAGES_MAX_PAGE_SIZE", 1000)
+
+    # Maximum number of messages accepted by one batch create or bulk update request.
+    MESSAGES_MAX_BATCH_SIZE: int = env.int("MESSAGES_MAX_BATCH_SIZE", 500)
+
+    # Patient UUIDs looked up per query when fetching active callbacks for many
+    # patients at once.
+    MESSAGES_PATIENT_CHUNK_SIZE: int = env.int("MESSAGES_PATIENT_CHUNK_SIZE", 10000)
+
+    # Stream unpaginated list responses as they are serialised rather than building
+    # the whole list first. Rows are fetched from the database in batches of this size.
+    STREAM_LIST_RESPONSES: bool = env.bool("STREAM_LIST_RESPONSES", False)
+    STREAM_BATCH_SIZE: int = env.int("STREAM_BATCH_SIZE", 500)
+
+    # Maximum number of replies followed in either direction when retrieving a thread.
+    MESSAGES_MAX_THREAD_DEPTH: int = env.int("MESSAGES_MAX_THREAD_DEPTH", 100)
+
+    # A message type value missing from the registry reloads it from the database, so
+    # types added since it was loaded are found, but at most once in this many seconds.
+    MESSAGE_TYPES_MIN_REFRESH_SECONDS: int = env.int(
+        "MESSAGE_TYPES_MIN_REFRESH_SECONDS", 60
+    )
+
+    # How clinicians' sender-or-receiver queries are built: "or" filters on a single OR
+    # of all the cases they may see, "union" runs each case as its own subquery.
+    CLINICIAN_QUERY_STRATEGY: str = env.str(
+        "CLINICIAN_QUERY_STRATEGY", "or", validate=OneOf(["or", "union"])
+    )
+
+    # Compare UUIDs against the native UUID shadow columns rather than the text
+    # columns. Only enable once `flask backfill-native-uuids` has completed.
+    MESSAGES_READ_NATIVE_UUIDS: bool = env.bool("MESSAGES_READ_NATIVE_UUIDS", False)
+
+    # On Postgres the message table is range partitioned by `created`, with each
+    # partition holding this many months of messages.
+    MESSAGES_PARTITION_MONTHS: int = env.int("MESSAGES_PARTITION_MONTHS", 1)
+
+    # `flask archive-messages` moves settled messages to the archive table once they
+    # have not been modified for this many days.
+    MESSAGES_ARCHIVE_AFTER_DAYS: int = env.int("MESSAGES_ARCHIVE_AFTER_DAYS", 90)
+
+    # Cache list responses in Redis ("redis"), in process ("local", for tests and
+    # development) or not at all ("none"). Entries are dropped after
+    # RESPONSE_CACHE_TTL seconds. With RESPONSE_CACHE_STALE_WHILE_REVALIDATE, an
+    # outdated response is served while another request is refreshing it.
+    RESPONSE_CACHE: str = env.str(
+        "RESPONSE_CACHE", "none", validate=OneOf(["none", "local", "redis"])
+    )
+    RESPONSE_CACHE_TTL: int = env.int("RESPONSE_CACHE_TTL", 300)
+    RESPONSE_CACHE_STALE_WHILE_REVALIDATE: bool = env.bool(
+        "RESPONSE_CACHE_STALE_WHILE_REVALIDATE", False
+    )
+    # Redis connection settings, named as for dhos-redis.
+    REDIS_HOST: str = env.str("REDIS_HOST", "localhost")
+    REDIS_PORT: int = env.int("REDIS_PORT", 6379)
+    REDIS_PASSWORD: Optional[str] = env.str("REDIS_PASSWORD", None)
+    REDIS_TIMEOUT: int = env.int("REDIS_TIMEOUT", 2)
+
+    # How far before the `since` watermark a receiver sync looks for changes, which
+    # must be longer than any transaction takes between setting `modified` on a message
+    # and committing.
+    MESSAGES_SYNC_OVERLAP_SECONDS: int = env.int("MESSAGES_SYNC_OVERLAP_SECONDS", 30)
+
+    # How creating or updating a message wakes sync requests waiting for a change:
+    # Postgres NOTIFY ("postgres"), in process ("local", for tests and development) or
+    # not at all ("none", when sync requests never wait). Waits are capped at
+    # MESSAGES_MAX_WAIT_SECONDS.
+    MESSAGE_NOTIFICATIONS: str = env.str(
+        "MESSAGE_NOTIFICATIONS", "none", validate=OneOf(["none", "local", "postgres"])
+    )
+    MESSAGES_MAX_WAIT_SECONDS: int = env.int("MESSAGES_MAX_WAIT_SECONDS", 30)
+
+    # Write JSON responses with orjson when it is installed (the `fast-json` extra)
+    # rather than the standard library.
+    FAST_JSON: bool = env.bool("FAST_JSON", False)
+
+    # How message lists are serialised: "orm" builds each message with to_dict, "core"
+    # writes JSON straight from selected columns and "postgres" has the database write
+    # it. MESSAGES_SERIALISER_ENDPOINTS overrides the default for individual
+    # endpoints, e.g. "get_messages_by_receiver_uuid=core".
+    MESSAGES_SERIALISER: str = env.str(
+        "MESSAGES_SERIALISER", "orm", validate=OneOf(["orm", "core", "postgres"])
+    )
+    MESSAGES_SERIALISER_ENDPOINTS: Dict[str, str] = env.dict(
+        "MESSAGES_SERIALISER_ENDPOINTS",
+        {},
+        validate=lambda endpoints: all(
+            serialiser in ["orm", "core", "postgres"]
+            for serialiser in endpoints.values()
+        ),
+    )
 
 
 def init_config(app: Flask) -> None:
@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from flask_batteries_included.sqldb import db
+from she_logging import logger
+from sqlalchemy import select
+
+from dhos_messages_api.helper.response_cache import bump_all_versions
+from dhos_messages_api.models.message import (
+    Message,
+    active_message_filter,
+    message_archive,
+)
+
+
+def archive_messages(
+    older_than_days: int, batch_size: int, now: Optional[datetime] = None
+) -> int:
+    """
+    Moves settled messages that have not been modified for `older_than_days` days
+    from the message table to the archive table, including soft-deleted ones.
+    Settled messages are those no longer returned by the active message endpoints,
+    so archiving never changes their results. Each batch is copied, deleted and
+    committed separately, with its rows locked so that concurrent updates either
+    finish first or wait. Returns the number of messages archived.
+    """
+    table = Message.__table__
+    cutoff: datetime = (now or datetime.utcnow()) - timedelta(days=older_than_days)
+    settled = ~active_message_filter() & (table.c.modified < cutoff)
+
+    total = 0
+    while True:
+        uuids: List[str] = list(
+            db.session.execute(
+                select(table.c.uuid)
+                .where(settled)
+                .order_by(table.c.modified)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            ).scalars()
+        )
+        if not uuids:
+            break
+
+        db.session.execute(
+            message_archive.insert().from_select(
+                [column.name for column in table.columns],
+                select(table).where(table.c.uuid.in_(uuids)),
+            )
+        )
+        db.session.execute(table.delete().where(table.c.uuid.in_(uuids)))
+        db.session.commit()
+
+        total += len(uuids)
+        logger.info("Archived %d messages", total)
+
+    if total:
+        # Archived messages drop out of list responses.
+        bump_all_versions()
+    return total
@@ -0,0 +1,65 @@
+from typing import Dict, List
+
+from flask_batteries_included.sqldb import db
+from she_logging import logger
+from sqlalchemy import bindparam, select
+
+from dhos_messages_api.models.message import Message
+from dhos_messages_api.models.native_uuid import to_native_uuid
+
+UUID_COLUMNS = ["uuid", "sender", "receiver", "related_message"]
+
+
+def backfill_native_uuids(batch_size: int) -> int:
+    """
+    Fills the native UUID shadow columns of every message, including soft-deleted
+    ones, from their text columns. Messages are walked in primary key order and each
+    batch is committed separately, so the table stays available throughout and the
+    backfill can be re-run safely if interrupted. Returns the number of messages.
+    """
+    table = Message.__table__
+    update = (
+        table.update()
+        .where(table.c.uuid == bindparam("_uuid"))
+        .values(
+            # Leave the modified columns alone so delta sync doesn't see every message
+            # as changed.
+            modified=table.c.modified,
+            modified_by_=table.c.modified_by_,
+            **{
+                "{}_native".format(column): bindparam("_{}_native".format(column))
+                for column in UUID_COLUMNS
+            },
+        )
+    )
+
+    last_uuid = ""
+    total = 0
+    while True:
+        rows = db.session.execute(
+            select(*(table.c[column] for column in UUID_COLUMNS))
+            .where(table.c.uuid > last_uuid)
+            .order_by(table.c.uuid)
+            .limit(batch_size)
+        ).fetchall()
+        if not rows:
+            break
+
+        params: List[Dict] = [
+            {
+                "_uuid": row.uuid,
+                **{
+                    "_{}_native".format(column): to_native_uuid(row[column])
+                    for column in UUID_COLUMNS
+                },
+            }
+            for row in rows
+        ]
+        db.session.execute(update, params)
+        db.session.commit()
+
+        last_uuid = rows[-1].uuid
+        total += len(rows)
+        logger.info("Backfilled native UUIDs for %d messages", total)
+
+    return total
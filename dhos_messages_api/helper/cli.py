@@ -1,11 +1,22 @@
+from typing import Optional
+
 import click
-from flask import Flask
+from flask import Flask, current_app
 from flask_batteries_included.helpers.apispec import generate_openapi_spec
+from flask_batteries_included.sqldb import db
 
 from dhos_messages_api import blueprint_api
+from dhos_messages_api.helper.archive import archive_messages
+from dhos_messages_api.helper.backfill import backfill_native_uuids
+from dhos_messages_api.helper.partitions import create_partitions, detach_partitions
 from dhos_messages_api.models.api_spec import dhos_messages_api_spec
 
 
+def _require_postgres() -> None:
+    if db.engine.dialect.name != "postgresql":
+        raise click.ClickException("Message partitions are only supported on Postgres")
+
+
 def add_cli_command(app: Flask) -> None:
     @app.cli.command("create-openapi")
     @click.argument("output", type=click.Path())
@@ -13,3 +24,54 @@ def add_cli_command(app: Flask) -> None:
         generate_openapi_spec(
             dhos_messages_api_spec, output, blueprint_api.api_blueprint
         )
+
+    @app.cli.command("create-partitions")
+    @click.option(
+        "--ahead",
+        type=int,
+        default=3,
+        show_default=True,
+        help="Number of future partitions to create beyond the current one",
+    )
+    def create_message_partitions(ahead: int) -> None:
+        _require_postgres()
+        for name in create_partitions(ahead):
+            click.echo("Created partition {}".format(name))
+
+    @app.cli.command("detach-partitions")
+    @click.option(
+        "--retain-months",
+        type=int,
+        required=True,
+        help="Keep partitions holding messages from this many past months",
+    )
+    @click.option("--drop", is_flag=True, help="Drop the partitions once detached")
+    def detach_message_partitions(retain_months: int, drop: bool) -> None:
+        _require_postgres()
+        for name in detach_partitions(retain_months, drop=drop):
+            click.echo(
+                "{} partition {}".format("Dropped" if drop else "Detached", name)
+            )
+
+    @app.cli.command("backfill-native-uuids")
+    @click.option("--batch-size", type=int, default=5000, show_default=True)
+    def backfill_uuids(batch_size: int) -> None:
+        total = backfill_native_uuids(batch_size)
+        click.echo("Backfilled native UUIDs for {} messages".format(total))
+
+    @app.cli.command("archive-messages")
+    @click.option(
+        "--older-than-days",
+        type=int,
+        default=None,
+        help="Archive settled messages not modified for this many days "
+        "(default MESSAGES_ARCHIVE_AFTER_DAYS)",
+    )
+    @click.option("--batch-size", type=int, default=1000, show_default=True)
+    def archive_settled_messages(
+        older_than_days: Optional[int], batch_size: int
+    ) -> None:
+        if older_than_days is None:
+            older_than_days = current_app.config["MESSAGES_ARCHIVE_AFTER_DAYS"]
+        total = archive_messages(older_than_days, batch_size)
+        click.echo("Archived {} messages".format(total))
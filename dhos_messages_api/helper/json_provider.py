@@ -0,0 +1,77 @@
+import re
+from datetime import date, datetime
+from typing import Any, Match
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from flask_batteries_included.helpers.timestamp import parse_date_to_iso8601_typesafe
+from she_logging import logger
+
+from dhos_messages_api.helper.timestamp import format_datetime
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore
+
+# Escaped by json.dumps with ensure_ascii but not by orjson.
+_NON_ASCII = re.compile(r"[^\x00-\x7e]")
+
+
+def _default(value: Any) -> Any:
+    # Same formats as flask_batteries_included's CustomJSONEncoder.
+    if isinstance(value, datetime):
+        return format_datetime(value)
+    if isinstance(value, date):
+        return parse_date_to_iso8601_typesafe(value)
+    return DefaultJSONProvider.default(value)
+
+
+def _escape(match: Match[str]) -> str:
+    # As json.dumps does, with characters outside the BMP as surrogate pairs.
+    code: int = ord(match.group())
+    if code > 0xFFFF:
+        code -= 0x10000
+        return "\\u{:04x}\\u{:04x}".format(
+            0xD800 | (code >> 10), 0xDC00 | (code & 0x3FF)
+        )
+    return "\\u{:04x}".format(code)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Writes JSON with orjson. Keys are sorted, datetimes formatted and non-ASCII
+    characters escaped as by the default provider, so responses are unchanged.
+    """
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        option: int = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        text: str = orjson.dumps(obj, default=_default, option=option).decode("utf-8")
+        if kwargs.get("ensure_ascii", self.ensure_ascii) and (
+            not text.isascii() or "\x7f" in text
+        ):
+            text = _NON_ASCII.sub(_escape, text)
+        return text
+
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+
+def init_json_provider(app: Flask) -> None:
+    """
+    Switches the app to the orjson provider when FAST_JSON is enabled and orjson is
+    installed (the `fast-json` extra).
+    """
+    if not app.config["FAST_JSON"]:
+        return
+    if orjson is None:
+        logger.info("orjson is not installed, using the default JSON provider")
+        return
+    app.json = OrjsonProvider(app)
+    logger.info("Using the orjson JSON provider")
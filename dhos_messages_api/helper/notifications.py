@@ -0,0 +1,195 @@
+import select
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Collection, Dict, Iterator, Optional
+
+from flask import Flask, current_app
+from flask_batteries_included.sqldb import db
+from she_logging import logger
+from sqlalchemy import text
+
+# The Postgres channel that message changes are published on. Each notification's
+# payload is the UUID of a participant whose messages changed.
+CHANNEL = "dhos_messages_changed"
+
+# How often the listener wakes to check its connection when there are no notifications.
+_LISTEN_POLL_SECONDS = 5.0
+
+
+class _Channel:
+    def __init__(self, lock: threading.Lock) -> None:
+        self.condition = threading.Condition(lock)
+        self.subscribers = 0
+        self.sequence = 0
+
+
+class LocalBroker:
+    """
+    Fans out notifications that a participant's messages have changed to the requests
+    in this process waiting for them. Publishing delivers straight to this process, so
+    it is only suitable for tests and a single process.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._channels: Dict[str, _Channel] = {}
+
+    def publish(self, participants: Collection[str]) -> None:
+        self.deliver(participants)
+
+    def deliver(self, participants: Collection[str]) -> None:
+        """
+        Wakes the subscribers of each participant.
+        """
+        with self._lock:
+            for participant in participants:
+                channel: Optional[_Channel] = self._channels.get(participant)
+                if channel is not None:
+                    channel.sequence += 1
+                    channel.condition.notify_all()
+
+    def deliver_all(self) -> None:
+        """
+        Wakes every subscriber, for when notifications may have been missed.
+        """
+        with self._lock:
+            participants = list(self._channels)
+        self.deliver(participants)
+
+    @contextmanager
+    def subscribe(self, participant: str) -> Iterator[Callable[[float], bool]]:
+        """
+        Subscribes to notifications for a participant. Yields a function that waits up
+        to the given number of seconds for a notification since the subscription was
+        made or the function last returned, and returns whether there was one.
+        """
+        with self._lock:
+            channel = self._channels.setdefault(participant, _Channel(self._lock))
+            channel.subscribers += 1
+            seen: int = channel.sequence
+
+        def wait(timeout: float) -> bool:
+            nonlocal seen
+            with self._lock:
+                notified: bool = channel.condition.wait_for(
+                    lambda: channel.sequence != seen, timeout
+                )
+                seen = channel.sequence
+            return notified
+
+        try:
+            yield wait
+        finally:
+            with self._lock:
+                channel.subscribers -= 1
+                if channel.subscribers == 0:
+                    del self._channels[participant]
+
+
+class PostgresBroker(LocalBroker):
+    """
+    Publishes notifications with Postgres NOTIFY, so that they reach every process.
+    Each process has a single listener connection, opened when the first request
+    subscribes, which delivers notifications to all of its subscribers.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._listener: Optional[threading.Thread] = None
+        self._listener_lock = threading.Lock()
+
+    def publish(self, participants: Collection[str]) -> None:
+        # On a connection of its own, as committing the request's session would expire
+        # the instances it has loaded.
+        with db.engine.begin() as connection:
+            connection.execute(
+                text(
+                    "SELECT pg_notify(:channel, participant) "
+                    "FROM unnest(CAST(:participants AS text[])) AS participant"
+                ),
+                {"channel": CHANNEL, "participants": list(participants)},
+            )
+
+    @contextmanager
+    def subscribe(self, participant: str) -> Iterator[Callable[[float], bool]]:
+        self._start_listener()
+        with super().subscribe(participant) as wait:
+            yield wait
+
+    def _start_listener(self) -> None:
+        with self._listener_lock:
+            if self._listener is not None:
+                return
+            self._listener = threading.Thread(
+                target=self._listen,
+                args=(db.engine,),
+                name="message-notifications",
+                daemon=True,
+            )
+            self._listener.start()
+
+    def _listen(self, engine: Any) -> None:
+        while True:
+            connection: Any = None
+            try:
+                # Detached from the pool, as it is held for the life of the process.
+                pooled = engine.raw_connection()
+                pooled.detach()
+                connection = pooled.connection
+                connection.autocommit = True
+                connection.cursor().execute("LISTEN {}".format(CHANNEL))
+                logger.info("Listening for message notifications")
+                # Anything published while not listening was missed.
+                self.deliver_all()
+                while True:
+                    if select.select([connection], [], [], _LISTEN_POLL_SECONDS)[0]:
+                        connection.poll()
+                        payloads = {notify.payload for notify in connection.notifies}
+                        connection.notifies.clear()
+                        self.deliver(payloads)
+                    else:
+                        connection.cursor().execute("SELECT 1")
+            except Exception:
+                logger.exception("Message notification listener failed, restarting")
+            finally:
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        logger.exception(
+                            "Could not close message notification listener"
+                        )
+            time.sleep(1)
+
+
+def init_notifications(app: Flask) -> None:
+    """
+    Sets up the message notification broker chosen by MESSAGE_NOTIFICATIONS.
+    """
+    backend: str = app.config["MESSAGE_NOTIFICATIONS"]
+    broker: Optional[LocalBroker] = None
+    if backend == "local":
+        broker = LocalBroker()
+    elif backend == "postgres":
+        broker = PostgresBroker()
+    app.extensions["message_notifications"] = broker
+    logger.info("Using message notifications '%s'", backend)
+
+
+def message_broker() -> Optional[LocalBroker]:
+    return current_app.extensions.get("message_notifications")
+
+
+def publish_changes(participants: Collection[str]) -> None:
+    """
+    Notifies subscribers that the participants' messages have changed. Call after
+    committing the change, so that they see it when they wake.
+    """
+    broker: Optional[LocalBroker] = message_broker()
+    if broker is None or not participants:
+        return
+    try:
+        broker.publish(participants)
+    except Exception:
+        logger.exception("Could not publish message notifications")
@@ -0,0 +1,147 @@
+import re
+from datetime import date, datetime
+from typing import List, Optional, Tuple
+
+from flask import current_app
+from flask_batteries_included.sqldb import db
+from she_logging import logger
+from sqlalchemy import text
+
+from dhos_messages_api.helper.response_cache import bump_all_versions
+
+PARTITION_PREFIX = "message_p"
+DEFAULT_PARTITION = "message_default"
+
+_BOUNDS = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def add_months(start: date, months: int) -> date:
+    """
+    Returns the first day of the month `months` months after the month of `start`.
+    """
+    month_index: int = start.year * 12 + start.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def period_start(day: date, months: int) -> date:
+    """
+    Returns the start of the partition period containing a day. Periods are `months`
+    long and aligned to the start of the year when `months` divides 12.
+    """
+    month_index: int = day.year * 12 + day.month - 1
+    month_index -= month_index % months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_ranges(first: date, last: date, months: int) -> List[Tuple[date, date]]:
+    """
+    Returns the [start, end) ranges of the partitions needed to hold every day from
+    `first` to `last` inclusive.
+    """
+    ranges: List[Tuple[date, date]] = []
+    start: date = period_start(first, months)
+    while start <= last:
+        end: date = add_months(start, months)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def partition_name(start: date) -> str:
+    return "{}{:%Y_%m}".format(PARTITION_PREFIX, start)
+
+
+def create_partition_sql(start: date, end: date, parent: str = "message") -> str:
+    return (
+        "CREATE TABLE IF NOT EXISTS {} PARTITION OF {} "
+        "FOR VALUES FROM ('{}') TO ('{}')".format(
+            partition_name(start), parent, start.isoformat(), end.isoformat()
+        )
+    )
+
+
+def list_partitions() -> List[Tuple[str, datetime, datetime]]:
+    """
+    Returns the name and [start, end) bounds of each range partition of the message
+    table, oldest first. The default partition is not included.
+    """
+    rows = db.session.execute(
+        text(
+            "SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) "
+            "FROM pg_inherits "
+            "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+            "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+            "WHERE parent.relname = 'message'"
+        )
+    ).fetchall()
+
+    partitions: List[Tuple[str, datetime, datetime]] = []
+    for name, bound in rows:
+        match = _BOUNDS.search(bound)
+        if match is not None:
+            partitions.append(
+                (
+                    name,
+                    datetime.fromisoformat(match.group(1)),
+                    datetime.fromisoformat(match.group(2)),
+                )
+            )
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def create_partitions(ahead: int, today: Optional[date] = None) -> List[str]:
+    """
+    Creates any missing partitions from the current period up to `ahead` periods in
+    the future, so that new messages never land in the default partition. Returns
+    the names of the partitions that were created.
+    """
+    months: int = current_app.config["MESSAGES_PARTITION_MONTHS"]
+    today = today or date.today()
+    existing = list_partitions()
+
+    created: List[str] = []
+    for start, end in partition_ranges(
+        today, add_months(period_start(today, months), ahead * months), months
+    ):
+        # Skip periods already covered, which may have been created with a different
+        # MESSAGES_PARTITION_MONTHS.
+        if any(
+            existing_start.date() < end and start < existing_end.date()
+            for _, existing_start, existing_end in existing
+        ):
+            continue
+        name: str = partition_name(start)
+        db.session.execute(text(create_partition_sql(start, end)))
+        logger.info("Created partition %s for %s to %s", name, start, end)
+        created.append(name)
+    db.session.commit()
+    return created
+
+
+def detach_partitions(
+    retain_months: int, drop: bool = False, today: Optional[date] = None
+) -> List[str]:
+    """
+    Detaches the partitions holding only messages created more than `retain_months`
+    months before the start of the current month, and drops them if asked. This is
+    how old messages are removed: whole partitions at a time rather than by deleting
+    rows. Returns the names of the partitions detached.
+    """
+    cutoff = datetime.combine(
+        add_months((today or date.today()).replace(day=1), -retain_months),
+        datetime.min.time(),
+    )
+
+    detached: List[str] = []
+    for name, _, end in list_partitions():
+        if end > cutoff:
+            continue
+        db.session.execute(text("ALTER TABLE message DETACH PARTITION {}".format(name)))
+        if drop:
+            db.session.execute(text("DROP TABLE {}".format(name)))
+        logger.info("%s partition %s", "Dropped" if drop else "Detached", name)
+        detached.append(name)
+    db.session.commit()
+    if detached:
+        bump_all_versions()
+    return detached
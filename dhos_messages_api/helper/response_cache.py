@@ -0,0 +1,251 @@
+import hashlib
+import json
+import threading
+import time
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+
+import redis
+from flask import Flask, Response, current_app, g, request
+from she_logging import logger
+
+F = TypeVar("F", bound=Callable[..., Response])
+
+_PREFIX = "dhos-messages:"
+_GENERATION_KEY = _PREFIX + "generation"
+# Response headers that are stored along with a cached body.
+_CACHED_HEADERS = ("ETag", "X-Next-Cursor")
+# How long a stale response may be served while one request refreshes it, should that
+# request fail without releasing its lock.
+_REFRESH_LOCK_SECONDS = 30
+
+
+class LocalCache:
+    """
+    An in-process stand-in for Redis, for tests and running without one. Implements
+    just the subset of the redis-py client API used by the response cache.
+    """
+
+    def __init__(self) -> None:
+        self._values: Dict[str, Tuple[bytes, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name: str) -> Optional[bytes]:
+        value, expires = self._values.get(name, (None, None))
+        if expires is not None and expires <= time.monotonic():
+            del self._values[name]
+            return None
+        return value
+
+    def get(self, name: str) -> Optional[bytes]:
+        with self._lock:
+            return self._get(name)
+
+    def mget(self, keys: List[str]) -> List[Optional[bytes]]:
+        with self._lock:
+            return [self._get(name) for name in keys]
+
+    def set(
+        self, name: str, value: bytes, ex: Optional[int] = None, nx: bool = False
+    ) -> Optional[bool]:
+        with self._lock:
+            if nx and self._get(name) is not None:
+                return None
+            expires = None if ex is None else time.monotonic() + ex
+            self._values[name] = (value, expires)
+            return True
+
+    def incr(self, name: str) -> int:
+        with self._lock:
+            value = int(self._get(name) or 0) + 1
+            self._values[name] = (str(value).encode(), None)
+            return value
+
+    def delete(self, *names: str) -> int:
+        with self._lock:
+            return sum(self._values.pop(name, None) is not None for name in names)
+
+
+def init_response_cache(app: Flask) -> None:
+    """
+    Sets up the response cache chosen by RESPONSE_CACHE.
+    """
+    backend: str = app.config["RESPONSE_CACHE"]
+    cache: Any = None
+    if backend == "local":
+        cache = LocalCache()
+    elif backend == "redis":
+        cache = redis.Redis(
+            host=app.config["REDIS_HOST"],
+            port=app.config["REDIS_PORT"],
+            password=app.config["REDIS_PASSWORD"],
+            socket_timeout=app.config["REDIS_TIMEOUT"],
+        )
+    app.extensions["response_cache"] = cache
+    logger.info("Using response cache '%s'", backend)
+
+
+def _cache() -> Any:
+    return current_app.extensions.get("response_cache")
+
+
+def response_cache_enabled() -> bool:
+    return _cache() is not None
+
+
+def _version_key(participant: str) -> str:
+    return "{}version:{}".format(_PREFIX, participant)
+
+
+def bump_versions(participants: Iterable[str]) -> None:
+    """
+    Invalidates the cached responses of the participants of changed messages. Call
+    after committing the change, so that no response read before it is cached under
+    the new version.
+    """
+    cache = _cache()
+    if cache is None:
+        return
+    try:
+        for participant in set(participants):
+            cache.incr(_version_key(participant))
+    except redis.RedisError:
+        logger.exception("Could not invalidate cached responses")
+
+
+def bump_all_versions() -> None:
+    """
+    Invalidates every cached response, for changes whose participants are unknown.
+    """
+    cache = _cache()
+    if cache is None:
+        return
+    try:
+        cache.incr(_GENERATION_KEY)
+    except redis.RedisError:
+        logger.exception("Could not invalidate cached responses")
+
+
+def caller_fingerprint() -> str:
+    """
+    Identifies everything other than the URL path that a response depends on: the
+    query string, the caller's locations and the caller's claims and scopes.
+    """
+    variant = json.dumps(
+        [
+            sorted(request.args.items(multi=True)),
+            request.headers.get("X-Location-Ids"),
+            getattr(g, "jwt_claims", None),
+            sorted(getattr(g, "jwt_scopes", None) or []),
+        ],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha1(variant.encode(), usedforsecurity=False).hexdigest()
+
+
+def _to_response(entry: Dict) -> Response:
+    etag: Optional[str] = entry["headers"].get("ETag")
+    if etag is not None and request.if_none_match.contains_raw(etag):
+        response = Response(status=304)
+    else:
+        response = Response(entry["body"], mimetype=entry["mimetype"])
+    response.headers.update(entry["headers"])
+    return response
+
+
+def _load(cache: Any, participants: List[str]) -> Tuple[str, str, Optional[Dict]]:
+    versions: List[Optional[bytes]] = cache.mget(
+        [_GENERATION_KEY] + [_version_key(participant) for participant in participants]
+    )
+    version = ":".join((value or b"0").decode() for value in versions)
+    key = "{}response:{}:{}:{}".format(
+        _PREFIX, request.endpoint, ":".join(participants), caller_fingerprint()
+    )
+    stored: Optional[bytes] = cache.get(key)
+    return version, key, None if stored is None else json.loads(stored)
+
+
+def _store(cache: Any, key: str, version: str, response: Response) -> None:
+    entry = {
+        "version": version,
+        "mimetype": response.mimetype,
+        "headers": {
+            header: response.headers[header]
+            for header in _CACHED_HEADERS
+            if header in response.headers
+        },
+        "body": response.get_data(as_text=True),
+    }
+    try:
+        cache.set(
+            key, json.dumps(entry).encode(), ex=current_app.config["RESPONSE_CACHE_TTL"]
+        )
+    except redis.RedisError:
+        logger.exception("Could not cache response")
+
+
+def _unlock(cache: Any, lock_key: str) -> None:
+    try:
+        cache.delete(lock_key)
+    except redis.RedisError:
+        logger.exception("Could not unlock cached response")
+
+
+def cached_response(*participant_args: str) -> Callable[[F], F]:
+    """
+    Caches the responses of a list endpoint by endpoint, participants (the named URL
+    arguments) and caller. Each cached response records the version counters of its
+    participants, which `bump_versions` increments when their messages change, so an
+    unchanged list is served without querying the database.
+
+    With RESPONSE_CACHE_STALE_WHILE_REVALIDATE, while one request refreshes an
+    outdated response, concurrent requests are given the outdated one rather than
+    also querying the database.
+    """
+
+    def decorator(view: F) -> F:
+        @wraps(view)
+        def wrapper(**kwargs: Any) -> Response:
+            cache = _cache()
+            if cache is None:
+                return view(**kwargs)
+            participants: List[str] = [kwargs[arg] for arg in participant_args]
+
+            try:
+                version, key, entry = _load(cache, participants)
+            except redis.RedisError:
+                logger.exception("Could not read cached response")
+                return view(**kwargs)
+            if entry is not None and entry["version"] == version:
+                return _to_response(entry)
+
+            lock_key: Optional[str] = None
+            if (
+                entry is not None
+                and current_app.config["RESPONSE_CACHE_STALE_WHILE_REVALIDATE"]
+            ):
+                lock_key = key + ":refresh"
+                try:
+                    locked = cache.set(
+                        lock_key, b"1", ex=_REFRESH_LOCK_SECONDS, nx=True
+                    )
+                except redis.RedisError:
+                    logger.exception("Could not lock cached response")
+                    lock_key, locked = None, True
+                if not locked:
+                    # Another request is already refreshing it.
+                    return _to_response(entry)
+
+            try:
+                response: Response = view(**kwargs)
+                if response.status_code == 200 and not response.direct_passthrough:
+                    _store(cache, key, version, response)
+            finally:
+                if lock_key is not None:
+                    _unlock(cache, lock_key)
+            return response
+
+        return wrapper  # type: ignore
+
+    return decorator
@@ -1,10 +1,11 @@
 from typing import Any, Dict, List, Optional, Tuple
 
 import connexion
-from flask import request
+from flask import abort, request
 from she_logging import logger
 
-from dhos_messages_api.models.message import Message
+from dhos_messages_api.models.message import Message, load_message_or_404
+from dhos_messages_api.query.filters import any_of
 
 
 def get_clinician_locations() -> List[str]:
@@ -80,8 +81,44 @@ def message_by_id_protection(
 ) -> bool:
     ids_to_validate, user_types = get_ids_to_validate(jwt_claims)
 
-    message = Message.query.filter_by(uuid=params["message_id"]).first_or_404()
+    # Archived messages can still be read, so the check is made against them too.
+    message = load_message_or_404(params["message_id"], include_archived=True)
 
+    return _is_participant(message, ids_to_validate, user_types)
+
+
+def message_list_protection(
+    jwt_claims: Dict, claims_map: Optional[Dict], **params: Any
+) -> bool:
+    # Every message in the request body must pass the single message check, which is
+    # made against all of them at once
+    message_uuids: List[str] = [
+        message_update["uuid"] for message_update in connexion.request.get_json()
+    ]
+    ids_to_validate, user_types = get_ids_to_validate(jwt_claims)
+
+    messages: List[Message] = (
+        Message.query.filter(any_of(Message.uuid, message_uuids))
+        .with_entities(
+            Message.uuid,
+            Message.sender,
+            Message.sender_type,
+            Message.receiver,
+            Message.receiver_type,
+        )
+        .all()
+    )
+    if len(messages) < len(set(message_uuids)):
+        abort(404)
+
+    return all(
+        _is_participant(message, ids_to_validate, user_types) for message in messages
+    )
+
+
+def _is_participant(
+    message: Any, ids_to_validate: List[str], user_types: List[str]
+) -> bool:
     for id_to_validate in ids_to_validate:
         if (message.sender == id_to_validate and message.sender_type in user_types) or (
             message.receiver == id_to_validate and message.receiver_type in user_types
@@ -98,6 +135,17 @@ def sender_receiver_protection(
     return ids_match(ids, jwt_claims, claims_map, **params)
 
 
+def receiver_list_protection(
+    jwt_claims: Dict, claims_map: Optional[Dict], **params: Any
+) -> bool:
+    # Every receiver in the request body must pass the single receiver check
+    receiver_ids: List[str] = connexion.request.get_json()
+    return all(
+        ids_match(["receiver_id"], jwt_claims, claims_map, receiver_id=receiver_id)
+        for receiver_id in receiver_ids
+    )
+
+
 def sender_or_receiver_protection(
     jwt_claims: Dict, claims_map: Optional[Dict], **params: Any
 ) -> bool:
@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+from flask_batteries_included.helpers.timestamp import (
+    join_timestamp,
+    parse_datetime_to_iso8601_typesafe,
+)
+
+
+def offset_suffix(offset: int) -> str:
+    """
+    Formats a UTC offset in seconds as parse_datetime_to_iso8601 does: "Z" for UTC,
+    otherwise e.g. "+01:00".
+    """
+    if offset == 0:
+        return "Z"
+    hours, minutes = divmod(abs(offset) // 60, 60)
+    return "{}{:02d}:{:02d}".format("-" if offset < 0 else "+", hours, minutes)
+
+
+def format_datetime(value: datetime) -> str:
+    """
+    A faster equivalent of parse_datetime_to_iso8601, producing identical output. The
+    rare cases isoformat() writes differently (years before 1000, offsets that are
+    not whole minutes) are handed to parse_datetime_to_iso8601.
+    """
+    offset = value.utcoffset()
+    if value.year < 1000 or (
+        offset is not None and (offset.microseconds or offset.seconds % 60)
+    ):
+        return parse_datetime_to_iso8601_typesafe(value)
+    text: str = value.replace(tzinfo=None).isoformat(timespec="milliseconds")
+    if offset is None:
+        return text
+    return text + offset_suffix(int(offset.total_seconds()))
+
+
+def format_local_timestamp(value: datetime, offset: int) -> str:
+    """
+    Formats a timestamp stored as UTC with a separate offset in seconds, as
+    join_timestamp followed by parse_datetime_to_iso8601 would.
+    """
+    local: datetime = value + timedelta(seconds=offset)
+    if offset % 60 or local.year < 1000:
+        return parse_datetime_to_iso8601_typesafe(join_timestamp(value, offset))
+    return local.isoformat(timespec="milliseconds") + offset_suffix(offset)
@@ -0,0 +1,113 @@
+from typing import Any, Dict, FrozenSet, Optional, Tuple
+
+from flask import Flask, current_app
+from flask_batteries_included.config import is_production_environment
+from flask_batteries_included.sqldb import generate_uuid
+from she_logging import logger
+
+from dhos_messages_api.models.message import Message
+from dhos_messages_api.models.message_type import get_message_type
+
+
+class MessageValidator:
+    """
+    Validates and builds new messages. The property sets are worked out once, so each
+    message is checked in a single pass over its properties.
+    """
+
+    def __init__(self, required: Tuple[str, ...], allowed: FrozenSet[str]) -> None:
+        self.required: Tuple[str, ...] = required
+        self.allowed: FrozenSet[str] = allowed
+
+    def build(self, message_details: Dict) -> Message:
+        """
+        Validates the details of a new message, returning it unsaved. Errors are
+        reported in order of precedence: an unknown property, then a missing required
+        property, as KeyError; then the first invalid property sent, as KeyError,
+        TypeError or ValueError.
+        """
+        insert = Message()
+        message_type_id: Optional[int] = None
+        # The first invalid property is only raised once no error of higher precedence
+        # can turn up, so keep scanning for unknown properties after it is found.
+        error: Optional[Exception] = None
+        for sent_property, value in message_details.items():
+            if sent_property not in self.allowed:
+                raise KeyError(
+                    "Property '{}' not found in schema".format(sent_property)
+                )
+            if error is not None:
+                continue
+            try:
+                if len(value) == 0:
+                    raise KeyError(
+                        "Empty fields should not be sent, property '{}' is empty".format(
+                            sent_property
+                        )
+                    )
+                if sent_property == "message_type":
+                    if get_message_type(value["value"]) is None:
+                        raise KeyError(
+                            "Property 'message_type' must contain a valid value, {} received".format(
+                                value["value"]
+                            )
+                        )
+                    message_type_id = value["value"]
+                else:
+                    insert.set_property(sent_property, value)
+            except (KeyError, TypeError, ValueError) as e:
+                error = e
+
+        for required_property in self.required:
+            value = message_details.get(required_property)
+            if value is None or len(str(value)) == 0:
+                raise KeyError(
+                    "Property '{}' must contain a valid value".format(required_property)
+                )
+
+        if error is not None:
+            raise error
+
+        insert.uuid = generate_uuid()
+        insert.message_type_id = message_type_id
+        return insert
+
+
+def compile_message_validator() -> MessageValidator:
+    """
+    Compiles a message validator from the MessageRequest schema in the API spec.
+    Builtin properties may also be sent outside production.
+    """
+    # Imported here as the API spec imports the controller, which uses the validator.
+    from dhos_messages_api.models.api_spec import MessageRequest
+
+    required: Tuple[str, ...] = tuple(
+        name for name, field in MessageRequest().fields.items() if field.required
+    )
+    schema: Dict[str, Dict[str, Any]] = Message.schema()
+    allowed = set(required) | set(schema["optional"])
+    if not is_production_environment():
+        allowed |= set(schema["builtin"])
+    return MessageValidator(required=required, allowed=frozenset(allowed))
+
+
+def init_message_validator(app: Flask) -> None:
+    """
+    Compiles the message validator for the app.
+    """
+    app.extensions["message_validator"] = compile_message_validator()
+    logger.debug("Compiled message validator")
+
+
+def message_validator() -> MessageValidator:
+    """
+    Returns the message validator of the current app, compiling it on first use.
+    """
+    validator: Optional[MessageValidator] = current_app.extensions.get(
+        "message_validator"
+    )
+    if validator is None:
+        validator = current_app.extensions[
+            "message_validator"
+        ] = compile_message_validator()
+    return validator
@@ -1,4 +1,4 @@
-from typing import TypedDict
+from typing import List, Optional, TypedDict
 
 from apispec import APISpec
 from apispec.ext.marshmallow import MarshmallowPlugin
@@ -114,6 +114,166 @@ class MessageResponse(MessageSchema, Identifier):
             pass
 
 
+@openapi_schema(dhos_messages_api_spec)
+class MessageBatchResult(Schema):
+    class Meta:
+        title = "Result of creating one message in a batch"
+        unknown = EXCLUDE
+        ordered = True
+
+        class Dict(TypedDict, total=False):
+            status: int
+            message: MessageResponse.Meta.Dict
+            error: str
+
+    status = fields.Int(
+        required=True,
+        example=200,
+        description="200 if the message was created, 400 if it was invalid or 403 if the caller may not send it",
+    )
+    message = fields.Nested(
+        MessageResponse,
+        required=False,
+        description="The new message, if it was created",
+    )
+    error = fields.String(
+        required=False,
+        example="'Property 'content' must contain a valid value'",
+        description="Why the message was not created",
+    )
+
+
+@openapi_schema(dhos_messages_api_spec)
+class MessageTombstone(Schema):
+    class Meta:
+        title = "Deleted message"
+        unknown = EXCLUDE
+        ordered = True
+
+        class Dict(TypedDict, total=False):
+            uuid: str
+            deleted: str
+
+    uuid = fields.String(
+        required=True,
+        example="18439f36-ffa9-42ae-90de-0beda299cd37",
+        description="The UUID of the deleted message",
+    )
+    deleted = fields.String(
+        required=True,
+        example="2018-02-11T11:59:50.123",
+        description="The UTC timestamp at which the message was deleted",
+    )
+
+
+@openapi_schema(dhos_messages_api_spec)
+class MessageSyncResponse(Schema):
+    class Meta:
+        title = "Message sync response"
+        unknown = EXCLUDE
+        ordered = True
+
+        class Dict(TypedDict, total=False):
+            messages: List[MessageResponse.Meta.Dict]
+            deleted: List[MessageTombstone.Meta.Dict]
+            watermark: Optional[str]
+
+    messages = fields.List(
+        fields.Nested(MessageResponse),
+        required=True,
+        description="Messages created or modified since the watermark, oldest first. "
+        "Recent messages may be returned again on the next sync.",
+    )
+    deleted = fields.List(
+        fields.Nested(MessageTombstone),
+        required=True,
+        description="Messages deleted since the watermark. Recent tombstones may be "
+        "returned again on the next sync.",
+    )
+    watermark = fields.String(
+        required=True,
+        allow_none=True,
+        example="2018-02-11T11:59:50.123456+00:00",
+        description="The watermark to send as `since` on the next sync",
+    )
+
+
+@openapi_schema(dhos_messages_api_spec)
+class MessageCounts(Schema):
+    class Meta:
+        title = "Message counts for a receiver"
+        unknown = EXCLUDE
+        ordered = True
+
+        class Dict(TypedDict, total=False):
+            receiver: str
+            unread: int
+            active: int
+            callback: int
+
+    receiver = fields.String(
+        required=True,
+        example="18439f36-ffa9-42ae-90de-0beda299cd37",
+        description="The UUID of the receiver",
+    )
+    unread = fields.Int(
+        required=True,
+        example=3,
+        description="The number of messages not yet retrieved by the receiver",
+    )
+    active = fields.Int(
+        required=True,
+        example=2,
+        description="The number of unconfirmed messages and callbacks",
+    )
+    callback = fields.Int(
+        required=True,
+        example=1,
+        description="The number of callback requests not yet confirmed or cancelled",
+    )
+
+
+@openapi_schema(dhos_messages_api_spec)
+class InboxEntry(Schema):
+    class Meta:
+        title = "Inbox conversation summary"
+        unknown = EXCLUDE
+        ordered = True
+
+        class Dict(TypedDict, total=False):
+            counterparty: str
+            counterparty_type: str
+            last_activity: str
+            unread: int
+            latest_message: MessageResponse.Meta.Dict
+
+    counterparty = fields.String(
+        required=True,
+        example="74780805-0a75-4bc3-99fb-3e3a64986cac",
+        description="The UUID of the other party in the conversation",
+    )
+    counterparty_type = fields.String(
+        required=True,
+        example="patient",
+        description="The type of the other party in the conversation",
+    )
+    last_activity = fields.String(
+        required=True,
+        example="2018-02-11T11:59:50.123Z",
+        description="The UTC timestamp of the latest message in the conversation",
+    )
+    unread = fields.Int(
+        required=True,
+        example=2,
+        description="The number of messages in the conversation not yet retrieved by the inbox owner",
+    )
+    latest_message = fields.Nested(
+        MessageResponse,
+        required=True,
+        description="The latest message in the conversation",
+    )
+
+
 @openapi_schema(dhos_messages_api_spec)
 class MessagePatchRequest(Schema):
     class Meta:
@@ -164,3 +324,66 @@ class MessagePatchRequest(Schema):
         description="The UUID of the user who cancelled the message",
         validate=not_empty,
     )
+
+
+@openapi_schema(dhos_messages_api_spec)
+class MessageBulkPatchRequest(Schema):
+    class Meta:
+        title = "Message bulk PATCH request item"
+        ordered = True
+
+        class Dict(TypedDict, total=False):
+            uuid: str
+            changes: MessagePatchRequest.Meta.Dict
+
+    uuid = fields.String(
+        required=True,
+        example="18439f36-ffa9-42ae-90de-0beda299cd37",
+        description="The UUID of the message to update",
+        validate=not_empty,
+    )
+    changes = fields.Nested(
+        MessagePatchRequest,
+        required=True,
+        description="The fields to update",
+    )
+
+
+@openapi_schema(dhos_messages_api_spec)
+class MessageRetrievedRequest(Schema):
+    class Meta:
+        title = "Message retrieved watermark request"
+        ordered = True
+
+        class Dict(TypedDict, total=False):
+            retrieved: str
+
+    retrieved = fields.String(
+        required=True,
+        example="2018-02-11T11:59:50.123+03:00",
+        description="The timezone-aware timestamp up to which all messages have been retrieved",
+        validate=not_empty,
+    )
+
+
+@openapi_schema(dhos_messages_api_spec)
+class MessageRetrievedResponse(Schema):
+    class Meta:
+        title = "Message retrieved watermark response"
+        unknown = EXCLUDE
+        ordered = True
+
+        class Dict(TypedDict, total=False):
+            receiver: str
+            updated: int
+
+    receiver = fields.String(
+        required=True,
+        example="18439f36-ffa9-42ae-90de-0beda299cd37",
+        description="The UUID of the receiver",
+    )
+    updated = fields.Int(
+        required=True,
+        example=3,
+        description="The number of messages marked as retrieved",
+    )
@@ -1,24 +1,77 @@
-from datetime import datetime
-from typing import Any, Dict
+from datetime import datetime, timezone
+from typing import Any, Collection, Dict, List, Optional, Set, Tuple
 
+from flask import abort, g
 from flask_batteries_included.helpers.timestamp import (
     join_timestamp,
     parse_datetime_to_iso8601,
     split_timestamp,
 )
-from flask_batteries_included.sqldb import ModelIdentifier, db
+from flask_batteries_included.sqldb import ModelIdentifier, db, generate_uuid
+from sqlalchemy import select
+from sqlalchemy.orm import Load, Query, load_only, query_expression
+from sqlalchemy.sql import visitors
+from sqlalchemy.sql.elements import ColumnElement
 
-from dhos_messages_api.models.message_type import MessageType
+from dhos_messages_api.models.message_type import (
+    CALLBACK_MESSAGE_TYPE,
+    get_message_type,
+)
+from dhos_messages_api.models.native_uuid import NativeUUID, UUIDText
 from dhos_messages_api.query.softdelete import QueryWithSoftDelete
 
+# The columns that must be loaded to serialise each field of `Message.to_dict`.
+_FIELD_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "sender": ("sender",),
+    "sender_type": ("sender_type",),
+    "receiver": ("receiver",),
+    "receiver_type": ("receiver_type",),
+    "message_type": ("message_type_id",),
+    "content": ("content",),
+    "retrieved": ("retrieved", "retrieved_tz"),
+    "confirmed": ("confirmed", "confirmed_tz"),
+    "confirmed_by": ("confirmed_by",),
+    "related_message": ("related_message",),
+    "cancelled": ("cancelled", "cancelled_tz"),
+    "cancelled_by": ("cancelled_by",),
+    "internal": ("internal",),
+    "deleted": ("deleted",),
+    "uuid": ("uuid",),
+    "created": ("created",),
+    "created_by": ("created_by_",),
+    "modified": ("modified",),
+    "modified_by": ("modified_by_",),
+}
+
+
+def _partial_index(name: str, *columns: Any, where: Any) -> db.Index:
+    return db.Index(name, *columns, postgresql_where=where, sqlite_where=where)
+
 
 class Message(ModelIdentifier, db.Model):
     query_class = QueryWithSoftDelete
+    __table_args__ = (
+        # Supports delta sync, which polls a receiver's messages by modified time.
+        db.Index("message_receiver_modified_index", "receiver", "modified"),
+        # Match the keyset order of paginated lists, so each page is read in order.
+        db.Index("message_receiver_created_index", "receiver", "created", "uuid"),
+        db.Index("message_sender_created_index", "sender", "created", "uuid"),
+        {"postgresql_partition_by": "RANGE (created)"},
+    )
+
+    uuid = db.Column(UUIDText(length=36), primary_key=True, default=generate_uuid)
+    # The partition key has to be part of the table's primary key, but messages are
+    # still identified by uuid alone. As the key no longer makes uuids unique on
+    # Postgres, the message_guard_unique_uuid trigger rejects duplicate inserts.
+    created = db.Column(
+        db.DateTime, primary_key=True, nullable=False, default=datetime.utcnow
+    )
+    __mapper_args__ = {"primary_key": [uuid]}
 
     # required
-    sender = db.Column(db.String, unique=False, nullable=False, index=True)
+    sender = db.Column(UUIDText, unique=False, nullable=False, index=True)
     sender_type = db.Column(db.String, unique=False, nullable=False, index=True)
-    receiver = db.Column(db.String, unique=False, nullable=False, index=True)
+    receiver = db.Column(UUIDText, unique=False, nullable=False, index=True)
     receiver_type = db.Column(db.String, unique=False, nullable=False, index=True)
 
     content = db.Column(db.String, unique=False, nullable=False)
@@ -35,19 +88,74 @@ class Message(ModelIdentifier, db.Model):
     cancelled_by = db.Column(db.String, unique=False, nullable=True)
 
     confirmed_by = db.Column(db.String, unique=False, nullable=True)
-    related_message = db.Column(db.String, unique=False, nullable=True)
+    related_message = db.Column(UUIDText, unique=False, nullable=True, index=True)
 
     internal = db.Column(db.String, unique=False, nullable=True)
 
     # system
     deleted = db.Column(db.DateTime, unique=False, nullable=True)
 
-    # relationship
+    # Native UUID copies of the UUID text columns, kept in step by a database trigger
+    # and filled for existing rows by `flask backfill-native-uuids`. See UUIDText.
+    uuid_native = db.Column(NativeUUID, unique=False, nullable=True, index=True)
+    sender_native = db.Column(NativeUUID, unique=False, nullable=True, index=True)
+    receiver_native = db.Column(NativeUUID, unique=False, nullable=True, index=True)
+    related_message_native = db.Column(
+        NativeUUID, unique=False, nullable=True, index=True
+    )
+
+    # Serialised from the in-process message type registry rather than joined.
     message_type_id = db.Column(db.Integer, db.ForeignKey("message_type.value"))
-    message_type = db.relationship("MessageType", lazy="joined")
 
     db.Index("message_type_index", message_type_id)
 
+    # Partial indexes matching the active and open callback list queries, so that each
+    # is answered from a single index. The predicates must stay in step with
+    # active_message_filter and open_callback_filter.
+    _partial_index(
+        "message_active_receiver_index",
+        receiver,
+        receiver_type,
+        where=deleted.is_(None)
+        & (confirmed.is_(None) | (message_type_id == CALLBACK_MESSAGE_TYPE)),
+    )
+    _partial_index(
+        "message_active_sender_index",
+        sender,
+        sender_type,
+        where=deleted.is_(None)
+        & (confirmed.is_(None) | (message_type_id == CALLBACK_MESSAGE_TYPE)),
+    )
+    _partial_index(
+        "message_open_callback_receiver_index",
+        receiver,
+        receiver_type,
+        where=deleted.is_(None)
+        & confirmed.is_(None)
+        & cancelled.is_(None)
+        & (message_type_id == CALLBACK_MESSAGE_TYPE),
+    )
+    _partial_index(
+        "message_open_callback_sender_index",
+        sender,
+        where=deleted.is_(None)
+        & confirmed.is_(None)
+        & cancelled.is_(None)
+        & (message_type_id == CALLBACK_MESSAGE_TYPE),
+    )
+
+    # Supports marking everything a receiver has read as retrieved in one UPDATE.
+    _partial_index(
+        "message_unretrieved_receiver_index",
+        receiver,
+        receiver_type,
+        created,
+        where=deleted.is_(None) & retrieved.is_(None),
+    )
+
+    # Only populated by queries that ask for it with `with_expression`.
+    unread_count = query_expression()
+
     @staticmethod
     def schema() -> Dict:
         return {
@@ -86,26 +194,57 @@ class Message(ModelIdentifier, db.Model):
             },
         }
 
-    def to_dict(self) -> Dict:
+    @staticmethod
+    def load_fields(fields: Collection[str]) -> List[Load]:
+        """
+        Returns query options that load only the columns needed to serialise the
+        given fields, deferring the rest (notably `content`) so they are never read.
+        """
+        columns: List[str] = ["uuid", "created"]
+        for field in fields:
+            if field not in _FIELD_COLUMNS:
+                raise KeyError("Field '{}' not found in schema".format(field))
+            columns.extend(_FIELD_COLUMNS[field])
+
+        return [load_only(*columns)]
+
+    def to_dict(self, fields: Optional[Collection[str]] = None) -> Dict:
+        """
+        Serialises the message. If `fields` is given only those fields are included,
+        and no other attributes are accessed, so they can be left unloaded.
+        """
         schema = self.schema()
-        message = {}
+        message: Dict[str, Any] = {}
         for key in schema["required"]:
+            if fields is not None and key not in fields:
+                continue
             if key == "message_type":
-                message[key] = self.message_type.to_dict()
+                message[key] = get_message_type(self.message_type_id)
             else:
                 message[key] = getattr(self, key)
 
         for key in schema["optional"]:
+            if fields is not None and key not in fields:
+                continue
             value = getattr(self, key)
             if key in ("retrieved", "confirmed", "cancelled") and value is not None:
                 value = join_timestamp(value, getattr(self, "{}_tz".format(key)))
             if value is not None or key == "confirmed":
                 message[key] = value
 
-        if self.deleted is not None:
+        if (fields is None or "deleted" in fields) and self.deleted is not None:
             message["deleted"] = parse_datetime_to_iso8601(self.deleted)
 
-        return {**message, **self.pack_identifier()}
+        if fields is None:
+            return {**message, **self.pack_identifier()}
+
+        for key in ("uuid", "created", "created_by", "modified", "modified_by"):
+            if key in fields:
+                value = getattr(self, key)
+                if key in ("created", "modified") and value is not None:
+                    value = value.replace(tzinfo=timezone.utc)
+                message[key] = value
+        return message
 
     def delete(self) -> None:
         self.deleted = datetime.utcnow()
@@ -117,22 +256,163 @@ class Message(ModelIdentifier, db.Model):
                     "Cannot set property related_message, "
                     "circular reference to parent."
                 )
-            message = Message.query.filter_by(uuid=value).first()
-            if message is None:
+            if load_message(value) is None and not is_archived(value):
                 raise KeyError(self.invalid_value_error(key, value))
 
         if key == "message_type":
-            original_value = value
-            value = MessageType.query.filter_by(value=value).first()
-            if not value:
-                raise KeyError(self.invalid_value_error(key, original_value))
+            if get_message_type(value) is None:
+                raise KeyError(self.invalid_value_error(key, value))
+
+        for column, column_value in self.column_values(key, value).items():
+            setattr(self, column, column_value)
 
+    @staticmethod
+    def column_values(key: str, value: Any) -> Dict[str, Any]:
+        """
+        The column values that store a property, e.g. a timestamp and its offset.
+        """
+        if key == "message_type":
+            return {"message_type_id": value}
         if key in ["retrieved", "confirmed", "cancelled"]:
             ts, tz = split_timestamp(value)
-            setattr(self, key, ts)
-            setattr(self, "{}_tz".format(key), tz)
-            return
-        setattr(self, key, value)
+            return {key: ts, "{}_tz".format(key): tz}
+        if key in ["created", "modified"]:
+            return {key: split_timestamp(value)[0]}
+        return {key: value}
 
     def invalid_value_error(self, key: str, value: Any) -> str:
         return "Cannot set '{}' as '{}' is an invalid value.".format(key, value)
+
+
+def active_message_filter() -> ColumnElement:
+    """
+    Messages that still need attention: unconfirmed messages, and all callbacks.
+    """
+    return (Message.confirmed.is_(None)) | (
+        Message.message_type_id == CALLBACK_MESSAGE_TYPE
+    )
+
+
+def open_callback_filter() -> ColumnElement:
+    """
+    Callback requests that have been neither confirmed nor cancelled.
+    """
+    return (
+        (Message.confirmed.is_(None))
+        & (Message.cancelled.is_(None))
+        & (Message.message_type_id == CALLBACK_MESSAGE_TYPE)
+    )
+
+
+def message_entity(messages: Query) -> Any:
+    """
+    Returns the entity a message query reads from: Message itself, or an alias of it
+    such as the one `include_archived_messages` returns. Columns used to filter, order
+    or select from the query must be taken from it.
+    """
+    for description in messages.column_descriptions:
+        if description["entity"] is not None:
+            return description["entity"]
+    return Message
+
+
+def load_message(
+    message_uuid: str, include_archived: bool = False
+) -> Optional[Message]:
+    """
+    Loads a message by UUID. The result, including a miss, is kept on `flask.g` until
+    the end of the request, so a route's protection function, its controller and
+    `related_message` checks share a single query.
+
+    With `include_archived`, a message that is not found is looked for in the archive
+    too. An archived message is not added to the session, so it is read-only.
+    """
+    loaded: Dict[str, Optional[Message]] = g.setdefault("loaded_messages", {})
+    # A message loaded outside a request may outlive the session it was loaded in.
+    if message_uuid not in loaded or (
+        loaded[message_uuid] is not None and loaded[message_uuid] not in db.session
+    ):
+        loaded[message_uuid] = Message.query.filter_by(uuid=message_uuid).first()
+    if loaded[message_uuid] is not None or not include_archived:
+        return loaded[message_uuid]
+
+    archived: Dict[str, Optional[Message]] = g.setdefault("archived_messages", {})
+    if message_uuid not in archived:
+        row = db.session.execute(
+            select(message_archive).where(message_archive.c.uuid == message_uuid)
+        ).first()
+        archived[message_uuid] = None if row is None else Message(**row._mapping)
+    return archived[message_uuid]
+
+
+def load_message_or_404(message_uuid: str, include_archived: bool = False) -> Message:
+    message = load_message(message_uuid, include_archived=include_archived)
+    if message is None:
+        abort(404)
+    return message
+
+
+def forget_loaded_messages(exc: Optional[BaseException] = None) -> None:
+    """
+    Clears the messages memoised by `load_message`. Registered to run at the end of
+    every request.
+    """
+    g.pop("loaded_messages", None)
+    g.pop("archived_messages", None)
+
+
+# Settled messages moved out of the message table by `flask archive-messages`. The
+# columns are the same, in the same order, as the message table's; only the indexes
+# needed by the history lookups are kept.
+message_archive = db.Table(
+    "message_archive",
+    *(
+        db.Column(
+            column.name,
+            column.type,
+            primary_key=column.primary_key,
+            nullable=column.nullable,
+        )
+        for column in Message.__table__.columns
+    ),
+    db.Index("message_archive_sender_index", "sender"),
+    db.Index("message_archive_receiver_index", "receiver"),
+    db.Index("message_archive_sender_native_index", "sender_native"),
+    db.Index("message_archive_receiver_native_index", "receiver_native"),
+    db.Index("message_archive_related_message_index", "related_message"),
+)
+
+
+def is_archived(message_uuid: str) -> bool:
+    return (
+        db.session.execute(
+            select(message_archive.c.uuid).where(message_archive.c.uuid == message_uuid)
+        ).first()
+        is not None
+    )
+
+
+def archived_uuids(message_uuids: Collection[str]) -> Set[str]:
+    """
+    Those of the given message UUIDs that are in the archive.
+    """
+    return set(
+        db.session.execute(
+            select(message_archive.c.uuid).where(
+                message_archive.c.uuid.in_(message_uuids)
+            )
+        ).scalars()
+    )
+
+
+def to_archive_criterion(criterion: ColumnElement) -> ColumnElement:
+    """
+    Rewrites a filter on the message table as the same filter on the archive table.
+    """
+
+    def replace(element: Any) -> Optional[Any]:
+        if isinstance(element, db.Column) and element.table is Message.__table__:
+            return message_archive.c[element.name]
+        return None
+
+    return visitors.replacement_traverse(criterion, {}, replace)
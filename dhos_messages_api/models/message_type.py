@@ -1,6 +1,14 @@
-from typing import Dict
+import time
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional
 
+from flask import current_app
 from flask_batteries_included.sqldb import ModelIdentifier, db
+from she_logging import logger
+
+# The value of the callback request message type. Callbacks stay active after they
+# are confirmed, so the active message filters and partial indexes single them out.
+CALLBACK_MESSAGE_TYPE = 5
 
 
 class MessageType(ModelIdentifier, db.Model):
@@ -13,3 +21,51 @@ class MessageType(ModelIdentifier, db.Model):
 
     def to_dict(self) -> Dict:
         return {"value": self.value, **self.pack_identifier()}
+
+
+def refresh_message_types() -> Mapping[int, Mapping]:
+    """
+    Reloads the message type registry of the current app from the database. The
+    registry is an immutable mapping of each type's value to its serialised form.
+    """
+    registry: Mapping[int, Mapping] = MappingProxyType(
+        {
+            message_type.value: MappingProxyType(message_type.to_dict())
+            for message_type in MessageType.query.all()
+        }
+    )
+    current_app.extensions["message_types"] = registry
+    current_app.extensions["message_types_refreshed"] = time.monotonic()
+    logger.debug("Loaded %d message types", len(registry))
+    return registry
+
+
+def message_types() -> Mapping[int, Mapping]:
+    """
+    Returns the message type registry of the current app, loading it on first use.
+    """
+    registry: Optional[Mapping[int, Mapping]] = current_app.extensions.get(
+        "message_types"
+    )
+    if registry is None:
+        registry = refresh_message_types()
+    return registry
+
+
+def get_message_type(value: Optional[int]) -> Optional[Dict]:
+    """
+    Returns the serialised message type with the given value, or None if there is no
+    such type. The registry is reloaded before giving up, so types added since it was
+    loaded are still found, unless it was loaded within the last
+    MESSAGE_TYPES_MIN_REFRESH_SECONDS. Invalid values therefore cannot make every
+    request reload it.
+    """
+    if value is None:
+        return None
+    message_type: Optional[Mapping] = message_types().get(value)
+    if message_type is None:
+        refreshed: float = current_app.extensions["message_types_refreshed"]
+        min_interval: int = current_app.config["MESSAGE_TYPES_MIN_REFRESH_SECONDS"]
+        if time.monotonic() - refreshed >= min_interval:
+            message_type = refresh_message_types().get(value)
+    return None if message_type is None else dict(message_type)
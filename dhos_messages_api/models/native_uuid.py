@@ -0,0 +1,81 @@
+import re
+from typing import Any, Optional
+
+from flask import current_app, has_app_context
+from flask_batteries_included.sqldb import db
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql import operators
+from sqlalchemy.types import String, TypeDecorator
+
+# The text form of a UUID accepted for the native columns. The trigger installed by
+# migration 9f2c6d1e4a73 uses the same pattern, so both agree on which values convert.
+UUID_PATTERN = re.compile(
+    r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$", re.IGNORECASE
+)
+
+# Native 16-byte UUID on Postgres, plain text elsewhere (for the SQLite test database).
+# Values are always strings in Python.
+NativeUUID = db.String().with_variant(postgresql.UUID(as_uuid=False), "postgresql")
+
+
+def is_uuid(value: Any) -> bool:
+    return isinstance(value, str) and UUID_PATTERN.match(value) is not None
+
+
+def to_native_uuid(value: Optional[str]) -> Optional[str]:
+    """
+    Returns the value for the `_native` shadow column of a UUID text column, or None
+    if the text is not a UUID (some participants, e.g. test locations, are not).
+    """
+    if value is None or not is_uuid(value):
+        return None
+    return value.lower()
+
+
+def read_native_uuids() -> bool:
+    return has_app_context() and current_app.config["MESSAGES_READ_NATIVE_UUIDS"]
+
+
+class UUIDText(TypeDecorator):
+    """
+    A text column holding UUIDs that has a native UUID shadow column named
+    `<column>_native`. When MESSAGES_READ_NATIVE_UUIDS is enabled, comparing the
+    column with UUID literals (== and IN) compares the shadow column instead, so
+    queries can move to the native columns without changing any call sites. Other
+    comparisons, and values that are not UUIDs, still use the text column.
+    """
+
+    impl = String
+    cache_ok = True
+
+    class comparator_factory(String.Comparator):
+        def operate(self, op: Any, *other: Any, **kwargs: Any) -> Any:
+            native = self._native_column()
+            if native is not None:
+                if op is operators.eq and is_uuid(other[0]):
+                    return native == other[0]
+                if (
+                    op is operators.in_op
+                    and isinstance(other[0], (list, tuple, set))
+                    and other[0]
+                    and all(is_uuid(value) for value in other[0])
+                ):
+                    return native.in_(other[0])
+            return super().operate(op, *other, **kwargs)
+
+        def _native_column(self) -> Any:
+            return native_column(self.expr)
+
+
+def native_column(column: Any) -> Any:
+    """
+    The native UUID shadow column to compare instead of a UUID text column, or None
+    if MESSAGES_READ_NATIVE_UUIDS is disabled or the column has no shadow.
+    """
+    if not read_native_uuids():
+        return None
+    table = getattr(column, "table", None)
+    name = getattr(column, "name", None)
+    if table is None or name is None:
+        return None
+    return table.c.get("{}_native".format(name))
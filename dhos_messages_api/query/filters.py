@@ -0,0 +1,28 @@
+from typing import Any, Collection
+
+from flask_batteries_included.sqldb import db
+from sqlalchemy import any_, bindparam
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql.elements import ColumnElement
+
+from dhos_messages_api.models.native_uuid import is_uuid, native_column
+
+
+def any_of(column: Any, values: Collection[str]) -> ColumnElement:
+    """
+    Matches rows where the column equals one of the values. On Postgres this is
+    `column = ANY(:values)`, binding the values as a single array so the statement
+    text is the same however many there are; elsewhere it is a plain IN. Like the
+    UUID columns' own IN, it compares the native shadow column when
+    MESSAGES_READ_NATIVE_UUIDS is enabled and every value is a UUID.
+    """
+    if db.engine.dialect.name != "postgresql":
+        return column.in_(values)
+
+    item_type: Any = column.type
+    native = native_column(column)
+    if native is not None and values and all(is_uuid(value) for value in values):
+        column, item_type = native, postgresql.UUID(as_uuid=False)
+    return column == any_(
+        bindparam(None, list(values), type_=postgresql.ARRAY(item_type), unique=True)
+    )
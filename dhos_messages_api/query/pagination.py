@@ -0,0 +1,82 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Query
+
+from dhos_messages_api.models.message import Message, message_entity
+
+
+def encode_cursor(created: datetime, uuid: str) -> str:
+    """
+    Builds an opaque continuation token pointing just past the message with the
+    given (created, uuid) keyset position.
+    """
+    payload: bytes = json.dumps(
+        [created.replace(tzinfo=None).isoformat(), uuid], separators=(",", ":")
+    ).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """
+    Reverses `encode_cursor`. Raises ValueError if the token was not issued by us.
+    """
+    try:
+        padded: str = cursor + "=" * (-len(cursor) % 4)
+        created, uuid = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(created), str(uuid)
+    except (binascii.Error, TypeError, UnicodeError, ValueError):
+        raise ValueError("Invalid pagination cursor '{}'".format(cursor))
+
+
+def page_size(limit: Optional[int]) -> Optional[int]:
+    """
+    Clamps a client-supplied limit to the configured maximum page size.
+    """
+    if limit is None:
+        return None
+    return max(1, min(limit, current_app.config["MESSAGES_MAX_PAGE_SIZE"]))
+
+
+def order_messages(query: Query) -> Query:
+    """
+    Orders a message query newest first, using the uuid as a tie-breaker so that the
+    order is deterministic.
+    """
+    message: Any = message_entity(query)
+    return query.order_by(None).order_by(message.created.desc(), message.uuid.desc())
+
+
+def paginate(
+    query: Query, limit: Optional[int] = None, cursor: Optional[str] = None
+) -> Tuple[List[Any], Optional[str]]:
+    """
+    Orders a message query with `order_messages`, and applies keyset pagination when
+    a limit or cursor is given.
+
+    Returns the selected messages and the cursor for the next page, which is None
+    when there are no more messages.
+    """
+    query = order_messages(query)
+
+    if cursor is not None:
+        created, uuid = decode_cursor(cursor)
+        message: Any = message_entity(query)
+        query = query.filter(tuple_(message.created, message.uuid) < (created, uuid))
+
+    size: Optional[int] = page_size(limit)
+    if size is None:
+        return query.all(), None
+
+    # Fetch one extra row so we know whether another page exists.
+    messages: List[Any] = query.limit(size + 1).all()
+    if len(messages) <= size:
+        return messages, None
+
+    last: Message = messages[size - 1]
+    return messages[:size], encode_cursor(last.created, last.uuid)
@@ -0,0 +1,299 @@
+import re
+from abc import ABC, abstractmethod
+from json.encoder import encode_basestring, encode_basestring_ascii  # type: ignore
+from typing import Any, Callable, Collection, Dict, List, Optional, Tuple
+
+from flask import current_app
+from flask_batteries_included.sqldb import db
+from sqlalchemy import Integer, Text, case, cast, func, literal
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Query
+from sqlalchemy.sql.elements import ColumnElement
+
+from dhos_messages_api.helper.timestamp import format_datetime, format_local_timestamp
+from dhos_messages_api.models.message import Message, message_entity
+from dhos_messages_api.models.message_type import message_types
+
+# How each key of `Message.to_dict` is written:
+# - value: a plain value, null when missing
+# - optional: a plain value, left out when missing
+# - local: a timestamp with its own UTC offset, left out when missing
+# - local_or_null: as local, but null when missing
+# - naive: a timestamp without an offset, left out when missing
+# - utc: a UTC timestamp, null when missing
+# - message_type: the serialised message type
+_VALUE = "value"
+_OPTIONAL = "optional"
+_LOCAL = "local"
+_LOCAL_OR_NULL = "local_or_null"
+_NAIVE = "naive"
+_UTC = "utc"
+_MESSAGE_TYPE = "message_type"
+
+# Key, how it is written, and the column holding its value.
+_KEYS: Dict[str, Tuple[str, str]] = {
+    "cancelled": (_LOCAL, "cancelled"),
+    "cancelled_by": (_OPTIONAL, "cancelled_by"),
+    "confirmed": (_LOCAL_OR_NULL, "confirmed"),
+    "confirmed_by": (_OPTIONAL, "confirmed_by"),
+    "content": (_VALUE, "content"),
+    "created": (_UTC, "created"),
+    "created_by": (_VALUE, "created_by_"),
+    "deleted": (_NAIVE, "deleted"),
+    "internal": (_OPTIONAL, "internal"),
+    "message_type": (_MESSAGE_TYPE, "message_type_id"),
+    "modified": (_UTC, "modified"),
+    "modified_by": (_VALUE, "modified_by_"),
+    "receiver": (_VALUE, "receiver"),
+    "receiver_type": (_VALUE, "receiver_type"),
+    "related_message": (_OPTIONAL, "related_message"),
+    "retrieved": (_LOCAL, "retrieved"),
+    "sender": (_VALUE, "sender"),
+    "sender_type": (_VALUE, "sender_type"),
+    "uuid": (_VALUE, "uuid"),
+}
+
+# Characters that the Flask JSON provider escapes when `ensure_ascii` is set but
+# Postgres writes as they are.
+_NOT_ASCII = re.compile(r"[\x7f-\U0010ffff]")
+
+# Postgres to_char format matching parse_datetime_to_iso8601, without the offset. The
+# year is not zero padded, as strftime("%Y") does not pad it.
+_PG_TIMESTAMP = 'FMYYYY-MM-DD"T"HH24:MI:SS.MS'
+
+
+def _escape_not_ascii(match: Any) -> str:
+    code = ord(match.group())
+    if code < 0x10000:
+        return "\\u{0:04x}".format(code)
+    code -= 0x10000
+    return "\\u{0:04x}\\u{1:04x}".format(0xD800 | (code >> 10), 0xDC00 | (code & 0x3FF))
+
+
+class MessageEncoder(ABC):
+    """
+    Writes message list rows straight to JSON, without building Message instances or
+    dictionaries. The output is byte for byte what `Message.to_dict` followed by the
+    app's JSON provider writes for the same fields, with sorted keys and compact
+    separators.
+
+    `select` turns a message list query into one returning the rows that `encode`
+    expects. The rows keep `created` and `uuid` so they can be paginated.
+    """
+
+    def __init__(self, fields: Optional[Collection[str]] = None) -> None:
+        if fields is None:
+            fields = _KEYS
+        for field in fields:
+            if field not in _KEYS:
+                raise KeyError("Field '{}' not found in schema".format(field))
+        self.keys: List[str] = sorted(set(fields))
+        self.ensure_ascii: bool = current_app.json.ensure_ascii  # type: ignore
+
+    @abstractmethod
+    def select(self, messages: Query) -> Query:
+        ...
+
+    @abstractmethod
+    def encode(self, row: Row) -> str:
+        ...
+
+    def message_type_json(self) -> Dict[int, str]:
+        return {
+            value: current_app.json.dumps(dict(message_type), separators=(",", ":"))
+            for value, message_type in message_types().items()
+        }
+
+
+class CoreMessageEncoder(MessageEncoder):
+    """
+    Selects plain column tuples and writes each row with a plan of key writers that
+    is worked out once per request.
+    """
+
+    def __init__(self, fields: Optional[Collection[str]] = None) -> None:
+        super().__init__(fields)
+        self._columns: List[str] = ["created", "uuid"]
+        self._plan: List[Tuple[str, Callable[[Row], Optional[str]], bool]] = []
+        self._message_types: Dict[int, str] = self.message_type_json()
+        string: Callable[[str], str] = (
+            encode_basestring_ascii if self.ensure_ascii else encode_basestring
+        )
+
+        for key in self.keys:
+            kind, column = _KEYS[key]
+            index: int = self._column_index(column)
+            writer: Callable[[Row], Optional[str]]
+            if kind in (_VALUE, _OPTIONAL):
+                writer = self._value_writer(index, string)
+            elif kind in (_LOCAL, _LOCAL_OR_NULL):
+                writer = self._local_writer(index, self._column_index(column + "_tz"))
+            elif kind == _NAIVE:
+                writer = self._naive_writer(index)
+            elif kind == _UTC:
+                writer = self._utc_writer(index)
+            else:
+                writer = self._message_type_writer(index)
+            optional: bool = kind in (_OPTIONAL, _LOCAL, _NAIVE)
+            self._plan.append((string(key) + ":", writer, optional))
+
+    def _column_index(self, column: str) -> int:
+        if column not in self._columns:
+            self._columns.append(column)
+        return self._columns.index(column)
+
+    @staticmethod
+    def _value_writer(
+        index: int, string: Callable[[str], str]
+    ) -> Callable[[Row], Optional[str]]:
+        return lambda row: None if row[index] is None else string(row[index])
+
+    @staticmethod
+    def _local_writer(index: int, tz_index: int) -> Callable[[Row], Optional[str]]:
+        def write(row: Row) -> Optional[str]:
+            if row[index] is None:
+                return None
+            return '"' + format_local_timestamp(row[index], row[tz_index]) + '"'
+
+        return write
+
+    @staticmethod
+    def _naive_writer(index: int) -> Callable[[Row], Optional[str]]:
+        def write(row: Row) -> Optional[str]:
+            if row[index] is None:
+                return None
+            return '"' + format_datetime(row[index]) + '"'
+
+        return write
+
+    @staticmethod
+    def _utc_writer(index: int) -> Callable[[Row], Optional[str]]:
+        def write(row: Row) -> Optional[str]:
+            if row[index] is None:
+                return None
+            return '"' + format_datetime(row[index]) + 'Z"'
+
+        return write
+
+    def _message_type_writer(self, index: int) -> Callable[[Row], Optional[str]]:
+        return lambda row: self._message_types.get(row[index])
+
+    def select(self, messages: Query) -> Query:
+        message: Any = message_entity(messages)
+        return messages.with_entities(
+            *(getattr(message, column) for column in self._columns)
+        )
+
+    def encode(self, row: Row) -> str:
+        parts: List[str] = []
+        for key, writer, optional in self._plan:
+            value: Optional[str] = writer(row)
+            if value is not None:
+                parts.append(key + value)
+            elif not optional:
+                parts.append(key + "null")
+        return "{" + ",".join(parts) + "}"
+
+
+class PostgresMessageEncoder(MessageEncoder):
+    """
+    Has Postgres build the JSON text of each row, so only one string per message is
+    sent back and nothing is converted in Python. The rows are still joined into the
+    list in Python so that pagination and streaming work as for the other modes.
+    """
+
+    def _string(self, column: ColumnElement) -> ColumnElement:
+        return cast(func.to_json(column), Text)
+
+    def _timestamp(self, value: ColumnElement, suffix: Any) -> ColumnElement:
+        return (
+            literal('"', Text)
+            + func.to_char(value, _PG_TIMESTAMP, type_=Text)
+            + suffix
+            + literal('"', Text)
+        )
+
+    def _local(self, column: ColumnElement, tz: ColumnElement) -> ColumnElement:
+        # As strftime("%z") with a colon added after the hours, so offsets that are
+        # not whole minutes end with their seconds, e.g. "+00:0130".
+        seconds = func.abs(tz)
+        suffix = case(
+            (tz == 0, literal("Z", Text)),
+            else_=case((tz < 0, literal("-", Text)), else_=literal("+", Text))
+            + func.to_char(seconds / 3600, "FM00", type_=Text)
+            + literal(":", Text)
+            + func.to_char(seconds / 60 % 60, "FM00", type_=Text)
+            + case(
+                (seconds % 60 == 0, literal("", Text)),
+                else_=func.to_char(seconds % 60, "FM00", type_=Text),
+            ),
+        )
+        return self._timestamp(
+            column + func.make_interval(0, 0, 0, 0, 0, 0, tz), suffix
+        )
+
+    def _message_type(self, column: ColumnElement) -> ColumnElement:
+        message_type_json: Dict[int, str] = self.message_type_json()
+        if not message_type_json:
+            return literal(None, Text)
+        return case(
+            {
+                literal(value, Integer): literal(text, Text)
+                for value, text in message_type_json.items()
+            },
+            value=column,
+        )
+
+    def row_json(self, message: Any = Message) -> ColumnElement:
+        pieces: List[ColumnElement] = []
+        for key in self.keys:
+            kind, name = _KEYS[key]
+            column: Any = getattr(message, name)
+            value: ColumnElement
+            if kind in (_VALUE, _OPTIONAL):
+                value = self._string(column)
+            elif kind in (_LOCAL, _LOCAL_OR_NULL):
+                value = self._local(column, getattr(message, name + "_tz"))
+            elif kind == _NAIVE:
+                value = self._timestamp(column, literal("", Text))
+            elif kind == _UTC:
+                value = self._timestamp(column, literal("Z", Text))
+            else:
+                value = self._message_type(column)
+            if kind not in (_OPTIONAL, _LOCAL, _NAIVE):
+                value = func.coalesce(value, literal("null", Text))
+            # A piece is NULL when its value is, and concat() skips NULLs, so missing
+            # optional keys drop out along with their comma.
+            pieces.append(literal(",{}:".format(encode_basestring(key)), Text) + value)
+        return (
+            literal("{", Text)
+            + func.substr(func.concat(*pieces), 2)
+            + literal("}", Text)
+        )
+
+    def select(self, messages: Query) -> Query:
+        message: Any = message_entity(messages)
+        return messages.with_entities(
+            self.row_json(message).label("json"), message.created, message.uuid
+        )
+
+    def encode(self, row: Row) -> str:
+        if self.ensure_ascii:
+            return _NOT_ASCII.sub(_escape_not_ascii, row.json)
+        return row.json
+
+
+def message_encoder(
+    serialiser: str, fields: Optional[Collection[str]] = None
+) -> Optional[MessageEncoder]:
+    """
+    Returns the encoder for a message list serialiser, or None for "orm", which
+    serialises Message instances with `to_dict`. Raises KeyError if any field is not a
+    message field. The "postgres" serialiser needs Postgres, and falls back to "core"
+    on other databases.
+    """
+    if serialiser == "orm":
+        return None
+    if serialiser == "postgres" and db.engine.dialect.name == "postgresql":
+        return PostgresMessageEncoder(fields)
+    return CoreMessageEncoder(fields)
@@ -14,3 +14,13 @@ class QueryWithSoftDelete(BaseQuery):
 
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         pass
+
+    def with_deleted(self) -> "QueryWithSoftDelete":
+        """
+        Returns a fresh query on the same model that also includes soft-deleted rows.
+        """
+        return self.__class__(
+            self.column_descriptions[0]["entity"],
+            session=self.session,
+            _with_deleted=True,
+        )
@@ -0,0 +1,36 @@
+"""receiver_modified_index
+
+Revision ID: 1de964d462d1
+Revises: f907f620abdc
+Create Date: 2026-10-17 09:12:44.301422
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "1de964d462d1"
+down_revision = "f907f620abdc"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Build the index without locking out writes to the live table.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "message_receiver_modified_index",
+            "message",
+            ["receiver", "modified"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "message_receiver_modified_index",
+            table_name="message",
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,36 @@
+"""related_message_index
+
+Revision ID: 3b8e2f0c9d41
+Revises: 1de964d462d1
+Create Date: 2026-10-17 15:48:02.517390
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "3b8e2f0c9d41"
+down_revision = "1de964d462d1"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Supports walking down a reply thread by parent message.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f("ix_message_related_message"),
+            "message",
+            ["related_message"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            op.f("ix_message_related_message"),
+            table_name="message",
+            postgresql_concurrently=True,
+        )
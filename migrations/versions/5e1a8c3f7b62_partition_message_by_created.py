@@ -0,0 +1,150 @@
+"""partition_message_by_created
+
+Revision ID: 5e1a8c3f7b62
+Revises: 9f2c6d1e4a73
+Create Date: 2026-10-17 17:41:26.118530
+
+Rebuilds the message table as a table range partitioned by `created`. Existing
+messages are copied in a single INSERT ... SELECT inside the migration's transaction,
+so writes are blocked for the duration: run it in a maintenance window. Afterwards use
+`flask create-partitions` to keep future partitions in place.
+
+A partitioned table's unique constraints must include the partition key, so the
+primary key becomes (uuid, created) and Postgres no longer enforces unique uuids by
+itself. The message_guard_unique_uuid trigger rejects inserts of a uuid that is
+already in the table instead. It checks with a query rather than an index, so two
+concurrent transactions inserting the same uuid can still both succeed.
+
+The partition SQL is inlined rather than imported from the app so that this revision
+keeps working as the app changes. Partitions are monthly, as MESSAGES_PARTITION_MONTHS
+defaults to; `flask create-partitions` only fills gaps, so it works alongside them
+whatever MESSAGES_PARTITION_MONTHS is later set to.
+"""
+from datetime import date
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "5e1a8c3f7b62"
+down_revision = "9f2c6d1e4a73"
+branch_labels = None
+depends_on = None
+
+# Partitions created beyond the current month, as `flask create-partitions` does by
+# default.
+PARTITIONS_AHEAD = 3
+
+GUARD_UNIQUE_UUID = """
+CREATE OR REPLACE FUNCTION message_guard_unique_uuid() RETURNS trigger AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM message WHERE uuid = NEW.uuid) THEN
+        RAISE unique_violation USING MESSAGE = format(
+            'duplicate key value violates unique message uuid %s', NEW.uuid
+        );
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+
+
+def _month(day, months=0):
+    # The first day of the month `months` months after the month of `day`.
+    month_index = day.year * 12 + day.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def _index_definitions():
+    # Every index on the message table except its primary key, to be rebuilt on the
+    # replacement table.
+    return [
+        row[0]
+        for row in op.get_bind().execute(
+            "SELECT indexdef FROM pg_indexes "
+            "WHERE tablename = 'message' AND indexname != 'message_pkey'"
+        )
+    ]
+
+
+def _replace_message_table(create_table, indexes):
+    """
+    Creates the replacement table as message_new, copies the messages into it, swaps
+    it in for the message table and restores its constraints, indexes and trigger.
+    """
+    create_table()
+    op.execute("INSERT INTO message_new SELECT * FROM message")
+    op.execute("DROP TABLE message")
+    op.execute("ALTER TABLE message_new RENAME TO message")
+
+    op.execute(
+        "ALTER TABLE message ADD CONSTRAINT message_message_type_id_fkey "
+        "FOREIGN KEY (message_type_id) REFERENCES message_type (value)"
+    )
+    for indexdef in indexes:
+        op.execute(indexdef)
+    op.execute(
+        "CREATE TRIGGER message_sync_native_uuids BEFORE INSERT OR UPDATE ON message "
+        "FOR EACH ROW EXECUTE FUNCTION message_sync_native_uuids()"
+    )
+
+
+def upgrade():
+    # Unique indexes on a partitioned table must include the partition key. The only
+    # one, on uuid_native, becomes a plain index; the trigger guards uuids instead.
+    indexes = [
+        indexdef.replace("CREATE UNIQUE INDEX", "CREATE INDEX")
+        for indexdef in _index_definitions()
+    ]
+    first = op.get_bind().execute("SELECT min(created) FROM message").scalar()
+    today = date.today()
+
+    def create_table():
+        op.execute(
+            "CREATE TABLE message_new (LIKE message INCLUDING DEFAULTS) "
+            "PARTITION BY RANGE (created)"
+        )
+        op.execute("ALTER TABLE message_new ADD PRIMARY KEY (uuid, created)")
+        start = _month(first.date() if first else today)
+        last = _month(today, PARTITIONS_AHEAD)
+        while start <= last:
+            end = _month(start, 1)
+            op.execute(
+                "CREATE TABLE message_p{:%Y_%m} PARTITION OF message_new "
+                "FOR VALUES FROM ('{}') TO ('{}')".format(
+                    start, start.isoformat(), end.isoformat()
+                )
+            )
+            start = end
+        # Catches anything outside the partitions, e.g. if create-partitions stops running.
+        op.execute("CREATE TABLE message_default PARTITION OF message_new DEFAULT")
+
+    _replace_message_table(create_table, indexes)
+    op.execute("ALTER TABLE message RENAME CONSTRAINT message_new_pkey TO message_pkey")
+    op.execute(GUARD_UNIQUE_UUID)
+    op.execute(
+        "CREATE TRIGGER message_guard_unique_uuid BEFORE INSERT ON message "
+        "FOR EACH ROW EXECUTE FUNCTION message_guard_unique_uuid()"
+    )
+
+
+def downgrade():
+    # The unique primary key on uuid takes over from the trigger.
+    op.execute("DROP TRIGGER message_guard_unique_uuid ON message")
+    op.execute("DROP FUNCTION message_guard_unique_uuid()")
+
+    # Partitioned indexes are listed once for the parent table, named as created.
+    indexes = [
+        indexdef.replace(
+            "CREATE INDEX ix_message_uuid_native",
+            "CREATE UNIQUE INDEX ix_message_uuid_native",
+        ).replace(" ON ONLY ", " ON ")
+        for indexdef in _index_definitions()
+    ]
+
+    def create_table():
+        op.execute("CREATE TABLE message_new (LIKE message INCLUDING DEFAULTS)")
+        op.execute("ALTER TABLE message_new ADD PRIMARY KEY (uuid)")
+
+    _replace_message_table(create_table, indexes)
+    op.execute("ALTER TABLE message RENAME CONSTRAINT message_new_pkey TO message_pkey")
@@ -0,0 +1,93 @@
+"""native_uuid_columns
+
+Revision ID: 9f2c6d1e4a73
+Revises: c41d7a9e5b20
+Create Date: 2026-10-17 16:58:11.602481
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = "9f2c6d1e4a73"
+down_revision = "c41d7a9e5b20"
+branch_labels = None
+depends_on = None
+
+UUID_COLUMNS = ["uuid", "sender", "receiver", "related_message"]
+
+# Must match UUID_PATTERN in dhos_messages_api/models/native_uuid.py.
+TO_UUID = """
+CREATE OR REPLACE FUNCTION message_text_to_uuid(value text) RETURNS uuid AS $$
+    SELECT CASE
+        WHEN value ~* '^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$'
+        THEN value::uuid
+    END
+$$ LANGUAGE sql IMMUTABLE
+"""
+
+SYNC_NATIVE = """
+CREATE OR REPLACE FUNCTION message_sync_native_uuids() RETURNS trigger AS $$
+BEGIN
+    NEW.uuid_native := message_text_to_uuid(NEW.uuid);
+    NEW.sender_native := message_text_to_uuid(NEW.sender);
+    NEW.receiver_native := message_text_to_uuid(NEW.receiver);
+    NEW.related_message_native := message_text_to_uuid(NEW.related_message);
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+
+
+def upgrade():
+    # Nullable columns without defaults, so adding them doesn't rewrite the table.
+    for column in UUID_COLUMNS:
+        op.add_column(
+            "message",
+            sa.Column("{}_native".format(column), postgresql.UUID(), nullable=True),
+        )
+
+    # Keep the native columns in step with every write from here on, whichever
+    # version of the API (or anything else) makes it. Existing rows are filled by
+    # `flask backfill-native-uuids`.
+    op.execute(TO_UUID)
+    op.execute(SYNC_NATIVE)
+    op.execute(
+        "CREATE TRIGGER message_sync_native_uuids BEFORE INSERT OR UPDATE ON message "
+        "FOR EACH ROW EXECUTE FUNCTION message_sync_native_uuids()"
+    )
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f("ix_message_uuid_native"),
+            "message",
+            ["uuid_native"],
+            unique=True,
+            postgresql_concurrently=True,
+        )
+        for column in UUID_COLUMNS[1:]:
+            op.create_index(
+                op.f("ix_message_{}_native".format(column)),
+                "message",
+                ["{}_native".format(column)],
+                unique=False,
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for column in UUID_COLUMNS:
+            op.drop_index(
+                op.f("ix_message_{}_native".format(column)),
+                table_name="message",
+                postgresql_concurrently=True,
+            )
+
+    op.execute("DROP TRIGGER message_sync_native_uuids ON message")
+    op.execute("DROP FUNCTION message_sync_native_uuids()")
+    op.execute("DROP FUNCTION message_text_to_uuid(text)")
+    for column in UUID_COLUMNS:
+        op.drop_column("message", "{}_native".format(column))
@@ -0,0 +1,39 @@
+"""keyset_page_indexes
+
+Revision ID: a4c8e2f61d37
+Revises: d2a6f4b8c913
+Create Date: 2026-10-17 21:03:18.529146
+
+Adds indexes matching the (created, uuid) keyset that paginated receiver and sender
+lists are ordered by, so a page is read in order rather than sorting the whole
+history. As for d2a6f4b8c913, the partitioned table rules out CREATE INDEX
+CONCURRENTLY.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "a4c8e2f61d37"
+down_revision = "d2a6f4b8c913"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "message_receiver_created_index",
+        "message",
+        ["receiver", "created", "uuid"],
+        unique=False,
+    )
+    op.create_index(
+        "message_sender_created_index",
+        "message",
+        ["sender", "created", "uuid"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index("message_sender_created_index", table_name="message")
+    op.drop_index("message_receiver_created_index", table_name="message")
@@ -0,0 +1,37 @@
+"""message_archive
+
+Revision ID: b7d3e9a1c054
+Revises: 5e1a8c3f7b62
+Create Date: 2026-10-17 18:32:04.517903
+
+Adds the archive table that `flask archive-messages` moves settled messages into.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "b7d3e9a1c054"
+down_revision = "5e1a8c3f7b62"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # LIKE keeps the columns in the same order as the message table's, so rows can be
+    # copied across with SELECT *. The archive is a plain table, not partitioned.
+    op.execute("CREATE TABLE message_archive (LIKE message INCLUDING DEFAULTS)")
+    op.execute("ALTER TABLE message_archive ADD PRIMARY KEY (uuid, created)")
+    op.create_index("message_archive_sender_index", "message_archive", ["sender"])
+    op.create_index("message_archive_receiver_index", "message_archive", ["receiver"])
+    op.create_index(
+        "message_archive_sender_native_index", "message_archive", ["sender_native"]
+    )
+    op.create_index(
+        "message_archive_receiver_native_index", "message_archive", ["receiver_native"]
+    )
+
+
+def downgrade():
+    # Put archived messages back rather than losing them with the table.
+    op.execute("INSERT INTO message SELECT * FROM message_archive")
+    op.drop_table("message_archive")
@@ -0,0 +1,27 @@
+"""archive_related_message_index
+
+Revision ID: c3f9b1d7e285
+Revises: a4c8e2f61d37
+Create Date: 2026-10-17 21:41:56.084213
+
+Indexes related_message in the archive, so that message threads can walk down through
+archived replies.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "c3f9b1d7e285"
+down_revision = "a4c8e2f61d37"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "message_archive_related_message_index", "message_archive", ["related_message"]
+    )
+
+
+def downgrade():
+    op.drop_index("message_archive_related_message_index", table_name="message_archive")
@@ -0,0 +1,57 @@
+"""active_partial_indexes
+
+Revision ID: c41d7a9e5b20
+Revises: 3b8e2f0c9d41
+Create Date: 2026-10-17 16:20:37.804113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "c41d7a9e5b20"
+down_revision = "3b8e2f0c9d41"
+branch_labels = None
+depends_on = None
+
+ACTIVE = "deleted IS NULL AND (confirmed IS NULL OR message_type_id = 5)"
+OPEN_CALLBACK = (
+    "deleted IS NULL AND confirmed IS NULL AND cancelled IS NULL"
+    " AND message_type_id = 5"
+)
+
+INDEXES = [
+    ("message_active_receiver_index", ["receiver", "receiver_type"], ACTIVE),
+    ("message_active_sender_index", ["sender", "sender_type"], ACTIVE),
+    (
+        "message_open_callback_receiver_index",
+        ["receiver", "receiver_type"],
+        OPEN_CALLBACK,
+    ),
+    ("message_open_callback_sender_index", ["sender"], OPEN_CALLBACK),
+]
+
+
+def upgrade():
+    # Build the indexes without locking out writes to the live table.
+    with op.get_context().autocommit_block():
+        for name, columns, where in INDEXES:
+            op.create_index(
+                name,
+                "message",
+                columns,
+                unique=False,
+                postgresql_where=sa.text(where),
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, _, _ in INDEXES:
+            op.drop_index(
+                name,
+                table_name="message",
+                postgresql_concurrently=True,
+            )
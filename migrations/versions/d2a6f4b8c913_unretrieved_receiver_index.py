@@ -0,0 +1,34 @@
+"""unretrieved_receiver_index
+
+Revision ID: d2a6f4b8c913
+Revises: b7d3e9a1c054
+Create Date: 2026-10-17 20:14:52.361907
+
+Adds a partial index of each receiver's unretrieved messages for
+POST /dhos/v1/receiver/<receiver_id>/message/retrieved. The message table is
+partitioned, which rules out CREATE INDEX CONCURRENTLY, so each partition is briefly
+locked against writes while its index is built.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "d2a6f4b8c913"
+down_revision = "b7d3e9a1c054"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "message_unretrieved_receiver_index",
+        "message",
+        ["receiver", "receiver_type", "created"],
+        unique=False,
+        postgresql_where=sa.text("deleted IS NULL AND retrieved IS NULL"),
+    )
+
+
+def downgrade():
+    op.drop_index("message_unretrieved_receiver_index", table_name="message")
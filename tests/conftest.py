@@ -1,14 +1,18 @@
 import json
+import os
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Any, Dict, Generator, List, Tuple
+from typing import Any, Callable, ContextManager, Dict, Generator, List, Tuple
 
 import pytest
 from flask import Flask, g
 from flask_batteries_included.sqldb import db
 from pytest_dhos.jwt_permissions import GDM_CLINICIAN_PERMISSIONS
+from sqlalchemy import event
 from sqlalchemy.exc import SQLAlchemyError
 
 from dhos_messages_api.blueprint_api import controller
+from dhos_messages_api.helper.partitions import DEFAULT_PARTITION
 from dhos_messages_api.models.message import Message
 from dhos_messages_api.models.message_type import MessageType
 
@@ -28,16 +32,34 @@ GDM_PATIENT_PERMISSIONS = [
 ]
 
 
+def pytest_configure(config: Any) -> None:
+    config.addinivalue_line(
+        "markers",
+        "postgres: runs against the Postgres database configured by the DATABASE_* "
+        "environment variables rather than SQLite, and is skipped without one",
+    )
+
+
 @pytest.fixture
-def app(mocker: Any) -> Flask:
+def app(mocker: Any, request: Any) -> Generator[Flask, None, None]:
     """Fixture that creates app for testing"""
     from flask_batteries_included.helpers.security import _ProtectedRoute
 
     import dhos_messages_api.app
 
+    use_pgsql: bool = request.node.get_closest_marker("postgres") is not None
+    if use_pgsql and not os.environ.get("DATABASE_HOST"):
+        pytest.skip("Postgres is not configured")
+
     app: Flask = dhos_messages_api.app.create_app(
-        testing=True, use_pgsql=False, use_sqlite=True
+        testing=True, use_pgsql=use_pgsql, use_sqlite=not use_pgsql
     )
+    if use_pgsql:
+        with app.app_context():
+            db.session.execute(
+                "CREATE TABLE {} PARTITION OF message DEFAULT".format(DEFAULT_PARTITION)
+            )
+            db.session.commit()
 
     def mock_claims(self: Any, verify: bool = True) -> Tuple:
         return getattr(g, "jwt_claims", {}), getattr(g, "jwt_scopes", [])
@@ -45,7 +67,12 @@ def app(mocker: Any) -> Flask:
     mocker.patch.object(_ProtectedRoute, "_retrieve_jwt_claims", mock_claims)
     app.config["IGNORE_JWT_VALIDATION"] = False
 
-    return app
+    yield app
+
+    if use_pgsql:
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
 
 
 @pytest.fixture
@@ -54,6 +81,29 @@ def app_context(app: Flask) -> Generator[None, None, None]:
         yield
 
 
+@pytest.fixture
+def sql_statements() -> Callable[[], ContextManager[List[str]]]:
+    """
+    Use this fixture to record the SQL statements run by the database engine, with
+    `with sql_statements() as statements:`. Needs an app context.
+    """
+
+    @contextmanager
+    def record() -> Generator[List[str], None, None]:
+        statements: List[str] = []
+
+        def before_cursor_execute(*args: Any) -> None:
+            statements.append(args[2])
+
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+    return record
+
+
 @pytest.fixture
 def jwt_valid_patient() -> Dict:
     return {"patient_id": "5c4f1d24-2952-4d4e-b1d1-3637e33cc161"}
@@ -187,6 +237,9 @@ def message_types() -> Generator[List[Message], None, None]:
 
     yield message_types
 
+    # Postgres enforces the foreign key from messages to their types.
+    db.session.rollback()
+    db.session.execute(Message.__table__.delete())
     for m in message_types:
         try:
             db.session.delete(m)
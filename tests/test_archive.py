@@ -0,0 +1,214 @@
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from flask_batteries_included.sqldb import db
+from sqlalchemy import select
+
+from dhos_messages_api.blueprint_api import controller
+from dhos_messages_api.blueprint_development.controller import reset_database
+from dhos_messages_api.models.message import Message, message_archive
+
+
+@pytest.mark.usefixtures("message_types", "app", "mock_bearer_validation")
+class TestArchive:
+    def _create_messages(self, message_dict_good: Dict) -> List[Dict]:
+        """
+        Creates a settled message, an unconfirmed message and a confirmed callback,
+        all last modified 60 days ago, and a settled message modified today.
+        """
+        confirmed = "2020-01-01T00:00:00.000Z"
+        messages = [
+            controller.create_message(
+                message_details={**message_dict_good, "confirmed": confirmed}
+            ),
+            controller.create_message(message_details=dict(message_dict_good)),
+            controller.create_message(
+                message_details={
+                    **message_dict_good,
+                    "message_type": {"value": 5},
+                    "confirmed": confirmed,
+                }
+            ),
+        ]
+        table = Message.__table__
+        db.session.execute(
+            table.update().values(modified=datetime.utcnow() - timedelta(days=60))
+        )
+        db.session.commit()
+        messages.append(
+            controller.create_message(
+                message_details={**message_dict_good, "confirmed": confirmed}
+            )
+        )
+        return messages
+
+    def _archive(self, app: Flask) -> None:
+        result = app.test_cli_runner().invoke(
+            args=["archive-messages", "--older-than-days", "30"]
+        )
+        assert "Archived 1 messages" in result.output
+
+    def _archived_uuids(self) -> List[str]:
+        return list(db.session.execute(select(message_archive.c.uuid)).scalars().all())
+
+    def test_archive_messages(
+        self, app: Flask, message_dict_good: Dict, jwt_gdm_clinician_uuid: str
+    ) -> None:
+        messages = self._create_messages(message_dict_good)
+
+        result = app.test_cli_runner().invoke(
+            args=["archive-messages", "--older-than-days", "30", "--batch-size", "1"]
+        )
+
+        assert result.exit_code == 0
+        assert "Archived 1 messages" in result.output
+        assert self._archived_uuids() == [messages[0]["uuid"]]
+        db.session.expire_all()
+        assert {m.uuid for m in Message.query.all()} == {
+            m["uuid"] for m in messages[1:]
+        }
+
+    def test_get_messages_include_archived(
+        self,
+        app: Flask,
+        client: FlaskClient,
+        message_dict_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        self._create_messages(message_dict_good)
+        url = f"/dhos/v1/receiver/{jwt_gdm_clinician_uuid}/message"
+        expected = client.get(url, headers={"Authorization": "Bearer TOKEN"})
+        active_url = f"/dhos/v1/receiver/{jwt_gdm_clinician_uuid}/active/message"
+        expected_active = client.get(
+            active_url, headers={"Authorization": "Bearer TOKEN"}
+        )
+
+        self._archive(app)
+        hot = client.get(url, headers={"Authorization": "Bearer TOKEN"})
+        combined = client.get(
+            f"{url}?include_archived=true", headers={"Authorization": "Bearer TOKEN"}
+        )
+        active = client.get(active_url, headers={"Authorization": "Bearer TOKEN"})
+
+        assert expected.json is not None and hot.json is not None
+        assert len(self._archived_uuids()) == 1
+        assert len(hot.json) == len(expected.json) - 1
+        assert combined.status_code == 200
+        assert combined.json == expected.json
+        assert active.json == expected_active.json
+
+    def test_get_messages_include_archived_paginated(
+        self,
+        app: Flask,
+        client: FlaskClient,
+        message_dict_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        messages = self._create_messages(message_dict_good)
+        self._archive(app)
+
+        uuids: List[str] = []
+        url = (
+            f"/dhos/v1/sender_or_receiver/{jwt_gdm_clinician_uuid}/message"
+            "?include_archived=true&limit=3&fields=uuid"
+        )
+        while True:
+            response = client.get(url, headers={"Authorization": "Bearer TOKEN"})
+            assert response.status_code == 200
+            assert response.json is not None
+            assert all(list(m) == ["uuid"] for m in response.json)
+            uuids.extend(m["uuid"] for m in response.json)
+            next_cursor = response.headers.get("X-Next-Cursor")
+            if next_cursor is None:
+                break
+            url = (
+                f"/dhos/v1/sender_or_receiver/{jwt_gdm_clinician_uuid}/message"
+                f"?include_archived=true&limit=3&fields=uuid&cursor={next_cursor}"
+            )
+
+        assert sorted(uuids) == sorted(m["uuid"] for m in messages)
+
+    def test_reply_to_archived_message(
+        self, app: Flask, message_dict_good: Dict, jwt_gdm_clinician_uuid: str
+    ) -> None:
+        messages = self._create_messages(message_dict_good)
+        self._archive(app)
+
+        reply = controller.create_message(
+            message_details={
+                **message_dict_good,
+                "related_message": messages[0]["uuid"],
+            }
+        )
+
+        assert reply["related_message"] == messages[0]["uuid"]
+
+    def test_get_archived_message(
+        self,
+        app: Flask,
+        client: FlaskClient,
+        message_dict_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        messages = self._create_messages(message_dict_good)
+        url = f"/dhos/v1/message/{messages[0]['uuid']}"
+        expected = client.get(url, headers={"Authorization": "Bearer TOKEN"})
+        self._archive(app)
+
+        response = client.get(url, headers={"Authorization": "Bearer TOKEN"})
+        assert response.status_code == 200
+        assert response.json == expected.json
+        assert response.headers["ETag"] == expected.headers["ETag"]
+
+        # Archived messages are read-only.
+        response = client.patch(
+            url,
+            json={"retrieved": "2020-01-01T00:00:00.000Z"},
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == 404
+
+    def test_archived_message_thread(
+        self,
+        app: Flask,
+        client: FlaskClient,
+        message_dict_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        messages = self._create_messages(message_dict_good)
+        reply = controller.create_message(
+            message_details={
+                **message_dict_good,
+                "related_message": messages[0]["uuid"],
+            }
+        )
+        self._archive(app)
+
+        for message in (messages[0], reply):
+            response = client.get(
+                f"/dhos/v1/message/{message['uuid']}/thread",
+                headers={"Authorization": "Bearer TOKEN"},
+            )
+            assert response.status_code == 200
+            assert response.json is not None
+            assert [m["uuid"] for m in response.json] == [
+                messages[0]["uuid"],
+                reply["uuid"],
+            ]
+
+
+@pytest.mark.postgres
+class TestPostgresArchive(TestArchive):
+    def test_reset_database_empties_archive(
+        self, app: Flask, message_dict_good: Dict, jwt_gdm_clinician_uuid: str
+    ) -> None:
+        self._create_messages(message_dict_good)
+        self._archive(app)
+
+        reset_database()
+
+        assert self._archived_uuids() == []
+        assert Message.query.count() == 0
@@ -0,0 +1,82 @@
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict
+
+import pytest
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from flask.testing import FlaskClient
+from flask_batteries_included.helpers.timestamp import (
+    join_timestamp,
+    parse_datetime_to_iso8601,
+)
+
+from dhos_messages_api.helper.json_provider import OrjsonProvider, init_json_provider
+from dhos_messages_api.helper.timestamp import format_datetime, format_local_timestamp
+
+DATETIMES = [
+    datetime(2020, 1, 2, 3, 4, 5, 999999),
+    datetime(2020, 1, 2, 3, 4, 5),
+    datetime(2020, 1, 2, 3, 4, 5, 123456, tzinfo=timezone.utc),
+    datetime(2020, 1, 2, 3, 4, 5, tzinfo=timezone(timedelta(hours=1))),
+    datetime(2020, 1, 2, 3, 4, 5, tzinfo=timezone(timedelta(hours=-5, minutes=-30))),
+    datetime(2020, 1, 2, 3, 4, 5, tzinfo=timezone(timedelta(seconds=90))),
+    datetime(999, 1, 2, 3, 4, 5),
+]
+
+
+@pytest.mark.parametrize("value", DATETIMES)
+def test_format_datetime(value: datetime) -> None:
+    assert format_datetime(value) == parse_datetime_to_iso8601(value)
+
+
+@pytest.mark.parametrize("offset", [0, 3600, -19800, 90, -86340])
+def test_format_local_timestamp(offset: int) -> None:
+    value = datetime(2020, 12, 31, 23, 59, 59, 999000)
+    assert format_local_timestamp(value, offset) == parse_datetime_to_iso8601(
+        join_timestamp(value, offset)
+    )
+
+
+@pytest.mark.usefixtures("message_types", "app", "mock_bearer_validation")
+class TestOrjsonProvider:
+    @pytest.fixture(autouse=True)
+    def fast_json(self, app: Flask) -> None:
+        pytest.importorskip("orjson")
+        app.config["FAST_JSON"] = True
+        init_json_provider(app)
+
+    def test_dumps_matches_default_provider(self, app: Flask) -> None:
+        value = {
+            "b": DATETIMES,
+            "a": [date(2020, 1, 2), None, True, 1.5, {2: "two", 1: "one"}],
+            "c": ["café", "naïve\u2028", "cake 🍰", "\x7f\x1f"],
+        }
+        default = DefaultJSONProvider(app)
+        assert app.json.dumps(value) == default.dumps(value, separators=(",", ":"))
+        assert app.json.loads(app.json.dumps(value)) == default.loads(
+            default.dumps(value)
+        )
+
+    def test_loads_passes_options_on(self, app: Flask) -> None:
+        assert app.json.loads("[1.5]", parse_float=str) == ["1.5"]
+
+    def test_responses_match_default_provider(
+        self,
+        app: Flask,
+        client: FlaskClient,
+        message_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        url = f"/dhos/v1/receiver/{message_good['receiver']}/message"
+        fast = client.get(url, headers={"Authorization": "Bearer TOKEN"})
+        app.json = DefaultJSONProvider(app)
+        default = client.get(url, headers={"Authorization": "Bearer TOKEN"})
+        assert fast.status_code == 200
+        assert fast.get_data() == default.get_data()
+
+    def test_disabled(self, app: Flask) -> None:
+        assert isinstance(app.json, OrjsonProvider)
+        app.json = DefaultJSONProvider(app)
+        app.config["FAST_JSON"] = False
+        init_json_provider(app)
+        assert type(app.json) is DefaultJSONProvider
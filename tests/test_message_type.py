@@ -0,0 +1,90 @@
+from datetime import datetime
+from typing import Any, Callable, ContextManager, Dict, List
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from flask_batteries_included.sqldb import db
+
+from dhos_messages_api.blueprint_api import controller
+from dhos_messages_api.models.message_type import (
+    MessageType,
+    get_message_type,
+    message_types,
+    refresh_message_types,
+)
+
+
+@pytest.mark.usefixtures("message_types", "app", "mock_bearer_validation")
+class TestMessageTypeRegistry:
+    def test_registry_is_immutable(self, app: Flask) -> None:
+        registry = message_types()
+        assert sorted(registry) == [0, 1, 2, 3, 5, 6, 7, 8]
+        assert registry[1]["uuid"] == "DHOS-MESSAGES-DOSAGE"
+        with pytest.raises(TypeError):
+            registry[1]["value"] = 2  # type: ignore
+
+    def test_create_and_list_without_message_type_queries(
+        self,
+        client: FlaskClient,
+        message_dict_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+        sql_statements: Callable[[], ContextManager[List[str]]],
+    ) -> None:
+        message_types()
+        with sql_statements() as statements:
+            created = controller.create_message(message_details=dict(message_dict_good))
+            response = client.get(
+                f"/dhos/v1/receiver/{message_dict_good['receiver']}/message",
+                headers={"Authorization": "Bearer TOKEN"},
+            )
+
+        assert response.status_code == 200
+        assert response.json is not None
+        assert created["message_type"]["uuid"] == "DHOS-MESSAGES-DOSAGE"
+        assert response.json[0]["message_type"]["value"] == 1
+        assert response.json[0]["message_type"]["uuid"] == "DHOS-MESSAGES-DOSAGE"
+        assert statements
+        assert not any(
+            "JOIN message_type" in statement or "FROM message_type" in statement
+            for statement in statements
+        )
+
+    def test_new_message_type_found_after_refresh(self, app: Flask) -> None:
+        app.config["MESSAGE_TYPES_MIN_REFRESH_SECONDS"] = 0
+        message_types()
+        db.session.add(
+            MessageType(
+                uuid="DHOS-MESSAGES-GREY-ALERT",
+                created=datetime.utcnow(),
+                modified=datetime.utcnow(),
+                value=9,
+            )
+        )
+        db.session.commit()
+
+        message_type = get_message_type(9)
+
+        assert message_type is not None
+        assert message_type["uuid"] == "DHOS-MESSAGES-GREY-ALERT"
+        assert 9 in message_types()
+        assert get_message_type(4) is None
+
+    def test_misses_refresh_at_most_once_per_interval(
+        self,
+        app: Flask,
+        mocker: Any,
+        sql_statements: Callable[[], ContextManager[List[str]]],
+    ) -> None:
+        app.config["MESSAGE_TYPES_MIN_REFRESH_SECONDS"] = 60
+        monotonic = mocker.patch("dhos_messages_api.models.message_type.time").monotonic
+        monotonic.return_value = 1000.0
+        refresh_message_types()
+
+        with sql_statements() as statements:
+            assert get_message_type(4) is None
+            assert get_message_type(4) is None
+            monotonic.return_value = 1060.0
+            assert get_message_type(4) is None
+            assert get_message_type(4) is None
+        assert len(statements) == 1
@@ -0,0 +1,120 @@
+from typing import Any, Dict, List
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from flask_batteries_included.sqldb import db
+from sqlalchemy.dialects import postgresql
+
+from dhos_messages_api.blueprint_api import controller
+from dhos_messages_api.models.message import Message
+from dhos_messages_api.models.native_uuid import to_native_uuid
+from dhos_messages_api.query.filters import any_of
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        (
+            "18439F36-FFA9-42AE-90DE-0BEDA299CD37",
+            "18439f36-ffa9-42ae-90de-0beda299cd37",
+        ),
+        ("18439f36ffa942ae90de0beda299cd37", None),
+        ("1", None),
+        (None, None),
+    ],
+)
+def test_to_native_uuid(value: str, expected: str) -> None:
+    assert to_native_uuid(value) == expected
+
+
+@pytest.mark.usefixtures("message_types", "app", "mock_bearer_validation")
+class TestNativeUuid:
+    def _create_messages(
+        self, message_dict_good: Dict, message_dict_location_one: Dict
+    ) -> List[Dict]:
+        first = controller.create_message(message_details=dict(message_dict_good))
+        return [
+            first,
+            controller.create_message(
+                message_details={
+                    **message_dict_good,
+                    "related_message": first["uuid"],
+                }
+            ),
+            controller.create_message(message_details=dict(message_dict_location_one)),
+        ]
+
+    def test_backfill_native_uuids(
+        self,
+        app: Flask,
+        message_dict_good: Dict,
+        message_dict_location_one: Dict,
+    ) -> None:
+        messages = self._create_messages(message_dict_good, message_dict_location_one)
+        before = {m.uuid: m.modified for m in Message.query.all()}
+
+        result = app.test_cli_runner().invoke(
+            args=["backfill-native-uuids", "--batch-size", "2"]
+        )
+
+        assert result.exit_code == 0
+        assert "Backfilled native UUIDs for 3 messages" in result.output
+        db.session.expire_all()
+        for message in Message.query.all():
+            assert message.uuid_native == message.uuid
+            assert message.sender_native == message.sender
+            assert message.modified == before[message.uuid]
+        by_uuid = {m.uuid: m for m in Message.query.all()}
+        assert (
+            by_uuid[messages[1]["uuid"]].related_message_native == messages[0]["uuid"]
+        )
+        # Location "1" is not a UUID, so it has no native value.
+        assert by_uuid[messages[2]["uuid"]].receiver_native is None
+
+    def test_read_native_uuids(
+        self,
+        app: Flask,
+        client: FlaskClient,
+        message_dict_good: Dict,
+        message_dict_location_one: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        self._create_messages(message_dict_good, message_dict_location_one)
+        app.test_cli_runner().invoke(args=["backfill-native-uuids"])
+        url = f"/dhos/v1/receiver/{jwt_gdm_clinician_uuid}/message"
+        expected = client.get(url, headers={"Authorization": "Bearer TOKEN"})
+
+        app.config["MESSAGES_READ_NATIVE_UUIDS"] = True
+        query = controller.get_messages_by_receiver_uuid(jwt_gdm_clinician_uuid)
+        response = client.get(url, headers={"Authorization": "Bearer TOKEN"})
+
+        assert "message.receiver_native = " in str(query)
+        assert response.status_code == 200
+        assert response.json is not None
+        assert response.json == expected.json
+        assert len(response.json) == 2
+
+    def test_read_native_uuids_not_uuid(
+        self, app: Flask, message_location_one: Dict, jwt_gdm_clinician_uuid: str
+    ) -> None:
+        app.config["MESSAGES_READ_NATIVE_UUIDS"] = True
+        query = Message.query.filter(Message.receiver == "1")
+        assert "message.receiver = " in str(query)
+        assert query.count() == 1
+
+    @pytest.mark.parametrize("read_native", [False, True])
+    def test_any_of_postgres(
+        self, app: Flask, app_context: None, mocker: Any, read_native: bool
+    ) -> None:
+        app.config["MESSAGES_READ_NATIVE_UUIDS"] = read_native
+        uuids = ["18439f36-ffa9-42ae-90de-0beda299cd37"] * 3
+        assert "IN (" in str(any_of(Message.uuid, uuids))
+
+        mocker.patch.object(db.engine.dialect, "name", "postgresql")
+        sql = str(any_of(Message.uuid, uuids).compile(dialect=postgresql.dialect()))
+        column = "uuid_native" if read_native else "uuid"
+        assert sql.startswith(f"message.{column} = ANY (%(param_1)s::")
+        assert "message.uuid = ANY" in str(
+            any_of(Message.uuid, ["1"]).compile(dialect=postgresql.dialect())
+        )
@@ -0,0 +1,178 @@
+import threading
+import time
+from typing import Any, Callable, ContextManager, Dict, Generator, List
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+
+from dhos_messages_api.blueprint_api import controller
+from dhos_messages_api.helper import notifications
+from dhos_messages_api.helper.notifications import LocalBroker, PostgresBroker
+
+
+@pytest.fixture
+def broker(app: Flask) -> Generator[LocalBroker, None, None]:
+    broker = LocalBroker()
+    app.extensions["message_notifications"] = broker
+    yield broker
+    app.extensions["message_notifications"] = None
+
+
+@pytest.mark.usefixtures("message_types", "app", "mock_bearer_validation")
+class TestSyncWait:
+    def _sync(self, client: FlaskClient, receiver: str, **query: object) -> Dict:
+        response = client.get(
+            f"/dhos/v1/receiver/{receiver}/message/sync",
+            query_string=query,
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == 200
+        assert response.json is not None
+        return response.json
+
+    def test_returns_changes_without_waiting(
+        self,
+        client: FlaskClient,
+        broker: LocalBroker,
+        message_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        start = time.monotonic()
+        changes = self._sync(
+            client,
+            message_good["receiver"],
+            since="2000-01-01T00:00:00.000000+00:00",
+            wait=30,
+        )
+        assert [m["uuid"] for m in changes["messages"]] == [message_good["uuid"]]
+        assert time.monotonic() - start < 5
+
+    def test_wait_ends_without_changes(
+        self,
+        app: Flask,
+        client: FlaskClient,
+        broker: LocalBroker,
+        message_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        app.config["MESSAGES_MAX_WAIT_SECONDS"] = 1
+        watermark = self._sync(client, message_good["receiver"])["watermark"]
+
+        start = time.monotonic()
+        changes = self._sync(client, message_good["receiver"], since=watermark, wait=60)
+        assert changes["watermark"] == watermark
+        assert 1 <= time.monotonic() - start < 30
+
+    def test_notification_ends_wait(
+        self,
+        app: Flask,
+        client: FlaskClient,
+        broker: LocalBroker,
+        message_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        watermark = self._sync(client, message_good["receiver"])["watermark"]
+
+        # As for a change that committed late, with `modified` before the watermark.
+        timer = threading.Timer(0.5, broker.deliver, [[message_good["receiver"]]])
+        timer.start()
+        start = time.monotonic()
+        changes = self._sync(client, message_good["receiver"], since=watermark, wait=20)
+        timer.join()
+
+        assert time.monotonic() - start < 10
+        assert [m["uuid"] for m in changes["messages"]] == [message_good["uuid"]]
+        assert changes["watermark"] == watermark
+
+    def test_changes_are_published(
+        self,
+        broker: LocalBroker,
+        message_good: Dict,
+        message_dict_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        with broker.subscribe(message_good["receiver"]) as wait:
+            assert wait(0) is False
+            created = controller.create_message(message_details=dict(message_dict_good))
+            assert wait(0) is True
+            controller.update_message(
+                created["uuid"], {"retrieved": "2018-02-11T11:59:50.123+03:00"}
+            )
+            assert wait(0) is True
+            controller.mark_messages_retrieved(
+                message_good["receiver"], "2099-01-01T00:00:00.000+00:00"
+            )
+            assert wait(0) is True
+            assert wait(0) is False
+
+
+class TestLocalBroker:
+    def test_deliver_wakes_subscribers(self) -> None:
+        broker = LocalBroker()
+        with broker.subscribe("receiver") as wait, broker.subscribe("other") as other:
+            timer = threading.Timer(0.1, broker.deliver, [["receiver"]])
+            timer.start()
+            assert wait(10) is True
+            timer.join()
+            assert other(0) is False
+
+    def test_unsubscribed_participants_are_forgotten(self) -> None:
+        broker = LocalBroker()
+        broker.deliver(["receiver"])
+        with broker.subscribe("receiver") as wait:
+            assert wait(0) is False
+            with broker.subscribe("receiver") as second:
+                broker.deliver(["receiver"])
+                assert second(0) is True
+            assert wait(0) is True
+        assert broker._channels == {}
+
+    def test_deliver_all_wakes_every_subscriber(self) -> None:
+        broker = LocalBroker()
+        with broker.subscribe("receiver") as wait, broker.subscribe("other") as other:
+            broker.deliver_all()
+            assert wait(0) is True
+            assert other(0) is True
+
+
+class _StopListening(BaseException):
+    pass
+
+
+class TestPostgresBroker:
+    def test_listener_closes_failed_connection(self, mocker: Any) -> None:
+        engine = mocker.Mock()
+        connection = engine.raw_connection.return_value.connection
+        connection.cursor.return_value.execute.side_effect = Exception("gone")
+        mocker.patch.object(notifications.time, "sleep", side_effect=_StopListening)
+
+        with pytest.raises(_StopListening):
+            PostgresBroker()._listen(engine)
+        connection.close.assert_called_once_with()
+
+    @pytest.mark.postgres
+    @pytest.mark.usefixtures("message_types", "app_context")
+    def test_publish_keeps_session(
+        self,
+        app: Flask,
+        message_dict_good: Dict,
+        sql_statements: Callable[[], ContextManager[List[str]]],
+    ) -> None:
+        app.extensions["message_notifications"] = PostgresBroker()
+        created = controller.create_messages(
+            messages_details=[dict(message_dict_good) for _ in range(3)]
+        )
+        updates = [
+            {"uuid": result["message"]["uuid"], "changes": {"content": "changed"}}
+            for result in created
+        ]
+        try:
+            with sql_statements() as statements:
+                updated = controller.update_messages(updates)
+        finally:
+            app.extensions["message_notifications"] = None
+
+        assert [message["content"] for message in updated] == ["changed"] * 3
+        # The UUID check and loading the updated messages, but not a reload of each.
+        assert len([s for s in statements if s.startswith("SELECT message.")]) == 2
@@ -0,0 +1,22 @@
+from datetime import datetime
+
+import pytest
+
+from dhos_messages_api.query.pagination import decode_cursor, encode_cursor
+
+
+class TestPagination:
+    def test_cursor_round_trip(self) -> None:
+        created = datetime(2021, 3, 4, 5, 6, 7, 891011)
+        uuid = "18439f36-ffa9-42ae-90de-0beda299cd37"
+        assert decode_cursor(encode_cursor(created, uuid)) == (created, uuid)
+
+    def test_cursor_is_opaque(self) -> None:
+        cursor = encode_cursor(datetime(2021, 3, 4), "18439f36")
+        assert "18439f36" not in cursor
+        assert "=" not in cursor
+
+    @pytest.mark.parametrize("cursor", ["", "rubbish", "W10", "WyJ4IiwieSJd"])
+    def test_invalid_cursor(self, cursor: str) -> None:
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
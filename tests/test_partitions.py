@@ -0,0 +1,189 @@
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Generator
+
+import pytest
+from flask import Flask
+from flask_batteries_included.sqldb import db
+from flask_migrate import downgrade, upgrade
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from dhos_messages_api.helper import partitions
+from dhos_messages_api.helper.partitions import (
+    add_months,
+    create_partition_sql,
+    create_partitions,
+    detach_partitions,
+    list_partitions,
+    partition_name,
+    partition_ranges,
+    period_start,
+)
+
+MIGRATIONS = str(Path(__file__).parents[1] / "migrations")
+
+
+class TestPartitionDates:
+    @pytest.mark.parametrize(
+        "start,months,expected",
+        [
+            (date(2020, 1, 15), 1, date(2020, 2, 1)),
+            (date(2020, 12, 1), 1, date(2021, 1, 1)),
+            (date(2020, 3, 31), -3, date(2019, 12, 1)),
+            (date(2020, 3, 31), 0, date(2020, 3, 1)),
+        ],
+    )
+    def test_add_months(self, start: date, months: int, expected: date) -> None:
+        assert add_months(start, months) == expected
+
+    @pytest.mark.parametrize(
+        "day,months,expected",
+        [
+            (date(2020, 5, 17), 1, date(2020, 5, 1)),
+            (date(2020, 5, 17), 3, date(2020, 4, 1)),
+            (date(2020, 12, 31), 6, date(2020, 7, 1)),
+            (date(2020, 5, 17), 12, date(2020, 1, 1)),
+        ],
+    )
+    def test_period_start(self, day: date, months: int, expected: date) -> None:
+        assert period_start(day, months) == expected
+
+    def test_partition_ranges(self) -> None:
+        assert partition_ranges(date(2020, 11, 20), date(2021, 2, 1), 1) == [
+            (date(2020, 11, 1), date(2020, 12, 1)),
+            (date(2020, 12, 1), date(2021, 1, 1)),
+            (date(2021, 1, 1), date(2021, 2, 1)),
+            (date(2021, 2, 1), date(2021, 3, 1)),
+        ]
+        assert partition_ranges(date(2020, 11, 20), date(2021, 2, 1), 3) == [
+            (date(2020, 10, 1), date(2021, 1, 1)),
+            (date(2021, 1, 1), date(2021, 4, 1)),
+        ]
+
+    def test_create_partition_sql(self) -> None:
+        assert partition_name(date(2021, 1, 1)) == "message_p2021_01"
+        assert create_partition_sql(date(2021, 1, 1), date(2021, 4, 1)) == (
+            "CREATE TABLE IF NOT EXISTS message_p2021_01 PARTITION OF message "
+            "FOR VALUES FROM ('2021-01-01') TO ('2021-04-01')"
+        )
+
+
+class TestPartitionCommands:
+    @pytest.mark.parametrize(
+        "args",
+        [["create-partitions"], ["detach-partitions", "--retain-months", "12"]],
+    )
+    def test_partition_commands_require_postgres(self, app: Flask, args: list) -> None:
+        result = app.test_cli_runner().invoke(args=args)
+        assert result.exit_code != 0
+        assert "only supported on Postgres" in result.output
+
+
+@pytest.mark.postgres
+@pytest.mark.usefixtures("app_context")
+class TestPostgresPartitions:
+    def test_create_partitions(self, app: Flask) -> None:
+        app.config["MESSAGES_PARTITION_MONTHS"] = 1
+        created = create_partitions(ahead=2, today=date(2020, 5, 17))
+        assert created == ["message_p2020_05", "message_p2020_06", "message_p2020_07"]
+        assert list_partitions() == [
+            ("message_p2020_05", datetime(2020, 5, 1), datetime(2020, 6, 1)),
+            ("message_p2020_06", datetime(2020, 6, 1), datetime(2020, 7, 1)),
+            ("message_p2020_07", datetime(2020, 7, 1), datetime(2020, 8, 1)),
+        ]
+
+    def test_create_partitions_skips_covered_periods(self, app: Flask) -> None:
+        app.config["MESSAGES_PARTITION_MONTHS"] = 1
+        create_partitions(ahead=1, today=date(2020, 5, 17))
+        app.config["MESSAGES_PARTITION_MONTHS"] = 3
+        # 2020-04 to 2020-07 overlaps the monthly partitions, so only the quarter
+        # after it is created.
+        assert create_partitions(ahead=1, today=date(2020, 5, 17)) == [
+            "message_p2020_07"
+        ]
+
+    def test_detach_partitions(self, app: Flask, mocker: Any) -> None:
+        app.config["MESSAGES_PARTITION_MONTHS"] = 1
+        create_partitions(ahead=2, today=date(2020, 5, 17))
+        mock_bump = mocker.patch.object(partitions, "bump_all_versions")
+
+        assert detach_partitions(
+            retain_months=1, drop=True, today=date(2020, 7, 10)
+        ) == ["message_p2020_05"]
+        assert [name for name, _, _ in list_partitions()] == [
+            "message_p2020_06",
+            "message_p2020_07",
+        ]
+        assert mock_bump.call_count == 1
+
+        assert detach_partitions(retain_months=1, today=date(2020, 7, 10)) == []
+        assert mock_bump.call_count == 1
+
+    def test_detach_partitions_keeps_table(self, app: Flask, mocker: Any) -> None:
+        app.config["MESSAGES_PARTITION_MONTHS"] = 1
+        create_partitions(ahead=0, today=date(2020, 5, 17))
+        mocker.patch.object(partitions, "bump_all_versions")
+        assert detach_partitions(retain_months=0, today=date(2020, 6, 1)) == [
+            "message_p2020_05"
+        ]
+        assert list_partitions() == []
+        # Detached partitions are plain tables, which drop_all does not know about.
+        db.session.execute(text("DROP TABLE message_p2020_05"))
+        db.session.commit()
+
+
+@pytest.mark.postgres
+@pytest.mark.usefixtures("app_context")
+class TestPostgresPartitionMigration:
+    @pytest.fixture
+    def migrated(self, app: Flask) -> Generator[None, None, None]:
+        db.drop_all()
+        upgrade(directory=MIGRATIONS)
+        yield
+        db.session.remove()
+        db.session.execute(text("DROP SCHEMA public CASCADE"))
+        db.session.execute(text("CREATE SCHEMA public"))
+        db.session.commit()
+
+    def _insert(self, uuid: str, created: str) -> None:
+        db.session.execute(
+            text(
+                "INSERT INTO message (uuid, created, modified, created_by_, "
+                "modified_by_, sender, sender_type, receiver, receiver_type, "
+                "content, message_type_id) VALUES (:uuid, :created, :created, "
+                "'user', 'user', 'sender', 'clinician', 'receiver', 'patient', "
+                "'content', 0)"
+            ),
+            {"uuid": uuid, "created": created},
+        )
+
+    @pytest.mark.usefixtures("migrated")
+    def test_migration_partitions_by_month(self) -> None:
+        names = [name for name, _, _ in list_partitions()]
+        assert names[0] == partition_name(date.today())
+        assert names[-1] == partition_name(add_months(date.today(), 3))
+        assert len(names) == 4
+
+    @pytest.mark.usefixtures("migrated")
+    def test_migration_guards_unique_uuid(self) -> None:
+        self._insert("0c9fc3c0-2a4c-4f0e-a5f6-9b3c3e3a0d01", "2020-01-01")
+        self._insert("0c9fc3c0-2a4c-4f0e-a5f6-9b3c3e3a0d02", "2020-01-01")
+        db.session.commit()
+        with pytest.raises(IntegrityError, match="unique message uuid"):
+            # A different created would otherwise satisfy the (uuid, created) key.
+            self._insert("0c9fc3c0-2a4c-4f0e-a5f6-9b3c3e3a0d01", "2021-01-01")
+        db.session.rollback()
+
+    @pytest.mark.usefixtures("migrated")
+    def test_migration_downgrade(self) -> None:
+        self._insert("0c9fc3c0-2a4c-4f0e-a5f6-9b3c3e3a0d01", "2020-01-01")
+        db.session.commit()
+        downgrade(directory=MIGRATIONS, revision="9f2c6d1e4a73")
+        assert list_partitions() == []
+        assert db.session.execute(text("SELECT count(*) FROM message")).scalar() == 1
+        with pytest.raises(IntegrityError, match="message_pkey"):
+            self._insert("0c9fc3c0-2a4c-4f0e-a5f6-9b3c3e3a0d01", "2021-01-01")
+        db.session.rollback()
+        upgrade(directory=MIGRATIONS)
+        assert db.session.execute(text("SELECT count(*) FROM message")).scalar() == 1
@@ -0,0 +1,163 @@
+import re
+from typing import Callable, Dict, List
+
+import pytest
+from flask_batteries_included.sqldb import db
+from sqlalchemy import literal_column, tuple_
+from sqlalchemy.orm import Query
+
+from dhos_messages_api.blueprint_api import controller
+from dhos_messages_api.models.message import Message
+from dhos_messages_api.query.pagination import order_messages
+
+
+def _literal_sql(query: Query) -> str:
+    return str(
+        query.statement.compile(
+            dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}
+        )
+    )
+
+
+@pytest.mark.usefixtures("message_types", "app")
+class TestSqliteQueryPlans:
+    """
+    Checks the indexes SQLite's planner picks. The partial index predicates are the
+    same on Postgres, which TestPostgresQueryPlans checks.
+    """
+
+    def query_plan(self, query: Query, index: str) -> List[str]:
+        return [
+            row[-1]
+            for row in db.session.execute("EXPLAIN QUERY PLAN " + _literal_sql(query))
+        ]
+
+    @pytest.mark.parametrize(
+        "build_query,index",
+        [
+            (
+                controller.get_active_messages_by_receiver_uuid,
+                "message_active_receiver_index",
+            ),
+            (
+                controller.get_active_messages_by_sender_uuid,
+                "message_active_sender_index",
+            ),
+            (
+                controller.get_active_callback_messages_by_receiver_uuid,
+                "message_open_callback_receiver_index",
+            ),
+        ],
+    )
+    def test_active_queries_use_partial_index(
+        self,
+        jwt_gdm_clinician_uuid: str,
+        message_dict_good: Dict,
+        message_dict_callback: Dict,
+        build_query: Callable[[str], Query],
+        index: str,
+    ) -> None:
+        # Give the planner statistics to choose between the overlapping indexes.
+        for i in range(20):
+            controller.create_message(
+                message_details={**message_dict_good, "receiver": f"receiver-{i}"}
+            )
+            controller.create_message(
+                message_details={**message_dict_callback, "receiver": f"receiver-{i}"}
+            )
+        for _ in range(10):
+            controller.create_message(message_details=dict(message_dict_good))
+        controller.create_message(
+            message_details={
+                **message_dict_callback,
+                "receiver": jwt_gdm_clinician_uuid,
+                "receiver_type": "clinician",
+            }
+        )
+        db.session.execute("ANALYZE")
+
+        plan = self.query_plan(build_query(jwt_gdm_clinician_uuid), index)
+        assert any(index in step for step in plan), plan
+
+    @pytest.mark.parametrize(
+        "build_query,index",
+        [
+            (
+                controller.get_messages_by_receiver_uuid,
+                "message_receiver_created_index",
+            ),
+            (controller.get_messages_by_sender_uuid, "message_sender_created_index"),
+        ],
+    )
+    def test_paginated_queries_use_keyset_index(
+        self,
+        jwt_gdm_clinician_uuid: str,
+        message_dict_good: Dict,
+        build_query: Callable[[str], Query],
+        index: str,
+    ) -> None:
+        for i in range(20):
+            controller.create_message(
+                message_details={
+                    **message_dict_good,
+                    "sender": f"sender-{i}",
+                    "receiver": f"receiver-{i}",
+                }
+            )
+        for _ in range(10):
+            controller.create_message(
+                message_details={
+                    **message_dict_good,
+                    "sender": jwt_gdm_clinician_uuid,
+                    "sender_type": "clinician",
+                }
+            )
+        db.session.execute("ANALYZE")
+
+        # As paginate builds it for a page after the first. The cursor's datetime is
+        # written as a literal, as it cannot be rendered as a literal bind.
+        cursor = tuple_(literal_column("'2100-01-01 00:00:00'"), literal_column("''"))
+        query = (
+            order_messages(build_query(jwt_gdm_clinician_uuid))
+            .filter(tuple_(Message.created, Message.uuid) < cursor)
+            .limit(51)
+        )
+        plan = self.query_plan(query, index)
+        assert any(index in step for step in plan), plan
+        assert not any("ORDER BY" in step or "Sort" in step for step in plan), plan
+
+
+@pytest.mark.postgres
+class TestPostgresQueryPlans(TestSqliteQueryPlans):
+    """
+    Checks that Postgres can answer each query from its partial index, i.e. that the
+    index predicate is implied by the query. The test tables are too small for the
+    planner's choice between indexes to mean anything, so the plain indexes other than
+    the one expected are dropped for the duration and sequential scans disabled.
+    """
+
+    def query_plan(self, query: Query, index: str) -> List[str]:
+        db.session.execute("SET LOCAL enable_seqscan = off")
+        for (name,) in db.session.execute(
+            "SELECT index.relname FROM pg_index "
+            "JOIN pg_class index ON pg_index.indexrelid = index.oid "
+            "JOIN pg_class message ON pg_index.indrelid = message.oid "
+            "WHERE message.relname = 'message' AND pg_index.indpred IS NULL "
+            "AND NOT pg_index.indisprimary AND index.relname != :index",
+            {"index": index},
+        ).fetchall():
+            db.session.execute(f"DROP INDEX {name}")
+        plan: List[str] = [
+            row[0] for row in db.session.execute("EXPLAIN " + _literal_sql(query))
+        ]
+        # Plans name the partitions' indexes, so map them back to the indexes on the
+        # message table that they were created from.
+        for child, parent in db.session.execute(
+            "SELECT child.relname, parent.relname FROM pg_inherits "
+            "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+            "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+            "WHERE child.relkind = 'i'"
+        ):
+            plan = [re.sub(rf"\b{child}\b", parent, step) for step in plan]
+        db.session.rollback()
+        return plan
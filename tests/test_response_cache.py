@@ -0,0 +1,151 @@
+import time
+from typing import Callable, ContextManager, Dict, Generator, List
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+
+from dhos_messages_api.blueprint_api import controller
+from dhos_messages_api.helper.response_cache import LocalCache
+
+
+@pytest.fixture
+def cache(app: Flask) -> Generator[LocalCache, None, None]:
+    cache = LocalCache()
+    app.extensions["response_cache"] = cache
+    yield cache
+    app.extensions["response_cache"] = None
+
+
+@pytest.mark.usefixtures("message_types", "app", "mock_bearer_validation")
+class TestResponseCache:
+    def _get(self, client: FlaskClient, url: str) -> List[Dict]:
+        response = client.get(url, headers={"Authorization": "Bearer TOKEN"})
+        assert response.status_code == 200
+        assert response.json is not None
+        return response.json
+
+    def test_unchanged_list_served_from_cache(
+        self,
+        client: FlaskClient,
+        cache: LocalCache,
+        message_good: Dict,
+        jwt_system: str,
+        sql_statements: Callable[[], ContextManager[List[str]]],
+    ) -> None:
+        url = f"/dhos/v1/receiver/{message_good['receiver']}/message"
+        first = self._get(client, url)
+
+        with sql_statements() as statements:
+            assert self._get(client, url) == first
+        assert statements == []
+        # A different query string is cached separately.
+        with sql_statements() as statements:
+            self._get(client, url + "?limit=1")
+        assert statements
+
+    def test_cached_etag_answers_if_none_match(
+        self,
+        client: FlaskClient,
+        cache: LocalCache,
+        message_good: Dict,
+        jwt_system: str,
+    ) -> None:
+        url = f"/dhos/v1/sender_or_receiver/{message_good['receiver']}/message"
+        etag = client.get(url, headers={"Authorization": "Bearer TOKEN"}).headers[
+            "ETag"
+        ]
+
+        response = client.get(
+            url, headers={"Authorization": "Bearer TOKEN", "If-None-Match": etag}
+        )
+
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+
+    def test_create_and_update_invalidate(
+        self,
+        client: FlaskClient,
+        cache: LocalCache,
+        message_good: Dict,
+        message_dict_good: Dict,
+        jwt_system: str,
+    ) -> None:
+        receiver_url = f"/dhos/v1/receiver/{message_good['receiver']}/message"
+        sender_url = f"/dhos/v1/sender_or_receiver/{message_good['sender']}/message"
+        assert len(self._get(client, receiver_url)) == 1
+        assert len(self._get(client, sender_url)) == 1
+
+        created = controller.create_message(message_details=dict(message_dict_good))
+        assert len(self._get(client, receiver_url)) == 2
+        assert len(self._get(client, sender_url)) == 2
+
+        controller.update_message(
+            created["uuid"], {"confirmed_by": "ac8459b0-6a9a-4e8e-a2de-41c5dd9b81aa"}
+        )
+        assert {
+            message["uuid"]: message.get("confirmed_by")
+            for message in self._get(client, sender_url)
+        }[created["uuid"]] == "ac8459b0-6a9a-4e8e-a2de-41c5dd9b81aa"
+
+    def test_mark_retrieved_invalidates_sender(
+        self,
+        client: FlaskClient,
+        cache: LocalCache,
+        message_good: Dict,
+        jwt_system: str,
+    ) -> None:
+        sender_url = f"/dhos/v1/sender_or_receiver/{message_good['sender']}/message"
+        assert "retrieved" not in self._get(client, sender_url)[0]
+
+        controller.mark_messages_retrieved(
+            message_good["receiver"], "2099-01-01T00:00:00.000+00:00"
+        )
+
+        assert self._get(client, sender_url)[0]["retrieved"]
+
+    def test_stale_while_revalidate(
+        self,
+        app: Flask,
+        client: FlaskClient,
+        cache: LocalCache,
+        message_good: Dict,
+        message_dict_good: Dict,
+        jwt_system: str,
+        sql_statements: Callable[[], ContextManager[List[str]]],
+    ) -> None:
+        app.config["RESPONSE_CACHE_STALE_WHILE_REVALIDATE"] = True
+        url = f"/dhos/v1/receiver/{message_good['receiver']}/message"
+        self._get(client, url)
+        controller.create_message(message_details=dict(message_dict_good))
+        # Another request is refreshing the response.
+        (key,) = [
+            key for key in cache._values if key.startswith("dhos-messages:response:")
+        ]
+        cache.set(key + ":refresh", b"1", nx=True)
+
+        with sql_statements() as statements:
+            assert len(self._get(client, url)) == 1
+        assert statements == []
+
+        cache.delete(key + ":refresh")
+        assert len(self._get(client, url)) == 2
+
+
+class TestLocalCache:
+    def test_set_get_and_expire(self) -> None:
+        cache = LocalCache()
+        assert cache.set("key", b"value", ex=60) is True
+        assert cache.set("key", b"other", nx=True) is None
+        assert cache.mget(["key", "missing"]) == [b"value", None]
+
+        cache.set("short", b"value", ex=0)
+        time.sleep(0.01)
+        assert cache.get("short") is None
+
+    def test_incr(self) -> None:
+        cache = LocalCache()
+        assert cache.incr("counter") == 1
+        assert cache.incr("counter") == 2
+        assert cache.get("counter") == b"2"
+        assert cache.delete("counter", "missing") == 1
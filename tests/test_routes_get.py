@@ -1,7 +1,16 @@
-from typing import Any, Dict
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, ContextManager, Dict, List
 
 import pytest
+from flask import Flask
 from flask.testing import FlaskClient
+from flask_batteries_included.sqldb import db
+from sqlalchemy.orm import Session
+
+from dhos_messages_api.blueprint_api import controller
+from dhos_messages_api.helper.validation import message_validator
+from dhos_messages_api.models.message import Message
 
 
 @pytest.mark.usefixtures("message_types", "app", "mock_bearer_validation")
@@ -181,6 +190,55 @@ class TestGet:
         assert response.json is not None
         assert response.json[0]["receiver"] == message_location_one["receiver"]
 
+    @pytest.mark.parametrize(
+        "unique_id",
+        [
+            "5c4f1d24-2952-4d4e-b1d1-3637e33cc161",
+            "999f1d24-2952-4d4e-b1d1-3637e33cc161",
+        ],
+    )
+    def test_get_messages_by_sender_or_receiver_clinician_query_strategies(
+        self,
+        app: Flask,
+        client: FlaskClient,
+        message_dict_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+        unique_id: str,
+    ) -> None:
+        patient = message_dict_good["sender"]
+        other = "999f1d24-2952-4d4e-b1d1-3637e33cc161"
+        for sender, sender_type, receiver, receiver_type in [
+            (patient, "patient", jwt_gdm_clinician_uuid, "clinician"),
+            (jwt_gdm_clinician_uuid, "clinician", patient, "patient"),
+            (patient, "patient", "1", "location"),
+            (patient, "patient", "3", "location"),
+            (other, "clinician", "1", "location"),
+            (other, "clinician", jwt_gdm_clinician_uuid, "clinician"),
+            ("2", "location", other, "clinician"),
+            (other, "clinician", "3", "location"),
+        ]:
+            controller.create_message(
+                message_details={
+                    **message_dict_good,
+                    "sender": sender,
+                    "sender_type": sender_type,
+                    "receiver": receiver,
+                    "receiver_type": receiver_type,
+                }
+            )
+
+        responses = {}
+        for strategy in ("or", "union"):
+            app.config["CLINICIAN_QUERY_STRATEGY"] = strategy
+            response = client.get(
+                f"/dhos/v1/sender_or_receiver/{unique_id}/message",
+                headers={"Authorization": "Bearer TOKEN", "X-Location-Ids": "1,2"},
+            )
+            assert response.status_code == 200
+            responses[strategy] = response.json
+        assert responses["or"]
+        assert responses["union"] == responses["or"]
+
     def test_get_messages_by_sender_or_receiver_c_to_p(
         self,
         client: FlaskClient,
@@ -264,6 +322,580 @@ class TestGet:
         )
         assert response.status_code == 200
 
+    def test_get_messages_by_receiver_paginated(
+        self,
+        client: FlaskClient,
+        message_dict_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        created = [
+            controller.create_message(message_details=dict(message_dict_good))
+            for _ in range(5)
+        ]
+        expected = sorted(
+            created, key=lambda m: (m["created"], m["uuid"]), reverse=True
+        )
+
+        pages: List[List[Dict]] = []
+        url = f"/dhos/v1/receiver/{message_dict_good['receiver']}/message?limit=2"
+        while True:
+            response = client.get(url, headers={"Authorization": "Bearer TOKEN"})
+            assert response.status_code == 200
+            assert response.json is not None
+            pages.append(response.json)
+            next_cursor = response.headers.get("X-Next-Cursor")
+            if next_cursor is None:
+                break
+            url = (
+                f"/dhos/v1/receiver/{message_dict_good['receiver']}/message"
+                f"?limit=2&cursor={next_cursor}"
+            )
+
+        assert [len(page) for page in pages] == [2, 2, 1]
+        assert [m["uuid"] for page in pages for m in page] == [
+            m["uuid"] for m in expected
+        ]
+
+    def test_get_messages_unpaginated_has_no_cursor(
+        self,
+        client: FlaskClient,
+        message_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        response = client.get(
+            f"/dhos/v1/receiver/{message_good['receiver']}/message",
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == 200
+        assert "X-Next-Cursor" not in response.headers
+
+    def test_get_messages_limit_capped_by_max_page_size(
+        self,
+        app: Flask,
+        client: FlaskClient,
+        message_dict_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        app.config["MESSAGES_MAX_PAGE_SIZE"] = 2
+        for _ in range(3):
+            controller.create_message(message_details=dict(message_dict_good))
+        response = client.get(
+            f"/dhos/v1/receiver/{message_dict_good['receiver']}/message?limit=100",
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == 200
+        assert response.json is not None
+        assert len(response.json) == 2
+        assert "X-Next-Cursor" in response.headers
+
+    def test_get_messages_invalid_cursor(
+        self,
+        client: FlaskClient,
+        message_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        response = client.get(
+            f"/dhos/v1/receiver/{message_good['receiver']}/message?limit=2&cursor=rubbish",
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == 400
+
+    def test_get_messages_by_sender_or_receiver_ordered(
+        self,
+        client: FlaskClient,
+        message_dict_good: Dict,
+        jwt_gdm_patient_uuid: str,
+    ) -> None:
+        created = [
+            controller.create_message(message_details=dict(message_dict_good))
+            for _ in range(3)
+        ]
+        response = client.get(
+            f"/dhos/v1/sender_or_receiver/{message_dict_good['sender']}/message",
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == 200
+        assert response.json is not None
+        assert [m["uuid"] for m in response.json] == [
+            m["uuid"]
+            for m in sorted(
+                created, key=lambda m: (m["created"], m["uuid"]), reverse=True
+            )
+        ]
+
+    @pytest.mark.parametrize("number_messages", [0, 1, 5])
+    def test_get_messages_streamed(
+        self,
+        app: Flask,
+        client: FlaskClient,
+        message_dict_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+        number_messages: int,
+        mocker: Any,
+    ) -> None:
+        spy = mocker.spy(controller, "stream_message_list")
+        for _ in range(number_messages):
+            controller.create_message(message_details=dict(message_dict_good))
+        url = f"/dhos/v1/receiver/{message_dict_good['receiver']}/message"
+        expected = client.get(url, headers={"Authorization": "Bearer TOKEN"})
+
+        app.config["STREAM_LIST_RESPONSES"] = True
+        app.config["STREAM_BATCH_SIZE"] = 2
+        response = client.get(url, headers={"Authorization": "Bearer TOKEN"})
+
+        assert response.status_code == 200
+        assert spy.call_count == 1
+        assert response.mimetype == "application/json"
+        assert response.json == expected.json
+        assert response.get_data() == expected.get_data()
+
+    def test_get_messages_paginated_not_streamed(
+        self,
+        app: Flask,
+        client: FlaskClient,
+        message_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+        mocker: Any,
+    ) -> None:
+        spy = mocker.spy(controller, "stream_message_list")
+        app.config["STREAM_LIST_RESPONSES"] = True
+        response = client.get(
+            f"/dhos/v1/receiver/{message_good['receiver']}/message?limit=1",
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == 200
+        assert spy.call_count == 0
+        assert response.json is not None
+        assert len(response.json) == 1
+
+    @pytest.mark.parametrize("stream", [False, True])
+    def test_get_messages_selected_fields(
+        self,
+        app: Flask,
+        client: FlaskClient,
+        message_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+        stream: bool,
+        sql_statements: Callable[[], ContextManager[List[str]]],
+    ) -> None:
+        url = f"/dhos/v1/receiver/{message_good['receiver']}/message"
+        full = client.get(url, headers={"Authorization": "Bearer TOKEN"}).json
+        assert full is not None
+        app.config["STREAM_LIST_RESPONSES"] = stream
+        with sql_statements() as statements:
+            response = client.get(
+                f"{url}?fields=uuid,sender,confirmed,created",
+                headers={"Authorization": "Bearer TOKEN"},
+            )
+            response.get_data()
+
+        assert response.status_code == 200
+        assert response.json == [
+            {key: full[0][key] for key in ("uuid", "sender", "confirmed", "created")}
+        ]
+        assert len(statements) == 1
+        assert "message.content" not in statements[0]
+        assert "message_type" not in statements[0]
+
+    def test_get_messages_selected_fields_message_type(
+        self, client: FlaskClient, message_good: Dict, jwt_gdm_clinician_uuid: str
+    ) -> None:
+        url = f"/dhos/v1/receiver/{message_good['receiver']}/message"
+        full = client.get(url, headers={"Authorization": "Bearer TOKEN"}).json
+        assert full is not None
+        response = client.get(
+            f"{url}?fields=message_type,content&limit=1",
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == 200
+        assert response.json == [
+            {key: full[0][key] for key in ("message_type", "content")}
+        ]
+
+    def test_get_messages_invalid_field(
+        self, client: FlaskClient, message_good: Dict, jwt_gdm_clinician_uuid: str
+    ) -> None:
+        response = client.get(
+            f"/dhos/v1/receiver/{message_good['receiver']}/message?fields=uuid,password",
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == 400
+
+    def _create_thread(self, message_dict_good: Dict) -> List[Dict]:
+        root = controller.create_message(message_details=dict(message_dict_good))
+        reply = controller.create_message(
+            message_details={**message_dict_good, "related_message": root["uuid"]}
+        )
+        reply_to_reply = controller.create_message(
+            message_details={**message_dict_good, "related_message": reply["uuid"]}
+        )
+        other_reply = controller.create_message(
+            message_details={**message_dict_good, "related_message": root["uuid"]}
+        )
+        controller.create_message(message_details=dict(message_dict_good))
+        return [root, reply, reply_to_reply, other_reply]
+
+    def test_get_message_thread(
+        self,
+        client: FlaskClient,
+        message_dict_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        thread = self._create_thread(message_dict_good)
+        response = client.get(
+            f"/dhos/v1/message/{thread[2]['uuid']}/thread",
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == 200
+        assert response.json is not None
+        assert [m["uuid"] for m in response.json] == [m["uuid"] for m in thread]
+
+    def test_get_message_thread_depth_limit(
+        self,
+        app: Flask,
+        client: FlaskClient,
+        message_dict_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        thread = self._create_thread(message_dict_good)
+        app.config["MESSAGES_MAX_THREAD_DEPTH"] = 1
+        response = client.get(
+            f"/dhos/v1/message/{thread[2]['uuid']}/thread",
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == 200
+        assert response.json is not None
+        assert [m["uuid"] for m in response.json] == [
+            thread[1]["uuid"],
+            thread[2]["uuid"],
+        ]
+
+    def test_get_message_thread_only_own_messages(
+        self,
+        client: FlaskClient,
+        message_dict_good: Dict,
+        jwt_gdm_patient_uuid: str,
+    ) -> None:
+        thread = self._create_thread(message_dict_good)
+        controller.create_message(
+            message_details={
+                **message_dict_good,
+                "sender": "4c4f1d24-2952-4d4e-b1d1-3637e33cc161",
+                "sender_type": "clinician",
+                "receiver": "1",
+                "receiver_type": "location",
+                "related_message": thread[0]["uuid"],
+            }
+        )
+        response = client.get(
+            f"/dhos/v1/message/{thread[0]['uuid']}/thread",
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == 200
+        assert response.json is not None
+        assert [m["uuid"] for m in response.json] == [m["uuid"] for m in thread]
+
+    def test_get_message_by_uuid_single_query(
+        self,
+        client: FlaskClient,
+        message_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+        sql_statements: Callable[[], ContextManager[List[str]]],
+    ) -> None:
+        url = f"/dhos/v1/message/{message_good['uuid']}"
+        with sql_statements() as statements:
+            response = client.get(url, headers={"Authorization": "Bearer TOKEN"})
+
+        assert response.status_code == 200
+        assert len(statements) == 1
+
+        # Nothing is remembered between requests.
+        client.patch(
+            url, json={"confirmed_by": "x"}, headers={"Authorization": "Bearer TOKEN"}
+        )
+        response = client.get(url, headers={"Authorization": "Bearer TOKEN"})
+        assert response.json is not None
+        assert response.json["confirmed_by"] == "x"
+
+    def test_get_message_thread_not_found(
+        self, client: FlaskClient, jwt_gdm_clinician_uuid: str
+    ) -> None:
+        response = client.get(
+            "/dhos/v1/message/7bd0e6ba-97c4-4b8b-8e07-9b6b2b6f3e55/thread",
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == 404
+
+    def test_get_inbox_summary(
+        self,
+        client: FlaskClient,
+        message_dict_good: Dict,
+        message_dict_clinician_good: Dict,
+        message_dict_location_one: Dict,
+        jwt_gdm_patient_uuid: str,
+    ) -> None:
+        controller.create_message(message_details=dict(message_dict_good))
+        reply = controller.create_message(
+            message_details=dict(message_dict_clinician_good)
+        )
+        latest = controller.create_message(
+            message_details=dict(message_dict_location_one)
+        )
+        url = f"/dhos/v1/sender_or_receiver/{jwt_gdm_patient_uuid}/inbox"
+
+        response = client.get(url, headers={"Authorization": "Bearer TOKEN"})
+        assert response.status_code == 200
+        assert "X-Next-Cursor" not in response.headers
+        assert response.json is not None
+        assert [
+            (e["counterparty"], e["counterparty_type"], e["unread"])
+            for e in response.json
+        ] == [("1", "location", 0), (reply["sender"], "clinician", 1)]
+        assert [e["latest_message"]["uuid"] for e in response.json] == [
+            latest["uuid"],
+            reply["uuid"],
+        ]
+        assert (
+            response.json[0]["last_activity"]
+            == response.json[0]["latest_message"]["created"]
+        )
+
+        first_page = client.get(
+            f"{url}?limit=1", headers={"Authorization": "Bearer TOKEN"}
+        )
+        assert first_page.json == response.json[:1]
+        second_page = client.get(
+            f"{url}?limit=1&cursor={first_page.headers['X-Next-Cursor']}",
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert second_page.json == response.json[1:]
+        assert "X-Next-Cursor" not in second_page.headers
+
+    def test_sync_messages_without_watermark(
+        self,
+        client: FlaskClient,
+        message_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        response = client.get(
+            f"/dhos/v1/receiver/{message_good['receiver']}/message/sync",
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == 200
+        assert response.json is not None
+        assert [m["uuid"] for m in response.json["messages"]] == [message_good["uuid"]]
+        assert response.json["deleted"] == []
+        assert response.json["watermark"] is not None
+
+    def test_sync_messages_since_watermark(
+        self,
+        app: Flask,
+        client: FlaskClient,
+        message_dict_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        app.config["MESSAGES_SYNC_OVERLAP_SECONDS"] = 0
+        unchanged, updated, deleted = [
+            controller.create_message(message_details=dict(message_dict_good))
+            for _ in range(3)
+        ]
+        url = f"/dhos/v1/receiver/{message_dict_good['receiver']}/message/sync"
+        first = client.get(url, headers={"Authorization": "Bearer TOKEN"})
+        assert first.json is not None
+        assert len(first.json["messages"]) == 3
+        watermark = first.json["watermark"]
+
+        controller.update_message(
+            updated["uuid"], {"retrieved": "2018-02-11T11:59:50.123+03:00"}
+        )
+        Message.query.filter_by(uuid=deleted["uuid"]).first().delete()
+        db.session.commit()
+        created = controller.create_message(message_details=dict(message_dict_good))
+
+        second = client.get(
+            url,
+            query_string={"since": watermark},
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert second.status_code == 200
+        assert second.json is not None
+        assert [m["uuid"] for m in second.json["messages"]] == [
+            updated["uuid"],
+            created["uuid"],
+        ]
+        assert [m["uuid"] for m in second.json["deleted"]] == [deleted["uuid"]]
+        assert second.json["watermark"] > watermark
+
+        third = client.get(
+            url,
+            query_string={"since": second.json["watermark"]},
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert third.json == {
+            "messages": [],
+            "deleted": [],
+            "watermark": second.json["watermark"],
+        }
+
+        # Recent changes are returned again, in case any committed late.
+        app.config["MESSAGES_SYNC_OVERLAP_SECONDS"] = 30
+        overlap = client.get(
+            url,
+            query_string={"since": second.json["watermark"]},
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert overlap.json is not None
+        assert [m["uuid"] for m in overlap.json["messages"]] == [
+            unchanged["uuid"],
+            updated["uuid"],
+            created["uuid"],
+        ]
+        assert [m["uuid"] for m in overlap.json["deleted"]] == [deleted["uuid"]]
+        assert overlap.json["watermark"] == second.json["watermark"]
+
+    def test_sync_messages_committed_late(
+        self,
+        app: Flask,
+        client: FlaskClient,
+        message_dict_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        url = f"/dhos/v1/receiver/{message_dict_good['receiver']}/message/sync"
+        # A second session stamps its message before the first commits a later one,
+        # but only commits after that one has been synced.
+        late_session = Session(bind=db.engine)
+        late = message_validator().build(dict(message_dict_good))
+        late.created = late.modified = datetime.utcnow()
+        late.created_by_ = late.modified_by_ = jwt_gdm_clinician_uuid
+        time.sleep(0.01)
+        early = controller.create_message(message_details=dict(message_dict_good))
+
+        first = client.get(url, headers={"Authorization": "Bearer TOKEN"})
+        assert first.json is not None
+        assert [m["uuid"] for m in first.json["messages"]] == [early["uuid"]]
+
+        late_session.add(late)
+        late_session.commit()
+        late_uuid = late.uuid
+        late_session.close()
+
+        second = client.get(
+            url,
+            query_string={"since": first.json["watermark"]},
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert second.json is not None
+        assert late_uuid in [m["uuid"] for m in second.json["messages"]]
+        assert second.json["watermark"] == first.json["watermark"]
+
+    def test_sync_messages_invalid_watermark(
+        self,
+        client: FlaskClient,
+        message_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        response = client.get(
+            f"/dhos/v1/receiver/{message_good['receiver']}/message/sync?since=yesterday",
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == 400
+
+    def test_sync_messages_naive_watermark_is_utc(
+        self,
+        app: Flask,
+        client: FlaskClient,
+        monkeypatch: pytest.MonkeyPatch,
+        message_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        app.config["MESSAGES_SYNC_OVERLAP_SECONDS"] = 0
+        since = datetime.utcnow() - timedelta(minutes=1)
+        monkeypatch.setenv("TZ", "America/New_York")
+        time.tzset()
+        try:
+            changes = controller.get_messages_changed_since(
+                message_good["receiver"], since=since
+            )
+        finally:
+            monkeypatch.undo()
+            time.tzset()
+        assert [m["uuid"] for m in changes["messages"]] == [message_good["uuid"]]
+
+        # The API only accepts watermarks with an offset.
+        response = client.get(
+            f"/dhos/v1/receiver/{message_good['receiver']}/message/sync",
+            query_string={"since": since.isoformat()},
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == 400
+
+    def test_get_message_etag(
+        self,
+        client: FlaskClient,
+        message_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        url = f"/dhos/v1/message/{message_good['uuid']}"
+        first = client.get(url, headers={"Authorization": "Bearer TOKEN"})
+        assert first.status_code == 200
+        etag = first.headers["ETag"]
+        assert not etag.startswith("W/")
+
+        not_modified = client.get(
+            url, headers={"Authorization": "Bearer TOKEN", "If-None-Match": etag}
+        )
+        assert not_modified.status_code == 304
+        assert not_modified.data == b""
+        assert not_modified.headers["ETag"] == etag
+
+        controller.update_message(
+            message_good["uuid"],
+            {"confirmed_by": "ac8459b0-6a9a-4e8e-a2de-41c5dd9b81aa"},
+        )
+        modified = client.get(
+            url, headers={"Authorization": "Bearer TOKEN", "If-None-Match": etag}
+        )
+        assert modified.status_code == 200
+        assert modified.headers["ETag"] != etag
+
+    def test_get_messages_by_sender_or_receiver_etag(
+        self,
+        client: FlaskClient,
+        message_good: Dict,
+        message_dict_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+        sql_statements: Callable[[], ContextManager[List[str]]],
+    ) -> None:
+        url = f"/dhos/v1/sender_or_receiver/{message_good['receiver']}/message"
+        first = client.get(url, headers={"Authorization": "Bearer TOKEN"})
+        assert first.status_code == 200
+        etag = first.headers["ETag"]
+        # The ETag depends on the query string as well as the messages.
+        limited = client.get(
+            url,
+            query_string={"limit": 1},
+            headers={"Authorization": "Bearer TOKEN", "If-None-Match": etag},
+        )
+        assert limited.status_code == 200
+
+        with sql_statements() as statements:
+            not_modified = client.get(
+                url, headers={"Authorization": "Bearer TOKEN", "If-None-Match": etag}
+            )
+        assert not_modified.status_code == 304
+        # Only the aggregate query is run.
+        assert len(statements) == 1
+        assert "count(" in statements[0]
+
+        controller.create_message(message_details=dict(message_dict_good))
+        modified = client.get(
+            url, headers={"Authorization": "Bearer TOKEN", "If-None-Match": etag}
+        )
+        assert modified.status_code == 200
+        assert modified.json is not None
+        assert len(modified.json) == 2
+        assert modified.headers["ETag"] != etag
+
 
 def assert_messages_equal(a: Dict, b: Dict) -> None:
     fields_to_ignore = {
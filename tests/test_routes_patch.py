@@ -1,8 +1,10 @@
-from typing import Dict
+from typing import Callable, ContextManager, Dict, List
 
 import pytest
 from flask.testing import FlaskClient
 
+from dhos_messages_api.blueprint_api import controller
+
 
 @pytest.mark.usefixtures("message_types", "app", "mock_bearer_validation")
 class TestPatch:
@@ -205,3 +207,159 @@ class TestPatch:
             headers={"Authorization": "Bearer TOKEN"},
         )
         assert response.status_code == 400
+
+    def test_update_messages(
+        self,
+        client: FlaskClient,
+        message_dict_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+        sql_statements: Callable[[], ContextManager[List[str]]],
+    ) -> None:
+        messages = [
+            controller.create_message(message_details=dict(message_dict_good))
+            for _ in range(3)
+        ]
+        retrieved = "2018-02-11T11:59:50.123+03:00"
+        with sql_statements() as statements:
+            response = client.patch(
+                "/dhos/v1/message",
+                json=[
+                    {"uuid": messages[2]["uuid"], "changes": {"retrieved": retrieved}},
+                    {"uuid": messages[0]["uuid"], "changes": {"retrieved": retrieved}},
+                    {
+                        "uuid": messages[1]["uuid"],
+                        "changes": {
+                            "retrieved": retrieved,
+                            "related_message": messages[0]["uuid"],
+                        },
+                    },
+                ],
+                headers={"Authorization": "Bearer TOKEN"},
+            )
+
+        assert response.status_code == 200
+        assert response.json is not None
+        assert [message["uuid"] for message in response.json] == [
+            messages[2]["uuid"],
+            messages[0]["uuid"],
+            messages[1]["uuid"],
+        ]
+        assert all(message["retrieved"] == retrieved for message in response.json)
+        assert response.json[2]["related_message"] == messages[0]["uuid"]
+        assert len([s for s in statements if s.startswith("UPDATE message ")]) == 2
+        for message in response.json:
+            stored = client.get(
+                f"/dhos/v1/message/{message['uuid']}",
+                headers={"Authorization": "Bearer TOKEN"},
+            )
+            assert stored.json == message
+
+    def test_update_messages_rolls_back_on_error(
+        self,
+        client: FlaskClient,
+        message_good: Dict,
+        message_dict_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        other = controller.create_message(message_details=dict(message_dict_good))
+        response = client.patch(
+            "/dhos/v1/message",
+            json=[
+                {"uuid": message_good["uuid"], "changes": {"confirmed_by": "x"}},
+                {
+                    "uuid": other["uuid"],
+                    "changes": {"related_message": other["uuid"]},
+                },
+            ],
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == 400
+        assert "confirmed_by" not in controller.get_message_by_uuid(
+            message_good["uuid"]
+        )
+
+    @pytest.mark.parametrize(
+        "body",
+        [
+            [{"uuid": "unknown", "changes": {"confirmed_by": "x"}}],
+            [{"uuid": "{uuid}", "changes": {"sender": "x"}}],
+            [{"uuid": "{uuid}", "changes": {}}],
+            [
+                {"uuid": "{uuid}", "changes": {"confirmed_by": "x"}},
+                {"uuid": "{uuid}", "changes": {"confirmed_by": "y"}},
+            ],
+        ],
+    )
+    def test_update_messages_bad(
+        self,
+        client: FlaskClient,
+        message_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+        body: List[Dict],
+    ) -> None:
+        response = client.patch(
+            "/dhos/v1/message",
+            json=[
+                {**item, "uuid": item["uuid"].format(uuid=message_good["uuid"])}
+                for item in body
+            ],
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == (404 if body[0]["uuid"] == "unknown" else 400)
+
+    def test_update_messages_other_clinician(
+        self,
+        client: FlaskClient,
+        message_good: Dict,
+        jwt_gdm_another_clinician_uuid: str,
+    ) -> None:
+        response = client.patch(
+            "/dhos/v1/message",
+            json=[{"uuid": message_good["uuid"], "changes": {"confirmed_by": "x"}}],
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == 403
+
+    def test_update_related_message_queries(
+        self,
+        client: FlaskClient,
+        message_good: Dict,
+        message_dict_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+        sql_statements: Callable[[], ContextManager[List[str]]],
+    ) -> None:
+        reply = controller.create_message(message_details=dict(message_dict_good))
+        with sql_statements() as statements:
+            response = client.patch(
+                f"/dhos/v1/message/{reply['uuid']}",
+                json={"related_message": message_good["uuid"]},
+                headers={"Authorization": "Bearer TOKEN"},
+            )
+
+        assert response.status_code == 200
+        selects = [s for s in statements if s.startswith("SELECT")]
+        # The message for protection and the update, and the related message. The
+        # updated message is serialised without being reloaded.
+        assert len(selects) == 2
+        assert response.json is not None
+        assert response.json["related_message"] == message_good["uuid"]
+
+    def test_update_message_return_minimal(
+        self,
+        client: FlaskClient,
+        message_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        confirmed_by = "ac8459b0-6a9a-4e8e-a2de-41c5dd9b81aa"
+        response = client.patch(
+            f"/dhos/v1/message/{message_good['uuid']}",
+            json={"confirmed_by": confirmed_by},
+            headers={
+                "Authorization": "Bearer TOKEN",
+                "Prefer": "handling=strict, return=minimal",
+            },
+        )
+        assert response.status_code == 204
+        assert response.data == b""
+        message = controller.get_message_by_uuid(message_good["uuid"])
+        assert message["confirmed_by"] == confirmed_by
@@ -1,7 +1,14 @@
-from typing import Dict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, ContextManager, Dict, List
 
 import pytest
+from flask import Flask
 from flask.testing import FlaskClient
+from flask_batteries_included.sqldb import db
+
+from dhos_messages_api.blueprint_api import controller
+from dhos_messages_api.models.message import Message
+from dhos_messages_api.models.message_type import message_types
 
 
 @pytest.mark.usefixtures("message_types", "app", "mock_bearer_validation")
@@ -141,6 +148,149 @@ class TestPost:
             == message_callback["uuid"]
         )
 
+    def test_get_active_callback_messages_for_patients_newest(
+        self,
+        app: Flask,
+        message_dict_callback: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        other_patient = "9c4f1d24-2952-4d4e-b1d1-3637e33cc161"
+        older, newer, confirmed, other = (
+            controller.create_message(message_details=dict(message_dict_callback)),
+            controller.create_message(message_details=dict(message_dict_callback)),
+            controller.create_message(message_details=dict(message_dict_callback)),
+            controller.create_message(
+                message_details={**message_dict_callback, "sender": other_patient}
+            ),
+        )
+        now = datetime.utcnow()
+        for message, age in ((older, 3), (newer, 2), (confirmed, 1)):
+            Message.query.filter_by(uuid=message["uuid"]).update(
+                {"created": now - timedelta(hours=age)}, synchronize_session=False
+            )
+        db.session.commit()
+        controller.update_message(
+            confirmed["uuid"], {"confirmed": "2018-02-11T11:59:50.123+03:00"}
+        )
+        # Patients are looked up one per query, and repeated ones only once.
+        app.config["MESSAGES_PATIENT_CHUNK_SIZE"] = 1
+
+        callbacks = controller.get_active_callback_messages_for_patients(
+            [newer["sender"], other_patient, newer["sender"], "unknown"]
+        )
+
+        assert {sender: callback["uuid"] for sender, callback in callbacks.items()} == {
+            newer["sender"]: newer["uuid"],
+            other_patient: other["uuid"],
+        }
+
+    def test_get_message_counts_by_receiver_uuids(
+        self,
+        client: FlaskClient,
+        message_good: Dict,
+        message_callback: Dict,
+        message_dict_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        confirmed = controller.create_message(message_details=dict(message_dict_good))
+        controller.update_message(
+            confirmed["uuid"],
+            {
+                "confirmed": "2018-02-11T11:59:50.123+03:00",
+                "retrieved": "2018-02-11T11:59:50.123+03:00",
+            },
+        )
+        # Not counted, as the receiver is only counted as a clinician.
+        controller.create_message(
+            message_details={**message_dict_good, "receiver_type": "location"}
+        )
+        response = client.post(
+            "/dhos/v1/message/count",
+            json=[
+                message_good["receiver"],
+                message_callback["receiver"],
+                "f5c3a6c2-0000-4a51-9f6f-6a2b0a0c6e43",
+            ],
+            headers={
+                "Authorization": "Bearer TOKEN",
+                "X-Location-Ids": f"{message_callback['receiver']},"
+                "f5c3a6c2-0000-4a51-9f6f-6a2b0a0c6e43",
+            },
+        )
+        assert response.status_code == 200
+        assert response.json == [
+            {
+                "receiver": message_good["receiver"],
+                "unread": 1,
+                "active": 1,
+                "callback": 0,
+            },
+            {
+                "receiver": message_callback["receiver"],
+                "unread": 1,
+                "active": 1,
+                "callback": 1,
+            },
+            {
+                "receiver": "f5c3a6c2-0000-4a51-9f6f-6a2b0a0c6e43",
+                "unread": 0,
+                "active": 0,
+                "callback": 0,
+            },
+        ]
+
+    @pytest.mark.parametrize("caller", ["jwt_gdm_clinician_uuid", "jwt_system"])
+    def test_get_message_counts_match_lists(
+        self,
+        request: pytest.FixtureRequest,
+        client: FlaskClient,
+        message_good: Dict,
+        message_callback: Dict,
+        message_dict_good: Dict,
+        caller: str,
+    ) -> None:
+        controller.create_message(
+            message_details={**message_dict_good, "receiver_type": "location"}
+        )
+        request.getfixturevalue(caller)
+        headers = {
+            "Authorization": "Bearer TOKEN",
+            "X-Location-Ids": message_callback["receiver"],
+        }
+        receivers = [message_good["receiver"], message_callback["receiver"]]
+        response = client.post(
+            "/dhos/v1/message/count", json=receivers, headers=headers
+        )
+        assert response.status_code == 200
+        assert response.json is not None
+
+        for counts in response.json:
+            url = f"/dhos/v1/receiver/{counts['receiver']}"
+            lists = {
+                name: client.get(f"{url}/{path}", headers=headers)
+                for name, path in [
+                    ("unread", "message"),
+                    ("active", "active/message"),
+                    ("callback", "active/callback/message"),
+                ]
+            }
+            assert all(response.status_code == 200 for response in lists.values())
+            messages = {name: response.json or [] for name, response in lists.items()}
+            unread = [m for m in messages["unread"] if "retrieved" not in m]
+            assert counts["unread"] == len(unread)
+            assert counts["active"] == len(messages["active"])
+            assert counts["callback"] == len(messages["callback"])
+
+    def test_get_message_counts_patient_other_receiver(
+        self, client: FlaskClient, jwt_gdm_patient_uuid: str
+    ) -> None:
+        response = client.post(
+            "/dhos/v1/message/count",
+            json=[jwt_gdm_patient_uuid, "4c4f1d24-2952-4d4e-b1d1-3637e33cc161"],
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == 403
+
     def test_post_message_v2_clinician(
         self,
         client: FlaskClient,
@@ -168,3 +318,212 @@ class TestPost:
             headers={"Authorization": "Bearer TOKEN"},
         )
         assert response.status_code == 400
+
+    def test_post_message_v2_statements(
+        self,
+        client: FlaskClient,
+        message_dict_clinician_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+        sql_statements: Callable[[], ContextManager[List[str]]],
+    ) -> None:
+        message_types()
+        with sql_statements() as statements:
+            response = client.post(
+                "/dhos/v2/message",
+                json=message_dict_clinician_good,
+                headers={"Authorization": "Bearer TOKEN"},
+            )
+
+        assert response.status_code == 200
+        assert response.json is not None
+        assert response.json["content"] == message_dict_clinician_good["content"]
+        # The new message is serialised from memory rather than reloaded.
+        assert [statement.split()[0] for statement in statements] == ["INSERT"]
+
+    def test_post_message_v2_keeps_builtin_properties(
+        self,
+        client: FlaskClient,
+        message_dict_good: Dict,
+        jwt_system: str,
+    ) -> None:
+        builtin = {
+            "created": "2020-01-01T10:00:00.123+01:00",
+            "created_by_": "fixture-creator",
+            "modified_by_": "fixture-modifier",
+        }
+        response = client.post(
+            "/dhos/v2/message",
+            json={**message_dict_good, **builtin},
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == 200
+        assert response.json is not None
+        assert response.json["created"] == "2020-01-01T09:00:00.123Z"
+        assert response.json["created_by"] == "fixture-creator"
+        assert response.json["modified_by"] == "fixture-modifier"
+        # Not sent, so set as usual.
+        assert response.json["modified"] > "2020"
+
+        stored = client.get(
+            f"/dhos/v1/message/{response.json['uuid']}",
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert stored.json == response.json
+
+    def test_post_message_v2_return_minimal(
+        self,
+        client: FlaskClient,
+        message_dict_clinician_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        response = client.post(
+            "/dhos/v2/message",
+            json=message_dict_clinician_good,
+            headers={"Authorization": "Bearer TOKEN", "Prefer": "return=minimal"},
+        )
+        assert response.status_code == 204
+        assert response.data == b""
+        assert response.headers["Preference-Applied"] == "return=minimal"
+        assert (
+            Message.query.filter_by(
+                content=message_dict_clinician_good["content"]
+            ).count()
+            == 1
+        )
+
+    def test_post_message_batch_clinician(
+        self,
+        client: FlaskClient,
+        message_dict_clinician_good: Dict,
+        message_dict_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        response = client.post(
+            "/dhos/v2/message/batch",
+            json=[
+                message_dict_clinician_good,
+                {**message_dict_clinician_good, "content": ""},
+                message_dict_good,
+                {**message_dict_clinician_good, "message_type": {"value": 99}},
+                {**message_dict_clinician_good, "content": "second"},
+            ],
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == 200
+        assert response.json is not None
+        assert [result["status"] for result in response.json] == [
+            200,
+            400,
+            403,
+            400,
+            200,
+        ]
+        assert "content" in response.json[1]["error"]
+        assert response.json[4]["message"]["content"] == "second"
+        for result in (response.json[0], response.json[4]):
+            stored = client.get(
+                f"/dhos/v1/message/{result['message']['uuid']}",
+                headers={"Authorization": "Bearer TOKEN"},
+            )
+            assert stored.json == result["message"]
+
+    def test_post_message_batch_system(
+        self,
+        client: FlaskClient,
+        message_dict_clinician_good: Dict,
+        message_dict_good: Dict,
+        jwt_system: str,
+        sql_statements: Callable[[], ContextManager[List[str]]],
+    ) -> None:
+        with sql_statements() as statements:
+            response = client.post(
+                "/dhos/v2/message/batch",
+                json=[message_dict_clinician_good, message_dict_good] * 3,
+                headers={"Authorization": "Bearer TOKEN"},
+            )
+
+        assert response.status_code == 200
+        assert response.json is not None
+        assert [result["status"] for result in response.json] == [200] * 6
+        inserts = [s for s in statements if s.startswith("INSERT INTO message ")]
+        assert len(inserts) == 1
+
+    def test_post_message_batch_wrong_types(
+        self,
+        client: FlaskClient,
+        message_dict_good: Dict,
+        jwt_system: str,
+    ) -> None:
+        response = client.post(
+            "/dhos/v2/message/batch",
+            json=[
+                {**message_dict_good, "content": 5},
+                message_dict_good,
+                {**message_dict_good, "message_type": "x"},
+            ],
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == 200
+        assert response.json is not None
+        assert [result["status"] for result in response.json] == [400, 200, 400]
+        assert Message.query.count() == 1
+
+    def test_post_message_batch_too_large(
+        self,
+        app: Flask,
+        client: FlaskClient,
+        message_dict_good: Dict,
+        jwt_system: str,
+    ) -> None:
+        app.config["MESSAGES_MAX_BATCH_SIZE"] = 1
+        response = client.post(
+            "/dhos/v2/message/batch",
+            json=[message_dict_good, message_dict_good],
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == 400
+
+    def test_mark_messages_retrieved(
+        self,
+        client: FlaskClient,
+        message_dict_good: Dict,
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        earlier = "2018-02-11T11:59:50.123+03:00"
+        read = [
+            controller.create_message(message_details=dict(message_dict_good)),
+            controller.create_message(message_details=dict(message_dict_good)),
+        ]
+        already = controller.create_message(
+            message_details={**message_dict_good, "retrieved": earlier}
+        )
+        retrieved = datetime.now(tz=timezone(timedelta(hours=1))).isoformat(
+            timespec="milliseconds"
+        )
+        unread = controller.create_message(message_details=dict(message_dict_good))
+        Message.query.filter_by(uuid=unread["uuid"]).update(
+            {"created": datetime.utcnow() + timedelta(minutes=1)}
+        )
+        response = client.post(
+            f"/dhos/v1/receiver/{jwt_gdm_clinician_uuid}/message/retrieved",
+            json={"retrieved": retrieved},
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == 200
+        assert response.json == {"receiver": jwt_gdm_clinician_uuid, "updated": 2}
+        for message in read:
+            stored = controller.get_message_by_uuid(message["uuid"])
+            assert stored["retrieved"].isoformat(timespec="milliseconds") == retrieved
+        stored = controller.get_message_by_uuid(already["uuid"])
+        assert stored["retrieved"].isoformat(timespec="milliseconds") == earlier
+        assert "retrieved" not in controller.get_message_by_uuid(unread["uuid"])
+
+    def test_mark_messages_retrieved_other_receiver(
+        self, client: FlaskClient, message_good: Dict, jwt_gdm_patient_uuid: str
+    ) -> None:
+        response = client.post(
+            f"/dhos/v1/receiver/{message_good['receiver']}/message/retrieved",
+            json={"retrieved": "2018-02-11T11:59:50.123+03:00"},
+            headers={"Authorization": "Bearer TOKEN"},
+        )
+        assert response.status_code == 403
@@ -8,6 +8,7 @@ from flask.testing import FlaskClient
 from dhos_messages_api.helper.security import (
     create_message_protection_base,
     message_by_id_protection,
+    receiver_list_protection,
     sender_or_receiver_protection,
     sender_receiver_protection,
     user_type_to_validate,
@@ -192,6 +193,20 @@ class TestSecurity:
             is False
         )
 
+    def test_receiver_list_protection_good(self, app: Flask) -> None:
+        jwt_claims = {"clinician_id": "11111111"}
+        with app.test_request_context(
+            json=["11111111", "2"], headers={"X-Location-Ids": "1,2"}
+        ):
+            assert receiver_list_protection(jwt_claims, None) is True
+
+    def test_receiver_list_protection_bad(self, app: Flask) -> None:
+        jwt_claims = {"clinician_id": "11111111"}
+        with app.test_request_context(
+            json=["11111111", "3"], headers={"X-Location-Ids": "1,2"}
+        ):
+            assert receiver_list_protection(jwt_claims, None) is False
+
     def test_user_type_to_validate_patient(self) -> None:
         jwt_claims = {"patient_id": "7"}
         assert user_type_to_validate("7", jwt_claims) == "patient"
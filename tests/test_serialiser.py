@@ -0,0 +1,159 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Type
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from flask_batteries_included.sqldb import db
+from sqlalchemy.dialects import postgresql
+
+from dhos_messages_api.blueprint_api import controller
+from dhos_messages_api.models.message import Message
+from dhos_messages_api.query.serialiser import (
+    CoreMessageEncoder,
+    MessageEncoder,
+    PostgresMessageEncoder,
+    message_encoder,
+)
+
+
+@pytest.mark.usefixtures("message_types", "app", "mock_bearer_validation")
+class TestSerialiser:
+    serialiser = "core"
+    encoder: Type[MessageEncoder] = CoreMessageEncoder
+
+    @pytest.fixture
+    def messages(self, message_dict_good: Dict) -> List[Dict]:
+        created = [
+            controller.create_message(message_details=dict(message_dict_good)),
+            controller.create_message(
+                message_details={
+                    **message_dict_good,
+                    "content": 'Café ☕ "quoted"\n\U0001f600 \x7f',
+                    "retrieved": "2020-01-01T10:00:00.123+01:00",
+                    "confirmed": "2020-01-01T10:00:01.999-05:30",
+                    "confirmed_by": "18439f36-ffa9-42ae-90de-0beda299cd37",
+                    "internal": "note",
+                }
+            ),
+            controller.create_message(
+                message_details={
+                    **message_dict_good,
+                    "message_type": {"value": 5},
+                    "cancelled": "2020-01-01T10:00:00.000Z",
+                    "cancelled_by": "18439f36-ffa9-42ae-90de-0beda299cd37",
+                }
+            ),
+        ]
+        # Offsets that are not whole minutes and years before 1000 are formatted
+        # differently by isoformat, so are worth covering.
+        Message.query.filter_by(uuid=created[1]["uuid"]).update(
+            {"retrieved_tz": -90, "confirmed_tz": 3690}
+        )
+        Message.query.filter_by(uuid=created[2]["uuid"]).update(
+            {"cancelled": datetime(999, 1, 2, 3, 4, 5, 678000)}
+        )
+        db.session.commit()
+        return created
+
+    def _get(
+        self,
+        app: Flask,
+        client: FlaskClient,
+        serialiser: str,
+        url: str,
+        stream: bool = False,
+    ) -> bytes:
+        app.config["MESSAGES_SERIALISER"] = serialiser
+        app.config["STREAM_LIST_RESPONSES"] = stream
+        response = client.get(url, headers={"Authorization": "Bearer TOKEN"})
+        assert response.status_code == 200
+        return response.get_data()
+
+    @pytest.mark.parametrize("stream", [False, True])
+    @pytest.mark.parametrize(
+        "query",
+        [
+            "",
+            "?fields=uuid,confirmed,retrieved,content,message_type",
+            "?fields=created,modified,created_by,internal,deleted",
+            "?limit=2",
+            "?include_archived=true",
+        ],
+    )
+    def test_parity_with_orm(
+        self,
+        app: Flask,
+        client: FlaskClient,
+        messages: List[Dict],
+        jwt_gdm_clinician_uuid: str,
+        stream: bool,
+        query: str,
+    ) -> None:
+        url = f"/dhos/v1/receiver/{jwt_gdm_clinician_uuid}/message{query}"
+        expected = self._get(app, client, "orm", url, stream=stream)
+        actual = self._get(app, client, self.serialiser, url, stream=stream)
+        assert actual == expected
+        cafe: bytes = (
+            b"Caf\\u00e9"
+            if getattr(app.json, "ensure_ascii", True)
+            else "Café".encode()
+        )
+        assert cafe in actual or b"content" not in actual
+
+    def test_paginated_parity_with_orm(
+        self,
+        app: Flask,
+        client: FlaskClient,
+        messages: List[Dict],
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        url = f"/dhos/v1/receiver/{jwt_gdm_clinician_uuid}/message?limit=1"
+        for serialiser in ["orm", "core"]:
+            app.config["MESSAGES_SERIALISER"] = serialiser
+            response = client.get(url, headers={"Authorization": "Bearer TOKEN"})
+            cursor: Optional[str] = response.headers["X-Next-Cursor"]
+            pages: List[bytes] = [response.get_data()]
+            while cursor is not None:
+                response = client.get(
+                    f"{url}&cursor={cursor}", headers={"Authorization": "Bearer TOKEN"}
+                )
+                pages.append(response.get_data())
+                cursor = response.headers.get("X-Next-Cursor")
+            if serialiser == "orm":
+                expected = pages
+        assert len(pages) == 3
+        assert pages == expected
+
+    def test_serialiser_per_endpoint(
+        self,
+        app: Flask,
+        client: FlaskClient,
+        messages: List[Dict],
+        jwt_gdm_clinician_uuid: str,
+    ) -> None:
+        url = f"/dhos/v1/receiver/{jwt_gdm_clinician_uuid}/message?fields=password"
+        app.config["MESSAGES_SERIALISER_ENDPOINTS"] = {
+            "get_messages_by_receiver_uuid": self.serialiser
+        }
+        response = client.get(url, headers={"Authorization": "Bearer TOKEN"})
+        assert response.status_code == 400
+        assert isinstance(message_encoder(self.serialiser), self.encoder)
+        assert message_encoder("orm") is None
+
+    def test_encoder_is_abstract(self) -> None:
+        with pytest.raises(TypeError):
+            MessageEncoder()  # type: ignore
+
+    def test_postgres_row_json(self, app: Flask) -> None:
+        query = PostgresMessageEncoder().select(Message.query)
+        sql = str(query.statement.compile(dialect=postgresql.dialect()))
+        assert "to_json(message.content)" in sql
+        assert "concat(" in sql
+        assert "CASE message.message_type_id" in sql
+
+
+@pytest.mark.postgres
+class TestPostgresSerialiser(TestSerialiser):
+    serialiser = "postgres"
+    encoder = PostgresMessageEncoder
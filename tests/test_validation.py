@@ -0,0 +1,69 @@
+from typing import Dict
+
+import pytest
+from flask import Flask
+
+from dhos_messages_api.helper.validation import message_validator
+
+
+@pytest.mark.usefixtures("message_types", "app")
+class TestMessageValidator:
+    def test_required_properties_come_from_api_spec(self) -> None:
+        assert message_validator().required == (
+            "sender",
+            "sender_type",
+            "receiver",
+            "receiver_type",
+            "message_type",
+            "content",
+        )
+
+    def test_compiled_once(self, app: Flask) -> None:
+        assert message_validator() is app.extensions["message_validator"]
+        assert message_validator() is message_validator()
+
+    def test_build(self, message_dict_good: Dict) -> None:
+        message = message_validator().build({**message_dict_good, "internal": "yes"})
+        assert message.uuid is not None
+        assert message.message_type_id == 1
+        assert message.internal == "yes"
+
+    @pytest.mark.parametrize(
+        "changes,error",
+        [
+            ({"colour": "blue"}, "Property 'colour' not found in schema"),
+            ({"sender": ""}, "Property 'sender' must contain a valid value"),
+            ({"sender": None}, "Property 'sender' must contain a valid value"),
+            (
+                {"internal": ""},
+                "Empty fields should not be sent, property 'internal' is empty",
+            ),
+            (
+                {"message_type": {"value": 4}},
+                "Property 'message_type' must contain a valid value, 4 received",
+            ),
+            (
+                {"related_message": "not-a-message"},
+                "Cannot set 'related_message' as 'not-a-message' is an invalid value.",
+            ),
+            # An unknown property takes precedence over everything else.
+            (
+                {"internal": "", "colour": "blue"},
+                "Property 'colour' not found in schema",
+            ),
+            # A missing required property takes precedence over an invalid one.
+            (
+                {"internal": "", "content": ""},
+                "Property 'content' must contain a valid value",
+            ),
+            # Otherwise the first invalid property sent is reported.
+            (
+                {"related_message": "not-a-message", "internal": ""},
+                "Cannot set 'related_message' as 'not-a-message' is an invalid value.",
+            ),
+        ],
+    )
+    def test_errors(self, message_dict_good: Dict, changes: Dict, error: str) -> None:
+        with pytest.raises(KeyError) as e:
+            message_validator().build({**message_dict_good, **changes})
+        assert e.value.args[0] == error